@@ -24,13 +24,18 @@
 $Id: BenchRunner.py 24746 2005-08-31 09:59:27Z bdelbosc $
 """
 import os
+import logging
+import multiprocessing
 import platform
+import random
+import select
 import sys
 import threading
 import time
 import traceback
 import unittest
 from datetime import datetime
+from Queue import Queue, Empty
 from optparse import OptionParser, TitledHelpFormatter
 from socket import error as SocketError
 from thread import error as ThreadError
@@ -39,8 +44,9 @@ import signal
 
 from FunkLoadTestCase import FunkLoadTestCase
 from FunkLoadHTTPServer import FunkLoadHTTPServer
+from ResultFile import AsyncResultHandler
 from utils import mmn_encode, set_recording_flag, recording, thread_sleep, \
-                  trace, red_str, green_str, get_version
+                  trace, red_str, green_str, get_version, set_active_cvus
 try:
     from funkload.rtfeedback import (FeedbackSender, DEFAULT_ENDPOINT,
                                      DEFAULT_PUBSUB)
@@ -87,32 +93,6 @@ except ImportError:
 # ------------------------------------------------------------
 # utils
 #
-g_failures = 0                      # result of the bench
-g_errors = 0                        # result of the bench
-g_success = 0
-
-
-def add_cycle_result(status):
-    """Count number of result."""
-    # XXX use a thread.lock, but we don't mind if it is not accurate
-    # as the report use the xml log
-    global g_success, g_failures, g_errors
-    if status == 'success':
-        g_success += 1
-    elif status == 'error':
-        g_errors += 1
-    else:
-        g_failures += 1
-
-    return g_success, g_errors, g_failures
-
-
-def get_cycle_results():
-    """Return counters."""
-    global g_success, g_failures, g_errors
-    return g_success, g_failures, g_errors
-
-
 def get_status(success, failures, errors, color=False):
     """Return a status and an exit code."""
     if errors:
@@ -133,17 +113,9 @@ def get_status(success, failures, errors, color=False):
     return status, code
 
 
-def reset_cycle_results():
-    """Clear the previous results."""
-    global g_success, g_failures, g_errors
-    g_success = g_failures = g_errors = 0
-
-
 def load_module(test_module):
     module = __import__(test_module)
-    parts = test_module.split('.')[1:]
-    while parts:
-        part = parts.pop()
+    for part in test_module.split('.')[1:]:
         module = getattr(module, part)
     return module
 
@@ -158,9 +130,13 @@ def load_unittest(test_module, test_class, test_name, options):
 class ThreadSignaller:
     """
     A simple class to signal whether a thread should continue running or stop.
+
+    The gate is an optional event shared by the threads of a bench, threads
+    wait for it between two tests so they can be paused between cycles.
     """
-    def __init__(self):
+    def __init__(self, gate=None):
         self.keep_running = True
+        self.gate = gate
 
     def running(self):
         return self.keep_running
@@ -168,6 +144,43 @@ class ThreadSignaller:
     def set_running(self, val):
         self.keep_running = val
 
+    def wait(self):
+        """Block while the threads are paused, return True if paused."""
+        if self.gate is None or self.gate.isSet():
+            return False
+        self.gate.wait()
+        return True
+
+
+class ResultCounter:
+    """Count the recorded results of a loop runner.
+
+    A counter is only updated by the thread of its runner, the bench sums
+    the counters of its runners so there is no need for a lock."""
+    def __init__(self):
+        self.success = self.failures = self.errors = 0
+
+    def add(self, status):
+        """Count a result, return the number of results with this status."""
+        if status == 'success':
+            self.success += 1
+            return self.success
+        elif status == 'error':
+            self.errors += 1
+            return self.errors
+        self.failures += 1
+        return self.failures
+
+    def get(self):
+        return self.success, self.failures, self.errors
+
+
+def add_results(totals, results):
+    """Add success, failures and errors results to the totals list."""
+    for i in range(3):
+        totals[i] += results[i]
+    return totals
+
 
 class ThreadData:
     """Container for thread related data."""
@@ -181,14 +194,21 @@ class ThreadData:
 # Classes
 #
 class LoopTestRunner(threading.Thread):
-    """Run a unit test in loop."""
+    """Run a unit test in loop.
+
+    When tickets is a queue, the test runs once per ticket taken from the
+    queue instead of sleeping sleep_time between tests. With a pacing, a
+    test is started every pacing seconds. In both cases the test is told
+    how late it started compared to its schedule."""
 
     def __init__(self, test_module, test_class, test_name, options,
                  cycle, cvus, thread_id, thread_signaller, sleep_time,
-                 debug=False, feedback=None):
+                 debug=False, feedback=None, tickets=None, pacing=0):
         meta_method_name = mmn_encode(test_name, cycle, cvus, thread_id)
         threading.Thread.__init__(self, target=self.run, name=meta_method_name,
                                   args=())
+        self.test_name = test_name
+        self.thread_id = thread_id
         self.test = load_unittest(test_module, test_class, meta_method_name,
                                   options)
         if sys.platform.lower().startswith('win'):
@@ -201,18 +221,42 @@ class LoopTestRunner(threading.Thread):
         # this makes threads endings if main stop with a KeyboardInterupt
         self.setDaemon(1)
         self.feedback = feedback
+        self.tickets = tickets
+        self.pacing = pacing
+        self.next_start = None
+        self.counter = ResultCounter()
 
     def run(self):
         """Run a test in loop."""
         while (self.thread_signaller.running()):
+            if self.thread_signaller.wait() or self.next_start is None:
+                # the pause between cycles is not part of the schedule
+                self.next_start = time.time()
+            if not self.thread_signaller.running():
+                break
+            intended_start = None
+            if self.tickets is not None:
+                try:
+                    intended_start = self.tickets.get(timeout=0.5)
+                except Empty:
+                    continue
+            elif self.pacing:
+                intended_start = self.next_start
+                self.next_start += self.pacing
+                thread_sleep(max(0, intended_start - time.time()))
+                if not self.thread_signaller.running():
+                    break
             test_result = unittest.TestResult()
             self.test.clearContext()
+            if intended_start is not None:
+                self.test.schedule_lag = max(0.0,
+                                             time.time() - intended_start)
             self.test(test_result)
             feedback = {}
 
             if test_result.wasSuccessful():
                 if recording():
-                    feedback['count'] = add_cycle_result('success')
+                    feedback['count'] = self.counter.add('success')
 
                 if self.color:
                     trace(green_str('.'))
@@ -223,7 +267,7 @@ class LoopTestRunner(threading.Thread):
             else:
                 if len(test_result.errors):
                     if recording():
-                        feedback['count'] = add_cycle_result('error')
+                        feedback['count'] = self.counter.add('error')
 
                     if self.color:
                         trace(red_str('E'))
@@ -234,7 +278,7 @@ class LoopTestRunner(threading.Thread):
 
                 else:
                     if recording():
-                        feedback['count'] = add_cycle_result('failure')
+                        feedback['count'] = self.counter.add('failure')
 
                     if self.color:
                         trace(red_str('F'))
@@ -255,11 +299,223 @@ class LoopTestRunner(threading.Thread):
             if self.feedback is not None:
                 self.feedback.test_done(feedback)
 
-            thread_sleep(self.sleep_time)
+            if self.tickets is not None:
+                self.tickets.task_done()
+            elif not self.pacing:
+                thread_sleep(self.sleep_time)
+
+    def retag(self, cycle, cvus):
+        """Keep running the test for another cycle."""
+        meta_method_name = mmn_encode(self.test_name, cycle, cvus,
+                                      self.thread_id)
+        self.setName(meta_method_name)
+        self.test.meta_method_name = meta_method_name
+        self.test.cycle = cycle
+        self.test.cvus = cvus
+        self.next_start = None
+
+
+class ArrivalDispatcher(threading.Thread):
+    """Start test iterations at a target arrival rate (open model).
+
+    Each arrival is a ticket holding its intended start time, tickets are
+    taken by a pool of loop runners which grows when all of them are
+    busy, so a slow server does not lower the offered load."""
+
+    def __init__(self, bench, cycle, cvus, rate):
+        threading.Thread.__init__(self, name='FunkLoadArrivalDispatcher')
+        self.setDaemon(1)
+        self.bench = bench
+        self.cycle = cycle
+        self.cvus = cvus
+        self.rate = float(rate)
+        self.poisson = bench.arrival_distribution == 'poisson'
+        self.tickets = Queue()
+        self.thread_signaller = ThreadSignaller()
+        self.threads = []
+        self.offered = 0
+
+    def run(self):
+        """Queue a ticket at each arrival time."""
+        if self.rate <= 0:
+            # no test is started during this cycle
+            return
+        bench = self.bench
+        next_time = time.time()
+        while self.thread_signaller.running():
+            delay = next_time - time.time()
+            if delay > 0:
+                thread_sleep(min(delay, 1))
+                continue
+            # unfinished tickets are either queued or being run
+            if (self.tickets.unfinished_tasks >= len(self.threads) and
+                len(self.threads) < bench.arrival_max_workers):
+                # the runners of the bench are changed under its lock
+                bench.thread_creation_lock.acquire()
+                try:
+                    self.threads.append(bench.createThread(
+                        self.cycle, self.cvus, bench.createThreadId(),
+                        self.tickets))
+                finally:
+                    bench.thread_creation_lock.release()
+            self.tickets.put(next_time)
+            if recording():
+                self.offered += 1
+            if self.poisson:
+                next_time += random.expovariate(self.rate)
+            else:
+                next_time += 1 / self.rate
+
+    def stop(self):
+        """Stop dispatching and wait for the end of the pool threads."""
+        self.thread_signaller.set_running(False)
+        self.join()
+        for thread_data in self.threads:
+            thread_data.thread_signaller.set_running(False)
+        for thread_data in self.threads:
+            thread_data.thread.join()
+            trace('.')
+
+
+class ResultPipeHandler(logging.Handler):
+    """Send the result records of a worker process to the bench process."""
+    def __init__(self, conn):
+        logging.Handler.__init__(self)
+        self.conn = conn
+
+    def emit(self, record):
+        # a binary result record is encoded by the bench process
+        self.conn.send(record.msg)
+
+    def emitBatch(self, records):
+        """Send a list of records at once."""
+        self.conn.send([record.msg for record in records])
+
+
+def wait_readable(conn):
+    """Wait for data on a connection.
+
+    Using select instead of a blocking recv lets the other threads run when
+    the socket and select modules are patched by gevent."""
+    select.select([conn], [], [])
+
+
+class BenchWorkerProcess(multiprocessing.Process):
+    """Run a share of the virtual users of a cycle in a separate process.
+
+    The worker is driven by the bench process through a pipe, the result
+    records are sent back using another pipe so the bench process writes a
+    single result file."""
+
+    def __init__(self, bench, worker_id):
+        multiprocessing.Process.__init__(self,
+                                         name='FunkLoadWorker-%i' % worker_id)
+        self.bench = bench
+        self.worker_id = worker_id
+        self.conn, self.worker_conn = multiprocessing.Pipe()
+        self.result_reader, self.result_writer = multiprocessing.Pipe(False)
+        self.lock = threading.Lock()
+        self.size = 0                   # number of threads, bench side
+        self.results = (0, 0, 0)        # last known counters, bench side
+        self.daemon = True
+
+    # bench process side
+    def send(self, command, *args):
+        """Send a command to the worker."""
+        self.lock.acquire()
+        try:
+            self.conn.send((command, args))
+        finally:
+            self.lock.release()
+
+    def reply(self):
+        """Wait for the reply of the last command."""
+        wait_readable(self.conn)
+        return self.conn.recv()
+
+    # worker process side
+    def run(self):
+        """Process the commands of the bench process."""
+        bench = self.bench
+        # the share of the worker is run in this single process
+        bench.workers = []
+        bench.thread_id_step = bench.processes
+        bench.last_thread_id = self.worker_id - bench.processes
+        bench.processes = 1
+        # the lock was held by the bench process when it forked
+        bench.thread_creation_lock = threading.Lock()
+        self.result_reader.close()
+        # the inherited result file belongs to the bench process, keep its
+        # handlers so that collecting a compressed stream does not write
+        # its end into the file
+        self.parent_handlers = bench.test.logger_result.handlers
+        handler = ResultPipeHandler(self.result_writer)
+        if bench.test.result_flush_interval:
+            handler = AsyncResultHandler(handler,
+                                         bench.test.result_queue_size,
+                                         bench.test.result_flush_interval)
+        bench.test.logger_result.handlers = [handler]
+        if bench.feedback is not None:
+            bench.feedback = FeedbackSender(
+                endpoint=bench.options.feedback_endpoint or DEFAULT_ENDPOINT)
+        threads = []
+        conn = self.worker_conn
+        while True:
+            wait_readable(conn)
+            command, args = conn.recv()
+            if command == 'start':
+                cycle, cvus, thread_ids, offset, delay = args
+                thread_sleep(offset)
+                for thread_id in thread_ids:
+                    try:
+                        threads.append(bench.createThread(cycle, cvus,
+                                                          thread_id))
+                    except ThreadError:
+                        break
+                    thread_sleep(delay)
+                conn.send(len(threads))
+            elif command == 'recording':
+                set_recording_flag(args[0])
+            elif command == 'pause':
+                bench.gate.clear()
+            elif command == 'resume':
+                bench.gate.set()
+            elif command == 'retag':
+                for thread_data in threads:
+                    thread_data.thread.retag(*args)
+            elif command == 'active_cvus':
+                set_active_cvus(args[0])
+            elif command == 'arrivals':
+                bench.startDispatcher(*args)
+            elif command == 'stop':
+                number_of_threads = args[0]
+                if number_of_threads is None:
+                    if bench.dispatcher is not None:
+                        bench.stopDispatcher()
+                    number_of_threads = len(threads)
+                removed_threads = []
+                for i in range(min(number_of_threads, len(threads))):
+                    thread_data = threads.pop()
+                    thread_data.thread_signaller.set_running(False)
+                    removed_threads.append(thread_data)
+                for thread_data in removed_threads:
+                    thread_data.thread.join()
+                    trace('.')
+                bench.foldRunners()
+                conn.send((len(removed_threads), bench.getResults()))
+            elif command == 'results':
+                conn.send(bench.getResults())
+            elif command == 'writer':
+                conn.send(bench.getWriterStats())
+            elif command == 'quit':
+                break
+        # send the queued records before exiting
+        handler.close()
 
 
 class BenchRunner:
     """Run a unit test in bench mode."""
+    loop_runner_class = LoopTestRunner
 
     def __init__(self, module_name, class_name, method_name, options):
         self.module_name = module_name
@@ -278,16 +534,57 @@ class BenchRunner:
         self.test_description = test.conf_get(self.method_name, 'description',
                                               'No test description')
         self.test_url = test.conf_get('main', 'url')
-        self.cycles = map(int, test.conf_getList('bench', 'cycles'))
+        self.arrival_rates = test.conf_getList('bench', 'arrival_rates', None,
+                                               quiet=True)
+        if self.arrival_rates:
+            # open model, a cycle is a number of tests started per second,
+            # the CUs of a cycle are its rate rounded down
+            self.arrival_rates = map(float, self.arrival_rates)
+            if min(self.arrival_rates) < 0:
+                raise ValueError('Invalid arrival_rates %r, expecting '
+                                 'tests per second of 0 or more' %
+                                 self.arrival_rates)
+            self.cycles = map(int, self.arrival_rates)
+        else:
+            self.cycles = map(int, test.conf_getList('bench', 'cycles'))
+        self.arrival_distribution = test.conf_get(
+            'bench', 'arrival_distribution', 'constant', quiet=True)
+        self.arrival_max_workers = test.conf_getInt(
+            'bench', 'arrival_max_workers', 1000, quiet=True)
+        self.load_shape = test.conf_get('bench', 'load_shape', None,
+                                        quiet=True)
+        self.load_shape_tick = test.conf_getFloat('bench', 'load_shape_tick',
+                                                  1, quiet=True)
         self.duration = test.conf_getInt('bench', 'duration')
         self.startup_delay = test.conf_getFloat('bench', 'startup_delay')
         self.cycle_time = test.conf_getFloat('bench', 'cycle_time')
         self.sleep_time = test.conf_getFloat('bench', 'sleep_time')
+        self.pacing = test.conf_getFloat('bench', 'pacing', 0, quiet=True)
         self.sleep_time_min = test.conf_getFloat('bench', 'sleep_time_min')
         self.sleep_time_max = test.conf_getFloat('bench', 'sleep_time_max')
+        self.processes = test.conf_getInt('bench', 'processes', 1, quiet=True)
+        if self.processes > 1 and sys.platform.lower().startswith('win'):
+            trace(red_str("Multi-process mode is not supported on windows, "
+                          "using a single process.\n"))
+            self.processes = 1
         self.threads = []  # Contains list of ThreadData objects
+        self.workers = []  # Contains list of BenchWorkerProcess objects
         self.last_thread_id = -1
+        self.thread_id_step = 1
         self.thread_creation_lock = threading.Lock()
+        self.reuse_threads = test.conf_getInt('bench', 'reuse_threads', 0,
+                                              quiet=True)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.dispatcher = None
+        self.shape = None
+        # result counters, see getResults
+        self.runners = []
+        self.results_done = [0, 0, 0]
+        self.results_base = [0, 0, 0]
+        self.rates = (0.0, 0.0, 0.0)
+        self.max_success_rate = 0.0
+        self.last_sample = None
 
         # setup monitoring
         monitor_hosts = []                  # list of (host, port, descr)
@@ -329,8 +626,12 @@ class BenchRunner:
         trace('\n')
         for cvus in self.cycles:
             t_start = time.time()
-            reset_cycle_results()
-            text = "Cycle #%i with %s virtual users\n" % (cycle, cvus)
+            self.resetCycleResults()
+            if self.arrival_rates:
+                text = "Cycle #%i with %g tests/s\n" % (
+                    cycle, self.arrival_rates[cycle])
+            else:
+                text = "Cycle #%i with %s virtual users\n" % (cycle, cvus)
             trace(text)
             trace('-' * (len(text) - 1) + "\n\n")
             monitor_key = '%s:%s:%s' % (self.method_name, cycle, cvus)
@@ -341,7 +642,7 @@ class BenchRunner:
             self.startThreads(cycle, cvus)
             self.logging(cycle, cvus)
             #self.dumpThreads()
-            self.stopThreads()
+            self.stopThreads(self.getReusableThreads(cycle))
             self.stopMonitors(monitor_key)
             cycle += 1
             trace("* tearDownCycle hook: ...")
@@ -349,14 +650,32 @@ class BenchRunner:
             trace(' done.\n')
             t_stop = time.time()
             trace("* End of cycle, %.2fs elapsed.\n" % (t_stop - t_start))
-            success, failures, errors = get_cycle_results()
+            success, failures, errors = self.getCycleResults()
             status, code = get_status(success, failures, errors, self.color)
+            trace("* Cycle rates: %.2f success/s (max %.2f), "
+                  "%.2f failures/s, %.2f errors/s.\n" % (
+                float(success) / self.duration, self.max_success_rate,
+                float(failures) / self.duration,
+                float(errors) / self.duration))
             trace("* Cycle result: **%s**, "
-                  "%i success, %i failure, %i errors.\n\n" % (
+                  "%i success, %i failure, %i errors.\n" % (
                 status, success, failures, errors))
+            writer_stats = self.getWriterStats()
+            if writer_stats is not None:
+                written, dropped, queued, max_backlog = writer_stats
+                text = ("* Result writer: %i records written, %i queued, "
+                        "largest batch %i" % (written, queued, max_backlog))
+                if dropped:
+                    dropped = "%i dropped" % dropped
+                    if self.color:
+                        dropped = red_str(dropped)
+                    text += ", " + dropped
+                trace(text + ".\n")
+            trace("\n")
             total_success += success
             total_failures += failures
             total_errors += errors
+        self.quitWorkers()
         trace("* tearDownBench hook: ...")
         self.test.tearDownBench()
         trace(' done.\n\n')
@@ -373,66 +692,343 @@ class BenchRunner:
         return code
 
     def createThreadId(self):
-        self.last_thread_id += 1
+        self.last_thread_id += self.thread_id_step
         return self.last_thread_id
 
+    def setRecording(self, value):
+        """Set the recording flag of the bench and worker processes."""
+        set_recording_flag(value)
+        for worker in self.workers:
+            worker.send('recording', value)
+
     def startThreads(self, cycle, number_of_threads):
         """Starts threads."""
         self.thread_creation_lock.acquire()
         try:
             trace("* Current time: %s\n" % datetime.now().isoformat())
             trace("* Starting threads: ")
-            set_recording_flag(False)
-            threads = self.createThreads(cycle, number_of_threads)
-            self.threads.extend(threads)
+            self.setRecording(False)
+            cvus = number_of_threads
+            if self.load_shape and not self.arrival_rates:
+                self.shape = get_runner_class(self.load_shape)(
+                    cvus, self.duration, self.test)
+                number_of_threads = self.shape.getUsers(0)
+                self.setActiveCvus(number_of_threads)
+            survivors = self.getNumberOfThreads()
+            if survivors:
+                # threads kept from the previous cycle
+                self.retagThreads(cycle, cvus)
+                self.resumeThreads()
+                number_of_threads -= survivors
+            if self.arrival_rates:
+                self.startArrivals(cycle, cvus, self.arrival_rates[cycle])
+            elif self.processes > 1:
+                self.startWorkerThreads(cycle, number_of_threads, cvus)
+            else:
+                threads = self.createThreads(cycle, number_of_threads, cvus)
+                self.threads.extend(threads)
         finally:
-            set_recording_flag(True)
+            self.setRecording(True)
             self.thread_creation_lock.release()
 
-    def addThreads(self, number_of_threads):
+    def getReusableThreads(self, cycle):
+        """Return the number of threads to keep for the next cycle."""
+        if (not self.reuse_threads or self.arrival_rates or self.load_shape
+            or cycle + 1 >= len(self.cycles)):
+            return 0
+        return min(self.getNumberOfThreads(), self.cycles[cycle + 1])
+
+    def retagThreads(self, cycle, cvus):
+        """Move the running threads to a new cycle."""
+        for thread_data in self.threads:
+            thread_data.thread.retag(cycle, cvus)
+        for worker in self.workers:
+            worker.send('retag', cycle, cvus)
+
+    def pauseThreads(self):
+        """Pause the threads of the bench and worker processes after their
+        current test."""
+        self.gate.clear()
+        for worker in self.workers:
+            worker.send('pause')
+
+    def resumeThreads(self):
+        """Resume the paused threads."""
+        self.gate.set()
+        for worker in self.workers:
+            worker.send('resume')
+
+    def setActiveCvus(self, value):
+        """Set the number of running users of the bench and worker
+        processes."""
+        set_active_cvus(value)
+        for worker in self.workers:
+            worker.send('active_cvus', value)
+
+    def addThreads(self, number_of_threads, cycle=0, cvus=None,
+                   shaping=False):
         """Adds new threads to existing list. Used to dynamically add new
-           threads during a debug bench run."""
+           threads during a debug bench run or by a load shape.
+
+        When shaping the threads belong to the current cycle and the
+        recording goes on."""
         self.thread_creation_lock.acquire()
         try:
-            trace("Adding new threads: ")
-            set_recording_flag(False)
+            if not shaping:
+                trace("Adding new threads: ")
+                self.setRecording(False)
             # In debug bench, 'cycle' value is irrelevant.
-            threads = self.createThreads(0, number_of_threads)
-            self.threads.extend(threads)
+            if self.processes > 1:
+                self.startWorkerThreads(cycle, number_of_threads, cvus,
+                                        quiet=shaping)
+            else:
+                threads = self.createThreads(cycle, number_of_threads, cvus,
+                                             quiet=shaping)
+                self.threads.extend(threads)
         finally:
-            set_recording_flag(True)
+            if not shaping:
+                self.setRecording(True)
             self.thread_creation_lock.release()
 
-    def createThreads(self, cycle, number_of_threads):
+    def createThreads(self, cycle, number_of_threads, cvus=None,
+                      quiet=False):
         """Creates number_of_threads threads and returns as a list.
 
         NOTE: This method is not thread safe. Thread safety must be
         handled by the caller."""
+        if cvus is None:
+            cvus = number_of_threads
         threads = []
         i = 0
         for i in range(number_of_threads):
             thread_id = self.createThreadId()
-            thread_signaller = ThreadSignaller()
-            thread = LoopTestRunner(self.module_name, self.class_name,
-                                    self.method_name, self.options,
-                                    cycle, number_of_threads,
-                                    thread_id, thread_signaller,
-                                    self.sleep_time,
-                                    feedback=self.feedback)
-            trace(".")
             try:
-                thread.start()
+                thread_data = self.createThread(cycle, cvus, thread_id)
             except ThreadError:
                 trace("\nERROR: Can not create more than %i threads, try a "
                       "smaller stack size using: 'ulimit -s 2048' "
                       "for example\n" % (i + 1))
                 raise
-            thread_data = ThreadData(thread, thread_id, thread_signaller)
             threads.append(thread_data)
             thread_sleep(self.startup_delay)
-        trace(' done.\n')
+        if not quiet:
+            trace(' done.\n')
         return threads
 
+    def createThread(self, cycle, cvus, thread_id, tickets=None):
+        """Creates and starts a single thread, returns its ThreadData."""
+        thread_signaller = ThreadSignaller(self.gate)
+        thread = self.loop_runner_class(self.module_name, self.class_name,
+                                           self.method_name, self.options,
+                                           cycle, cvus,
+                                           thread_id, thread_signaller,
+                                           self.sleep_time,
+                                           feedback=self.feedback,
+                                           tickets=tickets,
+                                           pacing=self.pacing)
+        trace(".")
+        thread.start()
+        self.runners.append(thread)
+        return ThreadData(thread, thread_id, thread_signaller)
+
+    def foldRunners(self):
+        """Move the counters of the finished runners into results_done."""
+        self.thread_creation_lock.acquire()
+        try:
+            runners = []
+            for runner in self.runners:
+                if runner.isAlive():
+                    runners.append(runner)
+                else:
+                    add_results(self.results_done, runner.counter.get())
+            self.runners = runners
+        finally:
+            self.thread_creation_lock.release()
+
+    def pollWorkerResults(self):
+        """Ask the worker processes for their counters."""
+        if not self.workers:
+            return
+        self.thread_creation_lock.acquire()
+        try:
+            for worker in self.workers:
+                worker.send('results')
+            for worker in self.workers:
+                worker.results = worker.reply()
+        finally:
+            self.thread_creation_lock.release()
+
+    def getResults(self):
+        """Return the success, failures and errors counted since the start
+        of the bench, using the last known counters of the workers."""
+        totals = list(self.results_done)
+        for runner in self.runners:
+            add_results(totals, runner.counter.get())
+        for worker in self.workers:
+            add_results(totals, worker.results)
+        return totals
+
+    def getCycleResults(self):
+        """Return the success, failures and errors of the current cycle."""
+        self.pollWorkerResults()
+        totals = self.getResults()
+        return [totals[i] - self.results_base[i] for i in range(3)]
+
+    def resetCycleResults(self):
+        """Start counting the results of a new cycle."""
+        self.foldRunners()
+        self.pollWorkerResults()
+        self.results_base = self.getResults()
+        self.rates = (0.0, 0.0, 0.0)
+        self.max_success_rate = 0.0
+        self.last_sample = None
+
+    def getWriterStats(self):
+        """Return the records written, dropped and queued and the largest
+        batch of the result writers since the previous call, None if the
+        results are written synchronously."""
+        handlers = [handler for handler in self.test.logger_result.handlers
+                    if isinstance(handler, AsyncResultHandler)]
+        if not handlers:
+            return None
+        stats = handlers[0].getStats()
+        if self.workers:
+            self.thread_creation_lock.acquire()
+            try:
+                for worker in self.workers:
+                    worker.send('writer')
+                for worker in self.workers:
+                    worker_stats = worker.reply()
+                    stats = (stats[0] + worker_stats[0],
+                             stats[1] + worker_stats[1],
+                             stats[2] + worker_stats[2],
+                             max(stats[3], worker_stats[3]))
+            finally:
+                self.thread_creation_lock.release()
+        return stats
+
+    def sampleRates(self):
+        """Compute the success, failures and errors per second since the
+        previous sample."""
+        now = time.time()
+        self.pollWorkerResults()
+        results = self.getResults()
+        if self.last_sample is not None:
+            last_time, last_results = self.last_sample
+            elapsed = now - last_time
+            if elapsed > 0:
+                self.rates = tuple([(results[i] - last_results[i]) / elapsed
+                                    for i in range(3)])
+                self.max_success_rate = max(self.max_success_rate,
+                                            self.rates[0])
+        self.last_sample = (now, results)
+
+    def createWorkers(self):
+        """Fork the worker processes and start collecting their results.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        # a forked worker must not inherit buffered result records
+        for handler in self.test.logger_result.handlers:
+            handler.flush()
+        for worker_id in range(self.processes):
+            worker = BenchWorkerProcess(self, worker_id)
+            worker.start()
+            # only the worker keeps the writing end, the reader gets an
+            # EOFError once the worker exits
+            worker.result_writer.close()
+            self.workers.append(worker)
+        collector = threading.Thread(target=self.collectWorkerResults,
+                                     name='FunkLoadResultCollector')
+        collector.setDaemon(1)
+        collector.start()
+        self.collector = collector
+
+    def collectWorkerResults(self):
+        """Write the result records sent by the worker processes."""
+        readers = [worker.result_reader for worker in self.workers]
+        while readers:
+            for reader in select.select(readers, [], [])[0]:
+                try:
+                    message = reader.recv()
+                except EOFError:
+                    readers.remove(reader)
+                    continue
+                if isinstance(message, list):
+                    for record in message:
+                        self.logr(record)
+                else:
+                    self.logr(message)
+
+    def startWorkerThreads(self, cycle, number_of_threads, cvus=None,
+                           quiet=False):
+        """Split number_of_threads threads among the worker processes.
+
+        Threads ids are allocated here so they are unique across workers,
+        each worker starts its threads startup_delay * processes apart so
+        the bench keeps the same ramp up.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        if not self.workers:
+            self.createWorkers()
+        if cvus is None:
+            cvus = number_of_threads
+        workers = self.workers
+        # give the new threads to the less loaded workers
+        sizes = [worker.size for worker in workers]
+        shares = [0] * len(workers)
+        for j in range(number_of_threads):
+            i = sizes.index(min(sizes))
+            sizes[i] += 1
+            shares[i] += 1
+        delay = self.startup_delay * len(workers)
+        started = []
+        for i, worker in enumerate(workers):
+            size = shares[i]
+            if not size:
+                continue
+            thread_ids = [self.createThreadId() for j in range(size)]
+            worker.send('start', cycle, cvus, thread_ids,
+                        i * self.startup_delay, delay)
+            started.append(worker)
+        for worker in started:
+            worker.size = worker.reply()
+        if not quiet:
+            trace(' done.\n')
+
+    def startArrivals(self, cycle, cvus, rate):
+        """Start dispatching rate tests per second.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        if self.processes > 1:
+            if not self.workers:
+                self.createWorkers()
+            for worker in self.workers:
+                worker.send('arrivals', cycle, cvus,
+                            rate / len(self.workers))
+        else:
+            self.startDispatcher(cycle, cvus, rate)
+        trace(' done.\n')
+
+    def startDispatcher(self, cycle, cvus, rate):
+        """Start an arrival dispatcher in this process."""
+        self.dispatcher = ArrivalDispatcher(self, cycle, cvus, rate)
+        self.dispatcher.start()
+
+    def stopDispatcher(self):
+        """Stop the arrival dispatcher and log what it has offered."""
+        dispatcher = self.dispatcher
+        dispatcher.stop()
+        self.dispatcher = None
+        self.logr('<arrival cycle="%.3i" cvus="%.3i" rate="%.3f" '
+                  'distribution="%s" offered="%i" backlog="%i" '
+                  'workers="%i" />' % (
+            dispatcher.cycle, dispatcher.cvus, dispatcher.rate,
+            self.arrival_distribution, dispatcher.offered,
+            dispatcher.tickets.qsize(), len(dispatcher.threads)))
+
     def logging(self, cycle, cvus):
         """Log activity during duration."""
         duration = self.duration
@@ -440,39 +1036,77 @@ class BenchRunner:
         mid_time = time.time() + duration / 2
         trace("* Logging for %ds (until %s): " % (
             duration, datetime.fromtimestamp(end_time).isoformat()))
-        set_recording_flag(True)
-        while time.time() < mid_time:
-            time.sleep(1)
+        self.setRecording(True)
+        start_time = time.time()
+        self.sampleRates()
+        self.waitUntil(cycle, cvus, start_time, mid_time)
         self.test.midCycle(cycle, cvus)
-        while time.time() < end_time:
-            # wait
-            time.sleep(1)
-        set_recording_flag(False)
+        self.waitUntil(cycle, cvus, start_time, end_time)
+        self.setRecording(False)
         trace(" done.\n")
 
-    def stopThreads(self):
-        """Stops all running threads."""
+    def waitUntil(self, cycle, cvus, start_time, until):
+        """Wait until the given time, following the load shape if any."""
+        while time.time() < until:
+            if self.shape is None:
+                time.sleep(1)
+            else:
+                time.sleep(self.load_shape_tick)
+                self.reshapeThreads(cycle, cvus, time.time() - start_time)
+            if time.time() - self.last_sample[0] >= 1:
+                self.sampleRates()
+
+    def reshapeThreads(self, cycle, cvus, elapsed):
+        """Add or remove threads to run the number of users of the load
+        shape."""
+        target = self.shape.getUsers(elapsed)
+        current = self.getNumberOfThreads()
+        if target > current:
+            self.setActiveCvus(target)
+            self.addThreads(target - current, cycle, cvus, shaping=True)
+        elif target < current:
+            self.removeThreads(current - target, shaping=True)
+            self.setActiveCvus(target)
+
+    def stopThreads(self, keep=0):
+        """Stops all running threads but keep threads paused for the next
+        cycle."""
+        trace("* Waiting end of threads: ")
+        if self.dispatcher is not None:
+            # the dispatcher takes the lock to create its runners
+            self.stopDispatcher()
         self.thread_creation_lock.acquire()
         try:
-            trace("* Waiting end of threads: ")
-            self.deleteThreads(len(self.threads))
-            self.threads = []
-            trace(" done.\n")
+            if self.arrival_rates and self.workers:
+                self.deleteWorkerThreads(None)
+            else:
+                self.deleteThreads(self.getNumberOfThreads() - keep)
+            if self.shape is not None:
+                self.shape = None
+                self.setActiveCvus(None)
+            if keep:
+                self.pauseThreads()
+                trace(" done, %i threads kept.\n" % keep)
+            else:
+                self.threads = []
+                self.last_thread_id = -1
+                trace(" done.\n")
             trace("* Waiting cycle sleeptime %ds: ..." % self.cycle_time)
             time.sleep(self.cycle_time)
             trace(" done.\n")
-            self.last_thread_id = -1
         finally:
             self.thread_creation_lock.release()
 
-    def removeThreads(self, number_of_threads):
+    def removeThreads(self, number_of_threads, shaping=False):
         """Removes threads. Used to dynamically remove threads during a
-           debug bench run."""
+           debug bench run or by a load shape."""
         self.thread_creation_lock.acquire()
         try:
-            trace('* Removing threads: ')
+            if not shaping:
+                trace('* Removing threads: ')
             self.deleteThreads(number_of_threads)
-            trace(' done.\n')
+            if not shaping:
+                trace(' done.\n')
         finally:
             self.thread_creation_lock.release()
 
@@ -481,6 +1115,9 @@ class BenchRunner:
 
         NOTE: This method is not thread safe. Thread safety must be
         handled by the caller."""
+        if self.workers:
+            self.deleteWorkerThreads(number_of_threads)
+            return
         removed_threads = []
         if number_of_threads > len(self.threads):
             number_of_threads = len(self.threads)
@@ -493,7 +1130,47 @@ class BenchRunner:
             del thread_data
             trace('.')
 
+    def deleteWorkerThreads(self, number_of_threads):
+        """Stops given number of threads, starting with the last worker
+        processes, and updates their counters.
+
+        NOTE: This method is not thread safe. Thread safety must be
+        handled by the caller."""
+        stopping = []
+        for worker in reversed(self.workers):
+            if number_of_threads is None:
+                # stop everything, including the arrival dispatchers
+                worker.send('stop', None)
+                stopping.append(worker)
+                continue
+            if number_of_threads <= 0:
+                break
+            if not worker.size:
+                continue
+            count = min(number_of_threads, worker.size)
+            worker.send('stop', count)
+            stopping.append(worker)
+            number_of_threads -= count
+        for worker in stopping:
+            removed, worker.results = worker.reply()
+            worker.size = max(0, worker.size - removed)
+
+    def quitWorkers(self):
+        """Terminate the worker processes once their results are written."""
+        if not self.workers:
+            return
+        for worker in self.workers:
+            worker.send('quit')
+        for worker in self.workers:
+            worker.join()
+        self.collector.join()
+        for worker in self.workers:
+            add_results(self.results_done, worker.results)
+        self.workers = []
+
     def getNumberOfThreads(self):
+        if self.workers:
+            return sum([worker.size for worker in self.workers])
         return len(self.threads)
 
     def dumpThreads(self):
@@ -594,10 +1271,13 @@ class BenchRunner:
                   'cycles': self.cycles,
                   'duration': self.duration,
                   'sleep_time': self.sleep_time,
+                  'pacing': self.pacing,
                   'startup_delay': self.startup_delay,
                   'sleep_time_min': self.sleep_time_min,
                   'sleep_time_max': self.sleep_time_max,
                   'cycle_time': self.cycle_time,
+                  'processes': self.processes,
+                  'reuse_threads': self.reuse_threads,
                   'configuration_file': self.config_path,
                   'server_url': self.test_url,
                   'log_xml': self.result_path,
@@ -605,6 +1285,12 @@ class BenchRunner:
                   'python_version': platform.python_version()}
         if self.options.label:
             config['label'] = self.options.label
+        if self.arrival_rates:
+            config['arrival_distribution'] = self.arrival_distribution
+        if self.load_shape:
+            config['load_shape'] = self.load_shape
+        if self.test._body_store is not None:
+            config['body_store'] = self.test._body_store.path
 
         for (name, host, port, desc) in self.monitor_hosts:
             config[name] = desc
@@ -613,6 +1299,8 @@ class BenchRunner:
     def logr_close(self):
         """Stop logging tag."""
         self.test._close_result_log()
+        for handler in self.test.logger_result.handlers:
+            handler.close()
         self.test.logger_result.handlers = []
 
     def __repr__(self):
@@ -630,13 +1318,27 @@ class BenchRunner:
         text.append("* Configuration file: %s" % self.config_path)
         text.append("* Log xml: %s" % self.result_path)
         text.append("* Server: %s" % self.test_url)
-        text.append("* Cycles: %s" % self.cycles)
+        if self.arrival_rates:
+            text.append("* Cycles: %s tests/s, %s arrivals" % (
+                ':'.join(['%g' % rate for rate in self.arrival_rates]),
+                self.arrival_distribution))
+        else:
+            text.append("* Cycles: %s" % self.cycles)
         text.append("* Cycle duration: %ss" % self.duration)
         text.append("* Sleeptime between request: from %ss to %ss" % (
             self.sleep_time_min, self.sleep_time_max))
-        text.append("* Sleeptime between test case: %ss" % self.sleep_time)
-        text.append("* Startup delay between thread: %ss\n\n" %
+        if self.load_shape:
+            text.append("* Load shape: %s" % self.load_shape)
+        if self.pacing:
+            text.append("* Pacing: a test every %ss" % self.pacing)
+        else:
+            text.append("* Sleeptime between test case: %ss" %
+                        self.sleep_time)
+        text.append("* Startup delay between thread: %ss" %
                     self.startup_delay)
+        if self.processes > 1:
+            text.append("* Worker processes: %s" % self.processes)
+        text.append("\n")
         return '\n'.join(text)
 
 
@@ -756,7 +1458,9 @@ def get_shared_OptionParser():
                       type="string",
                       dest="bench_runner_class",
                       default="funkload.BenchRunner.BenchRunner",
-                      help="Python dotted import path to BenchRunner class to use.")
+                      help="Python dotted import path to BenchRunner class "
+                      "to use, funkload.GreenRunner.GreenBenchRunner runs "
+                      "the virtual users as gevent green threads.")
     parser.add_option("", "--no-color",
                       action="store_true",
                       help="Monochrome output.")
@@ -776,7 +1480,9 @@ def get_shared_OptionParser():
                            "at run-time. Currently supported parameters: "
                            "/cvu?inc=<integer> to increase the number of "
                            "CVUs, /cvu?dec=<integer> to decrease the number "
-                           "of CVUs, /getcvu returns number of CVUs ")
+                           "of CVUs, /getcvu returns number of CVUs, /rates "
+                           "returns the success, failures and errors per "
+                           "second")
     parser.add_option("--debug-server-port",
                       type="string",
                       dest="debugport",
@@ -849,6 +1555,24 @@ def get_shared_OptionParser():
                       help="Cycles to bench, colon-separated list of "
                            "virtual concurrent users. To run a bench with 3 "
                            "cycles of 5, 10 and 20 users, use: -c 5:10:20")
+    parser.add_option("--arrival-rates",
+                      type="string",
+                      dest="bench_arrival_rates",
+                      help="Use an open model: cycles are defined as a "
+                           "colon-separated list of tests started per "
+                           "second, for example: --arrival-rates 50:100:200")
+    parser.add_option("--arrival-distribution",
+                      type="choice",
+                      choices=['constant', 'poisson'],
+                      dest="bench_arrival_distribution",
+                      help="Distribution of the arrivals, constant or "
+                           "poisson, default is constant.")
+    parser.add_option("--load-shape",
+                      type="string",
+                      dest="bench_load_shape",
+                      help="Python dotted import path to a LoadShape class "
+                           "giving the number of users during a cycle, for "
+                           "example: funkload.LoadShape.RampShape")
     parser.add_option("-D", "--duration",
                       type="string",
                       dest="bench_duration",
@@ -865,10 +1589,29 @@ def get_shared_OptionParser():
                       type="string",
                       dest="bench_sleep_time",
                       help="Sleep time between tests.")
+    parser.add_option("--pacing",
+                      type="string",
+                      dest="bench_pacing",
+                      help="Start a test every PACING seconds on each "
+                           "virtual user instead of sleeping between tests, "
+                           "latencies are then corrected for the late "
+                           "starts.")
     parser.add_option("-s", "--startup-delay",
                       type="string",
                       dest="bench_startup_delay",
                       help="Startup delay between thread.")
+    parser.add_option("-p", "--processes",
+                      type="string",
+                      dest="bench_processes",
+                      help="Number of worker processes used to run the "
+                           "virtual users of a cycle, use the number of "
+                           "cores to bypass the GIL limit.")
+    parser.add_option("--reuse-threads",
+                      action="store_true",
+                      dest="bench_reuse_threads",
+                      help="Keep the virtual users running between cycles, "
+                           "only the difference of CUs is started or "
+                           "stopped.")
     parser.add_option("-f", "--as-fast-as-possible",
                       action="store_true",
                       help="Remove sleep times between requests and between "
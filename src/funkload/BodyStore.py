@@ -0,0 +1,139 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A content-addressed store for the bodies and headers of the failures.
+
+A failed response used to be logged with its headers and body inlined in
+the result file. When the store is enabled, in the bench or ftest section:
+
+  store_failure_bodies = 1
+
+the headers and the body are written once in a directory next to the
+result file, named after their sha1, and the response record only keeps
+the headers_hash and body_hash attributes. The store of funkload.xml is
+the funkload.xml.bodies directory.
+
+The headers that change with each response (date, expires, age and
+set-cookie) are not stored so that the same failure is stored once.
+"""
+import os
+import errno
+import thread
+from hashlib import sha1
+
+VOLATILE_HEADERS = ('date', 'expires', 'age', 'set-cookie')
+
+
+def get_body_store_path(result_path):
+    """Return the store directory of a result file."""
+    return result_path + '.bodies'
+
+
+def format_headers(headers):
+    """Return the text of response headers."""
+    if not headers:
+        return ''
+    return ''.join(['%s: %s\n' % (key, value)
+                    for key, value in sorted(headers.items())
+                    if key.lower() not in VOLATILE_HEADERS])
+
+
+def parse_headers(text):
+    """Return the headers dict of a text made by format_headers."""
+    headers = {}
+    for line in text.splitlines():
+        if ': ' in line:
+            key, value = line.split(': ', 1)
+            headers[key] = value
+    return headers
+
+
+class BodyStore:
+    """Store texts once, named after their sha1."""
+    def __init__(self, path):
+        self.path = path
+        self.known = set()
+
+    def add(self, data):
+        """Store a text if needed, return its hash."""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        key = sha1(data).hexdigest()
+        if key in self.known:
+            return key
+        path = os.path.join(self.path, key)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(self.path)
+            except OSError, error:
+                if error.errno != errno.EEXIST:
+                    raise
+            # the threads and processes of a bench may store the same text
+            tmp_path = '%s.%i.%i' % (path, os.getpid(), thread.get_ident())
+            f = open(tmp_path, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        self.known.add(key)
+        return key
+
+
+_stores = {}
+
+def get_body_store(path):
+    """Return the store of the process for a directory."""
+    store = _stores.get(path)
+    if store is None:
+        store = _stores.setdefault(path, BodyStore(path))
+    return store
+
+
+class BodyStoreReader:
+    """Read the texts of the stores of one or more result files."""
+    def __init__(self, paths=()):
+        self.paths = []
+        for path in paths:
+            self.addPath(path)
+        self.headers = {}
+
+    def addPath(self, path):
+        """Look for the texts in a store directory too."""
+        if path and path not in self.paths and os.path.isdir(path):
+            self.paths.append(path)
+
+    def get(self, key):
+        """Return a stored text or None."""
+        for path in self.paths:
+            try:
+                f = open(os.path.join(path, key), 'rb')
+            except IOError:
+                continue
+            try:
+                return f.read()
+            finally:
+                f.close()
+        return None
+
+    def getHeaders(self, key):
+        """Return the stored headers dict, shared by the records using
+        it."""
+        headers = self.headers.get(key)
+        if headers is None:
+            headers = self.headers[key] = parse_headers(self.get(key) or '')
+        return headers
@@ -0,0 +1,234 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""The connections of a process.
+
+The proxies are read from the http_proxy, https_proxy and no_proxy
+environment variables. They can be overridden in the bench or ftest
+section of the configuration, where the socket options are set too:
+
+  http_proxy = proxy.example.com:3128
+  https_proxy = proxy.example.com:3128
+  no_proxy = localhost, .example.com
+  socket_timeout = 30
+  tcp_nodelay = 1
+
+A route is computed once per server: plain http requests are forwarded by
+the proxy, https requests go through a CONNECT tunnel.
+"""
+import os
+import ssl
+import time
+import socket
+import urlparse
+import httplib
+
+from Resolver import get_resolver
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def parse_proxy(value):
+    """Return the (host, port) of a proxy url or None."""
+    if not value:
+        return None
+    if '://' not in value:
+        value = 'http://' + value
+    parts = urlparse.urlsplit(value)
+    if not parts.hostname:
+        return None
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    return parts.hostname, port or 80
+
+
+def parse_no_proxy(value):
+    """Return the [(domain, port)] of a no_proxy list, port is None for any
+    port."""
+    ret = []
+    for entry in (value or '').replace(',', ' ').split():
+        port = None
+        if entry.count(':') == 1:
+            entry, port = entry.split(':')
+            if not port.isdigit():
+                continue
+            port = int(port)
+        ret.append((entry.lstrip('.').lower(), port))
+    return ret
+
+
+class Route:
+    """How to reach a server: directly, forwarded by a proxy or through a
+    CONNECT tunnel."""
+    def __init__(self, protocol, server, port, proxy=None):
+        self.protocol = protocol
+        self.server = server
+        self.port = port
+        self.proxy = proxy
+        self.tunnel = proxy is not None and protocol == 'https'
+        self.forward = proxy is not None and not self.tunnel
+        if port == DEFAULT_PORTS[protocol]:
+            self.host_header = server
+        else:
+            self.host_header = '%s:%s' % (server, port)
+        if self.forward:
+            # the request line has the absolute url
+            self.prefix = '%s://%s' % (protocol, self.host_header)
+            # a forward proxy connection is shared by all the servers
+            self.key = (protocol, None, None, proxy)
+        else:
+            self.prefix = ''
+            self.key = (protocol, server, port, proxy)
+
+    def __repr__(self):
+        return '<Route %s://%s:%s proxy=%s>' % (self.protocol, self.server,
+                                               self.port, self.proxy)
+
+
+class ConnectionFactory:
+    """Open and connect the connections of a process."""
+    def __init__(self):
+        self.settings = None
+        self.routes = {}
+        self.configure()
+
+    def configure(self, http_proxy=None, https_proxy=None, no_proxy=None,
+                  timeout=None, tcp_nodelay=False, environ=None):
+        """Set the proxies, the timeout in seconds and the socket options,
+        proxies that are not set are read from the environment."""
+        if environ is None:
+            environ = os.environ
+
+        def get_env(name):
+            return environ.get(name) or environ.get(name.upper())
+        if http_proxy is None:
+            http_proxy = get_env('http_proxy')
+        if https_proxy is None:
+            https_proxy = get_env('https_proxy')
+        if no_proxy is None:
+            no_proxy = get_env('no_proxy')
+        settings = (http_proxy, https_proxy, no_proxy, timeout or None,
+                    bool(tcp_nodelay))
+        if settings == self.settings:
+            return
+        self.settings = settings
+        self.proxies = {'http': parse_proxy(http_proxy),
+                        'https': parse_proxy(https_proxy)}
+        self.no_proxy = parse_no_proxy(no_proxy)
+        self.timeout = timeout or None
+        self.tcp_nodelay = bool(tcp_nodelay)
+        self.routes = {}
+
+    def bypassProxy(self, server, port):
+        """Check if a server is in the no_proxy list."""
+        server = server.lower()
+        for domain, domain_port in self.no_proxy:
+            if domain_port is not None and domain_port != port:
+                continue
+            if (domain == '*' or server == domain or
+                server.endswith('.' + domain)):
+                return True
+        return False
+
+    def getRoute(self, protocol, server, port):
+        """Return the route to a server."""
+        key = (protocol, server, port)
+        route = self.routes.get(key)
+        if route is None:
+            if protocol not in DEFAULT_PORTS:
+                raise ValueError, protocol
+            port = int(port)
+            proxy = self.proxies[protocol]
+            if proxy is not None and self.bypassProxy(server, port):
+                proxy = None
+            route = self.routes[key] = Route(protocol, server, port, proxy)
+        return route
+
+    def newConnection(self, route, key_file=None, cert_file=None,
+                      keep_alive=False):
+        """Return a new connection, an HTTP/1.1 one to keep it alive or to
+        use a proxy."""
+        if route.proxy is not None:
+            host, port = route.proxy
+        else:
+            host, port = route.server, route.port
+        if route.protocol == 'http':
+            if route.proxy or keep_alive:
+                conn = httplib.HTTPConnection(host, port)
+            else:
+                conn = httplib.HTTP(host, port)
+        # patched to use the given key and cert file
+        elif route.proxy or keep_alive:
+            conn = httplib.HTTPSConnection(host, port, key_file, cert_file)
+            if route.tunnel:
+                conn.set_tunnel(route.server, route.port)
+        else:
+            conn = httplib.HTTPS(host, port, key_file, cert_file)
+        if self.timeout:
+            # httplib.HTTP wraps a connection
+            getattr(conn, '_conn', conn).timeout = self.timeout
+        return conn
+
+    def connect(self, conn, timings):
+        """Connect an httplib connection like its connect method does,
+        timing the dns, connect and tls phases."""
+        t_start = time.time()
+        addresses = get_resolver().getaddrinfo(conn.host, conn.port)
+        t_resolved = time.time()
+        timings['dns'] = t_resolved - t_start
+        sock = None
+        error = socket.error('getaddrinfo returns an empty list')
+        for family, socktype, proto, canonname, address in addresses:
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if conn.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(conn.timeout)
+                if self.tcp_nodelay:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if conn.source_address:
+                    sock.bind(conn.source_address)
+                sock.connect(address)
+                break
+            except socket.error, error:
+                if sock is not None:
+                    sock.close()
+                sock = None
+        if sock is None:
+            raise error
+        conn.sock = sock
+        if conn._tunnel_host:
+            conn._tunnel()
+        t_connected = time.time()
+        timings['connect'] = t_connected - t_resolved
+        if isinstance(conn, httplib.HTTPSConnection):
+            context = getattr(conn, '_context', None)
+            if context is not None:
+                conn.sock = context.wrap_socket(
+                    sock, server_hostname=conn._tunnel_host or conn.host)
+            else:
+                conn.sock = ssl.wrap_socket(sock, conn.key_file,
+                                            conn.cert_file)
+            timings['tls'] = time.time() - t_connected
+
+
+_factory = ConnectionFactory()
+
+def get_connection_factory():
+    """Return the connection factory of the process."""
+    return _factory
@@ -0,0 +1,199 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""An indexed cookie store for the browser.
+
+The store keeps the webunit structure {domain: {path: {name: morsel}}} so
+existing code can read it, cookies must be changed using setCookie and
+deleteCookie, or by replacing a whole domain, to keep the index up to date.
+
+The domains are indexed by their registrable domain, approximated by the
+last two labels as there is no public suffix list. For each server the
+matching paths are kept with their pre-computed Cookie header fragments,
+the index is rebuilt when a cookie changes or expires.
+"""
+import re
+import time
+import calendar
+import datetime
+from email.utils import parsedate_tz, mktime_tz
+
+# hard coded values that applications can use to work around expires
+DELETED_VALUES = ('"deleted"', "null", "deleted")
+
+_ip_address = re.compile(r'^[0-9.]+$|:')
+_dates = {}
+
+
+def parse_cookie_date(value):
+    """Return the epoch time of a cookie expires date or None."""
+    seconds = _dates.get(value)
+    if seconds is None:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        seconds = mktime_tz(parsed)
+        if len(_dates) > 1000:
+            _dates.clear()
+        _dates[value] = seconds
+    return seconds
+
+
+def get_registrable_domain(host):
+    """Return the index key of a host."""
+    host = host.lstrip('.')
+    if _ip_address.search(host):
+        return host
+    return '.'.join(host.rsplit('.', 2)[-2:])
+
+
+def domain_match(server, domain):
+    """See rfc 6265, section 5.1.3."""
+    domain = domain.lstrip('.')
+    return server == domain or server.endswith('.' + domain)
+
+
+def path_match(request_path, path):
+    """See rfc 6265, section 5.1.4."""
+    if not request_path.startswith(path):
+        return False
+    return (len(request_path) == len(path) or path[-1] == '/' or
+            request_path[len(path)] == '/')
+
+
+def _get_expires(morsel):
+    """Return the epoch time of the expires of a morsel, None for a session
+    cookie."""
+    expires = morsel['expires']
+    if isinstance(expires, datetime.datetime):
+        if expires == datetime.datetime.max:
+            return None
+        return calendar.timegm(expires.utctimetuple())
+    if expires:
+        return parse_cookie_date(expires)
+    return None
+
+
+class CookieJar(dict):
+    """The cookies of a browser {domain: {path: {name: morsel}}}."""
+    def __init__(self, cookies=None):
+        dict.__init__(self)
+        self.domains = None
+        self.servers = {}
+        if cookies:
+            for domain, paths in cookies.items():
+                self[domain] = paths
+
+    def changed(self):
+        """Invalidate the index."""
+        self.domains = None
+        self.servers.clear()
+
+    def __setitem__(self, domain, paths):
+        dict.__setitem__(self, domain, paths)
+        self.changed()
+
+    def __delitem__(self, domain):
+        dict.__delitem__(self, domain)
+        self.changed()
+
+    def clear(self):
+        dict.clear(self)
+        self.changed()
+
+    def setdefault(self, domain, paths=None):
+        if domain not in self:
+            self[domain] = paths
+        return self[domain]
+
+    def update(self, *args, **kw):
+        dict.update(self, *args, **kw)
+        self.changed()
+
+    def setCookie(self, domain, path, morsel):
+        paths = self.get(domain)
+        if paths is None:
+            paths = self[domain] = {}
+        paths.setdefault(path, {})[morsel.key] = morsel
+        self.changed()
+
+    def deleteCookie(self, domain, path, name):
+        morsels = self.get(domain, {}).get(path, {})
+        if name in morsels:
+            del morsels[name]
+            self.changed()
+
+    def getCookies(self, server, request_path, secure, now=None):
+        """Return the Cookie header value and the names of the cookies to
+        send for a request."""
+        if not self:
+            return '', []
+        if now is None:
+            now = time.time()
+        key = (server, secure)
+        entry = self.servers.get(key)
+        if entry is None or entry[0] <= now:
+            entry = self._indexServer(server, secure, now)
+            self.servers[key] = entry
+        if not request_path:
+            request_path = '/'
+        fragments = []
+        names = []
+        for path, path_fragments, path_names in entry[1]:
+            if path_match(request_path, path):
+                fragments.extend(path_fragments)
+                names.extend(path_names)
+        return ' '.join(fragments), names
+
+    def _indexServer(self, server, secure, now):
+        """Return (valid_until, [(path, fragments, names)]) for a server,
+        longest paths first."""
+        if self.domains is None:
+            self.domains = {}
+            for domain in self.keys():
+                self.domains.setdefault(get_registrable_domain(domain),
+                                        []).append(domain)
+        valid_until = float('inf')
+        paths = []
+        expired = []
+        for domain in self.domains.get(get_registrable_domain(server), ()):
+            if not domain_match(server, domain):
+                continue
+            for path, morsels in self[domain].items():
+                fragments = []
+                names = []
+                for name, morsel in morsels.items():
+                    expires = _get_expires(morsel)
+                    if expires is not None:
+                        if expires <= now:
+                            expired.append((domain, path, name))
+                            continue
+                        valid_until = min(valid_until, expires)
+                    if morsel['secure'] and not secure:
+                        continue
+                    if morsel.coded_value in DELETED_VALUES:
+                        continue
+                    fragments.append('%s=%s;' % (morsel.key,
+                                                 morsel.coded_value))
+                    names.append(morsel.key)
+                if fragments:
+                    paths.append((path, fragments, names))
+        for domain, path, name in expired:
+            del self[domain][path][name]
+        # see rfc 6265, section 5.4, longer paths first
+        paths.sort(key=lambda item: -len(item[0]))
+        return valid_until, paths
@@ -35,6 +35,8 @@ import paramiko
 
 from utils import mmn_encode, trace, package_tests, get_virtualenv_script, \
     get_version
+from ResultFile import open_result, is_binary_result, read_results
+from BodyStore import get_body_store_path
 
 try:
     from funkload.rtfeedback import (FeedbackPublisher,
@@ -155,6 +157,19 @@ class SSHDistributor(DistributorBase):
             trace("failed to get %s->%s with error %s\n" %
                   (local_path, remote_path, error))
 
+    @requiresconnection
+    def listdir(self, remote_path):
+        """
+        returns the names of the entries of the ``remote_path``
+        directory.
+        """
+        try:
+            sftp = self.connection.open_sftp()
+            return sftp.listdir(remote_path)
+        except Exception, error:
+            trace("failed to list %s with error %s\n" % (remote_path, error))
+            return []
+
     @requiresconnection
     def put(self, local_path, remote_path):
         """
@@ -621,6 +636,15 @@ class DistributionMgr(threading.Thread):
                 worker.get(remote_file, local_file)
                 trace("* Received bench log from [%s] into %s\n" % (
                     worker.name, local_file))
+                remote_store = get_body_store_path(remote_file)
+                if worker.isdir(remote_store):
+                    # the bodies of the failures
+                    local_store = get_body_store_path(local_file)
+                    if not os.path.isdir(local_store):
+                        os.makedirs(local_store)
+                    for name in worker.listdir(remote_store):
+                        worker.get(remote_store + '/' + name,
+                                   os.path.join(local_store, name))
 
     def startMonitors(self):
         """Start monitoring on hosts list."""
@@ -701,12 +725,22 @@ class DistributionMgr(threading.Thread):
 
             fd.write("</funkload>\n")
 
+    def _read_test_results(self, result_path):
+        """Return the attributes of the testResult records of a result file
+        in the xml or binary format."""
+        if is_binary_result(result_path):
+            return [attrs for name, attrs in read_results(result_path)
+                    if name == 'testResult']
+        results_tree = ElementTree(file=open_result(result_path))
+        return [element.attrib
+                for element in results_tree.findall("testResult")]
+
     def _calculate_time_skew(self, results, stats):
         if not results or not stats:
             return 1
 
         def min_time(vals):
-            keyfunc = lambda elem: float(elem.attrib['time'])
+            keyfunc = lambda attrs: float(attrs['time'])
             return keyfunc(min(vals, key=keyfunc))
 
         results_min = min_time(results)
@@ -717,13 +751,13 @@ class DistributionMgr(threading.Thread):
     def _calculate_results_ranges(self, results):
         seen = []
         times = {}
-        for element in results:
-            cycle = int(element.attrib['cycle'])
+        for attrs in results:
+            cycle = int(attrs['cycle'])
             if cycle not in seen:
                 seen.append(cycle)
 
-                cvus = int(element.attrib['cvus'])
-                start_time = float(element.attrib['time'])
+                cvus = int(attrs['cvus'])
+                start_time = float(attrs['time'])
                 times[start_time] = (cycle, cvus)
 
         return times
@@ -733,8 +767,10 @@ class DistributionMgr(threading.Thread):
         if not self.monitor_hosts:
             return
         for worker, results in self._worker_results.items():
-            files = glob("%s/%s-*.xml" % (self.distribution_output,
-                                          worker.name))
+            # the result file of any format, see final_collect
+            files = [path for path in glob("%s/%s-*" % (
+                        self.distribution_output, worker.name))
+                     if os.path.isfile(path) and '.bak-' not in path]
             if files:
                 result_path = files[0]
                 break
@@ -744,13 +780,13 @@ class DistributionMgr(threading.Thread):
             return
 
         # Calculate the ratio between results and monitoring
-        results_tree = ElementTree(file=result_path)
+        results = self._read_test_results(result_path)
         stats_path = os.path.join(self.distribution_output, "stats.xml")
         stats_tree = ElementTree(file=stats_path)
 
-        results = results_tree.findall("testResult")
         stats = stats_tree.findall("monitor")
-        ratio = self._calculate_time_skew(results, stats)
+        ratio = self._calculate_time_skew(results,
+                                          [stat.attrib for stat in stats])
 
         # Now that we have the ratio, we can calculate the sessions!
         times = self._calculate_results_ranges(results)
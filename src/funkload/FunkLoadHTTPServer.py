@@ -29,6 +29,8 @@ class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     These are the requests currently supported:
     /cvu?inc=<INTEGER> :: Increments number of CVU by given value.
     /cvu?dec=<INTEGER> :: Decrements number of CVU by given value.
+    /getcvu :: Returns the number of CVU.
+    /rates :: Returns the success, failures and errors per second.
     """
     benchrunner = None
     def do_GET(self):
@@ -51,6 +53,9 @@ class FunkLoadHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                                  (old_num_threads, new_num_threads))
         elif parsed_url.path == '/getcvu':
             self.respond('CVU = %d' % benchrunner.getNumberOfThreads())
+        elif parsed_url.path == '/rates':
+            self.respond('SUCCESS = %.2f/s FAILURES = %.2f/s ERRORS = %.2f/s'
+                         % benchrunner.rates)
 
     def respond(self, message):
         self.send_response(200)
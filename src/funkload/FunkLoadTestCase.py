@@ -23,11 +23,13 @@ $Id: FunkLoadTestCase.py 24757 2005-08-31 12:22:19Z bdelbosc $
 import os
 import sys
 import time
+import copy
 import string
 import re
 import logging
 import gzip
 import threading
+from collections import deque
 from StringIO import StringIO
 from warnings import warn
 from socket import error as SocketError
@@ -41,12 +43,21 @@ from tempfile import mkdtemp
 from xml.sax.saxutils import quoteattr
 from urlparse import urljoin
 from ConfigParser import ConfigParser, NoSectionError, NoOptionError
+from ConfigParser import InterpolationError
 
 from webunit.webunittest import WebTestCase, HTTPError
 
 import PatchWebunit
+from PatchWebunit import ConnectionPool
+from ResourceCache import ResourceCache, get_process_cache
+from LinkExtractor import get_page_links
+from Resolver import get_resolver
+from ConnectionFactory import get_connection_factory
 from utils import get_default_logger, mmn_is_bench, mmn_decode, Data
 from utils import recording, thread_sleep, is_html, get_version, trace
+from utils import active_cvus, REQUEST_PHASES
+from ResultFile import RecordBuilder
+from BodyStore import get_body_store, get_body_store_path, format_headers
 from xmlrpclib import ServerProxy
 
 _marker = []
@@ -75,6 +86,71 @@ class ConfSectionFinder(object):
                 return set(section+attr).issubset(self.allowedChars)
         return ConfKeyFinder()
 
+class ConfigSnapshot(object):
+    """A configuration file parsed once and shared by the test cases.
+
+    Values are interpolated and stored in dictionaries, command line
+    options take precedence, resolved values are cached. The snapshot is
+    not changed once built, a test that needs a ConfigParser gets its own
+    with getParser."""
+    def __init__(self, config_path, options):
+        parser = ConfigParser()
+        parser.read(config_path)
+        sections = {}
+        for section in parser.sections():
+            values = {}
+            for key in parser.options(section):
+                try:
+                    values[key] = parser.get(section, key)
+                except InterpolationError:
+                    values[key] = parser.get(section, key, raw=True)
+            sections[section] = values
+        self.config_path = config_path
+        self.options = options
+        self.sections = sections
+        self.resolved = {}
+
+    def has_section(self, section):
+        return section in self.sections
+
+    def getParser(self):
+        """Return a new ConfigParser of the configuration file."""
+        parser = ConfigParser()
+        parser.read(self.config_path)
+        return parser
+
+    def get(self, section, key, default=None):
+        """Return an entry from the options or the configuration file."""
+        value = self.resolved.get((section, key), _marker)
+        if value is _marker:
+            value = getattr(self.options, '%s_%s' % (section, key), None)
+            if not value:
+                value = self.sections.get(section, {}).get(key.lower(),
+                                                           _marker)
+            self.resolved[(section, key)] = value
+        if value is _marker:
+            return default
+        return value
+
+_config_snapshots = {}
+_config_snapshots_lock = threading.Lock()
+
+def get_config_snapshot(config_path, options):
+    """Return the configuration snapshot of a file and options."""
+    key = (config_path, id(options))
+    snapshot = _config_snapshots.get(key)
+    if snapshot is None or snapshot.options is not options:
+        _config_snapshots_lock.acquire()
+        try:
+            snapshot = _config_snapshots.get(key)
+            if snapshot is None or snapshot.options is not options:
+                snapshot = ConfigSnapshot(config_path, options)
+                _config_snapshots[key] = snapshot
+        finally:
+            _config_snapshots_lock.release()
+    return snapshot
+
+
 class FunkLoadTestCase(unittest.TestCase):
     """Unit test with browser and configuration capabilties."""
     # ------------------------------------------------------------
@@ -93,6 +169,7 @@ class FunkLoadTestCase(unittest.TestCase):
             methodName)
         self.meta_method_name = methodName
         self.suite_name = self.__class__.__name__
+        self._record_builder = RecordBuilder(self.suite_name, self.test_name)
         unittest.TestCase.__init__(self, methodName=self.test_name)
         self._response = None
         self._options = options
@@ -138,9 +215,8 @@ class FunkLoadTestCase(unittest.TestCase):
         config_path = os.path.abspath(os.path.expanduser(config_path))
         if not os.path.exists(config_path):
             config_path = "Missing: "+ config_path
-        config = ConfigParser()
-        config.read(config_path)
-        self._config = config
+        self._config_snapshot = get_config_snapshot(config_path,
+                                                    self._options)
         self._config_path = config_path
         self.conf = ConfSectionFinder(self)
         self.default_user_agent = self.conf_get('main', 'user_agent',
@@ -157,10 +233,65 @@ class FunkLoadTestCase(unittest.TestCase):
         self.sleep_time_max = self.conf_getFloat(section, 'sleep_time_max', 0)
         self._simple_fetch = self.conf_getInt(section, 'simple_fetch', 0,
                                               quiet=True)
+        self._keep_alive = self.conf_getInt(section, 'keep_alive', 0,
+                                            quiet=True)
+        self._keep_alive_across_tests = self.conf_getInt(
+            section, 'keep_alive_across_tests', 0, quiet=True)
+        self._parallel_fetch = self.conf_getInt(section, 'parallel_fetch', 0,
+                                                quiet=True)
+        self._max_connections_per_host = self.conf_getInt(
+            section, 'max_connections_per_host', 6, quiet=True)
+        self._http_cache = self.conf_getInt(section, 'http_cache', 0,
+                                            quiet=True)
+        self._http_cache_scope = self.conf_get(section, 'http_cache_scope',
+                                               'vu', quiet=True)
+        self._http_cache_size = int(1024 * 1024 * self.conf_getFloat(
+            section, 'http_cache_size', 10, quiet=True))
+        self._history_size = self.conf_getInt(section, 'history_size', 100,
+                                              quiet=True)
+        self._body_retention = self.conf_get(section, 'body_retention',
+                                             'last', quiet=True)
+        # the resolver is shared by the process
+        hosts = {}
+        for name, addresses in self._config_snapshot.sections.get(
+            'hosts', {}).items():
+            hosts[name] = addresses.replace(',', ' ').split()
+        get_resolver().configure(
+            self.conf_getFloat(section, 'dns_cache_ttl', 0, quiet=True),
+            hosts)
+        # so is the connection factory, proxies default to the environment
+        get_connection_factory().configure(
+            self.conf_get(section, 'http_proxy', None, quiet=True),
+            self.conf_get(section, 'https_proxy', None, quiet=True),
+            self.conf_get(section, 'no_proxy', None, quiet=True),
+            self.conf_getFloat(section, 'socket_timeout', 0, quiet=True),
+            self.conf_getInt(section, 'tcp_nodelay', 0, quiet=True))
         self.log_to = self.conf_get(section, 'log_to', 'console file')
         self.log_path = self.conf_get(section, 'log_path', 'funkload.log')
         self.result_path = os.path.abspath(
             self.conf_get(section, 'result_path', 'funkload.xml'))
+        self.result_format = self.conf_get(section, 'result_format', 'xml',
+                                           quiet=True)
+        if self.result_format not in ('xml', 'binary'):
+            raise ValueError('Invalid result_format %r, expecting xml or '
+                             'binary' % self.result_format)
+        self._binary_results = self.result_format == 'binary'
+        if self.in_bench_mode:
+            # the results are written in batches by a writer thread
+            self.result_flush_interval = self.conf_getFloat(
+                section, 'result_flush_interval', 1.0, quiet=True)
+            self.result_queue_size = self.conf_getInt(
+                section, 'result_queue_size', 100000, quiet=True)
+        else:
+            self.result_flush_interval = 0
+            self.result_queue_size = 0
+        # the bodies of the failures are stored once next to the results
+        if self.conf_getInt(section, 'store_failure_bodies',
+                            self.in_bench_mode and 1 or 0, quiet=True):
+            self._body_store = get_body_store(
+                get_body_store_path(self.result_path))
+        else:
+            self._body_store = None
 
         # init loggers
         if self.in_bench_mode:
@@ -169,15 +300,29 @@ class FunkLoadTestCase(unittest.TestCase):
             level = logging.DEBUG
         self.logger = get_default_logger(self.log_to, self.log_path,
                                          level=level)
-        self.logger_result = get_default_logger(log_to="xml",
-                                                log_path=self.result_path,
-                                                name="FunkLoadResult")
+        self.logger_result = get_default_logger(
+            log_to=self.result_format, log_path=self.result_path,
+            name="FunkLoadResult", flush_interval=self.result_flush_interval,
+            queue_size=self.result_queue_size)
         #self.logd('_funkload_init config [%s], log_to [%s],'
         #          ' log_path [%s], result [%s].' % (
         #    self._config_path, self.log_to, self.log_path, self.result_path))
 
+        # delay between the intended and the actual start of the test, set
+        # by the bench runner when the tests are scheduled
+        self.schedule_lag = None
+
         # init webunit browser (passing a fake methodName)
         self._browser = WebTestCase(methodName='log')
+        if self._keep_alive:
+            self._browser.connection_pool = ConnectionPool()
+        self._browser.parallel_fetch = self._parallel_fetch
+        self._browser.max_connections_per_host = self._max_connections_per_host
+        if self._http_cache and self._http_cache_scope == 'process':
+            self._browser.resource_cache = get_process_cache(
+                self._http_cache_size)
+        elif self._http_cache:
+            self._browser.resource_cache = ResourceCache(self._http_cache_size)
         self.clearContext()
 
         #self.logd('# FunkLoadTestCase._funkload_init done')
@@ -192,8 +337,10 @@ class FunkLoadTestCase(unittest.TestCase):
         """Reset the testcase."""
         self._browser.clearContext()
         self._browser.css = {}
-        self._browser.history = []
+        self._browser.history = deque(maxlen=self._history_size)
         self._browser.extra_headers = []
+        if self._keep_alive and not self._keep_alive_across_tests:
+            self._browser.connection_pool.clear()
         if self.debug_level >= 3:
             self._browser.debug_headers = True
         else:
@@ -364,7 +511,8 @@ class FunkLoadTestCase(unittest.TestCase):
             c_start = self.total_time
             try:
                 # pageImages is patched to call _log_response on all links
-                self._browser.pageImages(url, page, self)
+                self._browser.pageImages(url, page, self,
+                                         get_page_links(response))
             except HTTPError, error:
                 if self._accept_invalid_links:
                     if not self.in_bench_mode:
@@ -376,14 +524,22 @@ class FunkLoadTestCase(unittest.TestCase):
                     self.test_status = 'Failure'
                     self.logd('  Failed in ~ %.2fs' % t_delta)
                     # XXX The duration logged for this response is wrong
+                    # unless the links are fetched in parallel
                     self._log_response(error.response, 'link', None,
-                                       t_start, t_stop, log_body=True)
+                                       getattr(error, 'time_start', t_start),
+                                       getattr(error, 'time_stop', t_stop),
+                                       log_body=True)
                     raise self.failureException, str(error)
             c_stop = self.total_time
             self.logd('  Done in %.3fs' % (c_stop - c_start))
         if sleep:
             self.sleep()
-        self._response = response
+        if self._body_retention == 'none':
+            # keep only what getLastUrl needs
+            self._response = copy.copy(response)
+            self._response.body = None
+        else:
+            self._response = response
 
         # Loop mode
         if self._loop_mode and self.steps == self._loop_steps[-1]:
@@ -558,20 +714,35 @@ class FunkLoadTestCase(unittest.TestCase):
                 return
             time.sleep(sleep_time)
 
-    def comet(self, url, consumer, description=None):
-        """Initiate a comet request and process the input in a separate thread.
-        This call is async and return a thread object.
+    def comet(self, url, consumer, description=None, framing=None):
+        """Initiate a comet request, the response body is read by the stream
+        selector of the process. This call is async and return a stream
+        object that can be joined.
 
-        The consumer method takes as parameter an input string, it can
-        close the comet connection by returning 0."""
+        The consumer method takes as parameter a message, it can close the
+        comet connection by returning 0. The framing of the messages is
+        'sse' for Server-Sent Events, 'line' or 'raw', by default 'sse' for
+        a text/event-stream response and 'line' otherwise.
+
+        Each message is logged as an event response, its duration is the
+        time waited since the previous message."""
         self.steps += 1
         self.page_responses = 0
-        thread = threading.Thread(target=self._cometFetcher, args=(url, consumer, description))
-        thread.start()
-        return thread
-
-    def _cometFetcher(self, url, consumer, description):
-        self._connect(url, None, self.ok_codes, 'GET', description, consumer=consumer)
+        response = self._connect(url, None, self.ok_codes, 'GET',
+                                 description, consumer=consumer)
+        stream = getattr(response, 'stream', None)
+        if stream is None:
+            self.fail('No stream to read for %s, got a %s response '
+                      'without a body' % (url, response.code))
+        step, number = self.steps, self.page_responses
+        code = response.code
+        # the events have the url of their request record
+        response_url = response.url
+
+        def log_event(message, time_start, time_stop):
+            self._log_event(response_url, description, step, number, code,
+                            time_start, time_stop)
+        return stream.start(framing, log_event)
 
     def setBasicAuth(self, login, password):
         """Set HTTP basic authentication for the following requests."""
@@ -675,9 +846,11 @@ class FunkLoadTestCase(unittest.TestCase):
         return ''
 
     def getBody(self):
-        """Return the last response content."""
+        """Return the last response content.
+
+        Empty when the body_retention configuration is none."""
         response = self._response
-        if response is not None:
+        if response is not None and response.body is not None:
             return response.body
         return ''
 
@@ -687,14 +860,8 @@ class FunkLoadTestCase(unittest.TestCase):
         Filtering href with url pattern or link text pattern."""
         response = self._response
         ret = []
-        if response is not None:
-            a_links = response.getDOM().getByName('a')
-            if a_links:
-                for link in a_links:
-                    try:
-                        ret.append((link.getContentString(), link.href))
-                    except AttributeError:
-                        pass
+        if response is not None and response.body is not None:
+            ret = get_page_links(response).anchors
             if url_pattern is not None:
                 pat = re.compile(url_pattern)
                 ret = [link for link in ret
@@ -708,34 +875,51 @@ class FunkLoadTestCase(unittest.TestCase):
     def getLastBaseUrl(self):
         """Return the base href url."""
         response = self._response
-        if response is not None:
-            base = response.getDOM().getByName('base')
-            if base:
-                return base[0].href
+        if response is not None and response.body is not None:
+            base = get_page_links(response).base
+            if base is not None:
+                return base
         return ''
 
     #------------------------------------------------------------
     # configuration file utils
     #
+    def _get_config(self):
+        """The ConfigParser of this test, read on first use so that its
+        changes are not seen by the other tests."""
+        config = self.__dict__.get('_test_config')
+        if config is None:
+            config = self._test_config = self._config_snapshot.getParser()
+        return config
+
+    def _set_config(self, config):
+        self._test_config = config
+
+    _config = property(_get_config, _set_config)
+
     def conf_get(self, section, key, default=_marker, quiet=False):
         """Return an entry from the options or configuration file."""
-        # check for a command line options
-        opt_key = '%s_%s' % (section, key)
-        opt_val = getattr(self._options, opt_key, None)
-        if opt_val:
-            #print('[%s] %s = %s from options.' % (section, key, opt_val))
-            return opt_val
-        # check for the configuration file if opt val is None
-        # or nul
-        try:
-            val = self._config.get(section, key)
-        except (NoSectionError, NoOptionError):
+        config = self.__dict__.get('_test_config')
+        if config is None:
+            val = self._config_snapshot.get(section, key, _marker)
+        else:
+            # the test has its own ConfigParser
+            val = getattr(self._options, '%s_%s' % (section, key), None)
+            if not val:
+                try:
+                    val = config.get(section, key)
+                except (NoSectionError, NoOptionError):
+                    val = _marker
+        if val is _marker:
             if not quiet:
                 self.logi('[%s] %s not found' % (section, key))
             if default is _marker:
-                raise
+                if config is None:
+                    config = self._config_snapshot
+                if not config.has_section(section):
+                    raise NoSectionError(section)
+                raise NoOptionError(key, section)
             val = default
-        #print('[%s] %s = %s from config.' % (section, key, val))
         return val
 
     def conf_getInt(self, section, key, default=_marker, quiet=False):
@@ -830,68 +1014,116 @@ class FunkLoadTestCase(unittest.TestCase):
         """Close the result log."""
         self._logr('</funkload>', force=True)
 
+    def _bench_attributes(self, duration):
+        """Return the extra attributes of a record set by the bench runner,
+        as a list of (name, value).
+
+        The duration of a scheduled test is corrected with the schedule lag
+        so that a late test accounts for the waiting time (coordinated
+        omission). With a load shape the number of active users is added."""
+        attributes = []
+        if self.schedule_lag is not None:
+            attributes.append(('corrected_duration',
+                               duration + self.schedule_lag))
+        cvus = active_cvus()
+        if cvus is not None:
+            attributes.append(('active_cvus', cvus))
+        return attributes
+
+    def _response_attributes(self, response):
+        """Return the extra attributes of a response record."""
+        attributes = []
+        connection = getattr(response, 'connection', None)
+        if connection is not None:
+            attributes.append(('connection', connection))
+        cache = getattr(response, 'cache', None)
+        if cache is not None:
+            attributes.append(('cache', cache))
+        wire_bytes = getattr(response, 'wire_bytes', None)
+        if wire_bytes:
+            attributes.extend([('request_bytes', wire_bytes[0]),
+                               ('response_bytes', wire_bytes[1]),
+                               ('decoded_bytes', len(response.body or ''))])
+        timings = getattr(response, 'timings', None)
+        if timings:
+            # a reused connection has no dns, connect and tls phases
+            for phase in REQUEST_PHASES:
+                attributes.append((phase, float(timings.get(phase, 0))))
+        return attributes
+
+    def _logr_record(self, name, fields, extra):
+        """Log a record of the binary result format."""
+        self._logr((name, fields, extra))
+
+    def _logr_response(self, step, number, rtype, result, url, code,
+                       description, time_start, duration, extra):
+        """Log a response record."""
+        if self.in_bench_mode and not recording():
+            return
+        if self._binary_results:
+            self._logr_record('response', (
+                    self.cycle, self.cvus, self.thread_id, self.suite_name,
+                    self.test_name, step, number, rtype, result, url, code,
+                    description, time_start, duration), extra)
+            return
+        self._logr(self._record_builder.response(
+                self.cycle, self.cvus, self.thread_id, step, number, rtype,
+                result, url, code, description, time_start, duration,
+                extra) + ' />')
+
     def _log_response_error(self, url, rtype, description, time_start,
                             time_stop):
         """Log a response that raise an unexpected exception."""
         self.total_responses += 1
         self.page_responses += 1
-        info = {}
-        info['cycle'] = self.cycle
-        info['cvus'] = self.cvus
-        info['thread_id'] = self.thread_id
-        info['suite_name'] = self.suite_name
-        info['test_name'] = self.test_name
-        info['step'] = self.steps
-        info['number'] = self.page_responses
-        info['type'] = rtype
-        info['url'] = quoteattr(url)
-        info['code'] = -1
-        info['description'] = description and quoteattr(description) or '""'
-        info['time_start'] = time_start
-        info['duration'] = time_stop - time_start
-        info['result'] = 'Error'
-        info['traceback'] = quoteattr(' '.join(
-            traceback.format_exception(*sys.exc_info())))
-        message = '''<response cycle="%(cycle).3i" cvus="%(cvus).3i" thread="%(thread_id).3i" suite="%(suite_name)s" name="%(test_name)s" step="%(step).3i" number="%(number).3i" type="%(type)s" result="%(result)s" url=%(url)s code="%(code)s" description=%(description)s time="%(time_start)s" duration="%(duration)s" traceback=%(traceback)s />''' % info
-        self._logr(message)
+        duration = time_stop - time_start
+        trace_back = ' '.join(traceback.format_exception(*sys.exc_info()))
+        self._logr_response(self.steps, self.page_responses, rtype, 'Error',
+                            url, -1, description, time_start, duration,
+                            self._bench_attributes(duration) +
+                            [('traceback', trace_back)])
 
     def _log_response(self, response, rtype, description, time_start,
                       time_stop, log_body=False):
         """Log a response."""
         self.total_responses += 1
         self.page_responses += 1
-        info = {}
-        info['cycle'] = self.cycle
-        info['cvus'] = self.cvus
-        info['thread_id'] = self.thread_id
-        info['suite_name'] = self.suite_name
-        info['test_name'] = self.test_name
-        info['step'] = self.steps
-        info['number'] = self.page_responses
-        info['type'] = rtype
-        info['url'] = quoteattr(response.url)
-        info['code'] = response.code
-        info['description'] = description and quoteattr(description) or '""'
-        info['time_start'] = time_start
-        info['duration'] = time_stop - time_start
-        info['result'] = self.step_success and 'Successful' or 'Failure'
-        response_start = '''<response cycle="%(cycle).3i" cvus="%(cvus).3i" thread="%(thread_id).3i" suite="%(suite_name)s" name="%(test_name)s" step="%(step).3i" number="%(number).3i" type="%(type)s" result="%(result)s" url=%(url)s code="%(code)s" description=%(description)s time="%(time_start)s" duration="%(duration)s"''' % info
-
+        duration = time_stop - time_start
+        extra = (self._bench_attributes(duration) +
+                 self._response_attributes(response))
+        result = self.step_success and 'Successful' or 'Failure'
         if not log_body:
-            message = response_start + ' />'
-        else:
-            response_start = response_start + '>\n  <headers>'
-            header_xml = []
-            if response.headers is not None:
-                for key, value in response.headers.items():
-                    header_xml.append('    <header name="%s" value=%s />' % (
-                            key, quoteattr(value)))
-            headers = '\n'.join(header_xml) + '\n  </headers>'
-            message = '\n'.join([
-                response_start,
-                headers,
-                '  <body><![CDATA[\n%s\n]]>\n  </body>' % response.body,
-                '</response>'])
+            self._logr_response(self.steps, self.page_responses, rtype,
+                                result, response.url, response.code,
+                                description, time_start, duration, extra)
+            return
+        if self._body_store is not None:
+            if not self.in_bench_mode or recording():
+                extra.extend([
+                        ('headers_hash', self._body_store.add(
+                                format_headers(response.headers))),
+                        ('body_hash', self._body_store.add(
+                                response.body or ''))])
+            self._logr_response(self.steps, self.page_responses, rtype,
+                                result, response.url, response.code,
+                                description, time_start, duration, extra)
+            return
+        # the headers and the body are logged as xml in both formats
+        response_start = self._record_builder.response(
+            self.cycle, self.cvus, self.thread_id, self.steps,
+            self.page_responses, rtype, result, response.url, response.code,
+            description, time_start, duration, extra) + '>\n  <headers>'
+        header_xml = []
+        if response.headers is not None:
+            for key, value in response.headers.items():
+                header_xml.append('    <header name="%s" value=%s />' % (
+                        key, quoteattr(value)))
+        headers = '\n'.join(header_xml) + '\n  </headers>'
+        message = '\n'.join([
+            response_start,
+            headers,
+            '  <body><![CDATA[\n%s\n]]>\n  </body>' % response.body,
+            '</response>'])
         self._logr(message)
 
     def _log_xmlrpc_response(self, url, method, description, response,
@@ -899,50 +1131,40 @@ class FunkLoadTestCase(unittest.TestCase):
         """Log a response."""
         self.total_responses += 1
         self.page_responses += 1
-        info = {}
-        info['cycle'] = self.cycle
-        info['cvus'] = self.cvus
-        info['thread_id'] = self.thread_id
-        info['suite_name'] = self.suite_name
-        info['test_name'] = self.test_name
-        info['step'] = self.steps
-        info['number'] = self.page_responses
-        info['type'] = 'xmlrpc'
-        info['url'] = quoteattr(url + '#' + method)
-        info['code'] = code
-        info['description'] = description and quoteattr(description) or '""'
-        info['time_start'] = time_start
-        info['duration'] = time_stop - time_start
-        info['result'] = self.step_success and 'Successful' or 'Failure'
-        message = '''<response cycle="%(cycle).3i" cvus="%(cvus).3i" thread="%(thread_id).3i" suite="%(suite_name)s" name="%(test_name)s" step="%(step).3i" number="%(number).3i" type="%(type)s" result="%(result)s" url=%(url)s code="%(code)s" description=%(description)s time="%(time_start)s" duration="%(duration)s" />"''' % info
-        self._logr(message)
+        duration = time_stop - time_start
+        self._logr_response(self.steps, self.page_responses, 'xmlrpc',
+                            self.step_success and 'Successful' or 'Failure',
+                            url + '#' + method, code, description, time_start,
+                            duration, self._bench_attributes(duration))
+
+    def _log_event(self, url, description, step, number, code, time_start,
+                   time_stop):
+        """Log a message received on a stream."""
+        self._logr_response(step, number, 'event', 'Successful', url, code,
+                            description, time_start, time_stop - time_start,
+                            [])
 
     def _log_result(self, time_start, time_stop):
         """Log the test result."""
-        info = {}
-        info['cycle'] = self.cycle
-        info['cvus'] = self.cvus
-        info['thread_id'] = self.thread_id
-        info['suite_name'] = self.suite_name
-        info['test_name'] = self.test_name
-        info['steps'] = self.steps
-        info['time_start'] = time_start
-        info['duration'] = time_stop - time_start
-        info['connection_duration'] = self.total_time
-        info['requests'] = self.total_responses
-        info['pages'] = self.total_pages
-        info['xmlrpc'] = self.total_xmlrpc
-        info['redirects'] = self.total_redirects
-        info['images'] = self.total_images
-        info['links'] = self.total_links
-        info['result'] = self.test_status
+        duration = time_stop - time_start
+        extra = self._bench_attributes(duration)
         if self.test_status != 'Successful':
-            info['traceback'] = 'traceback=' + quoteattr(' '.join(
-                traceback.format_exception(*sys.exc_info()))) + ' '
-        else:
-            info['traceback'] = ''
-        text = '''<testResult cycle="%(cycle).3i" cvus="%(cvus).3i" thread="%(thread_id).3i" suite="%(suite_name)s" name="%(test_name)s"  time="%(time_start)s" result="%(result)s" steps="%(steps)s" duration="%(duration)s" connection_duration="%(connection_duration)s" requests="%(requests)s" pages="%(pages)s" xmlrpc="%(xmlrpc)s" redirects="%(redirects)s" images="%(images)s" links="%(links)s" %(traceback)s/>''' % info
-        self._logr(text)
+            trace_back = ' '.join(traceback.format_exception(*sys.exc_info()))
+            extra.append(('traceback', trace_back))
+        if self._binary_results:
+            self._logr_record('testResult', (
+                    self.cycle, self.cvus, self.thread_id, self.suite_name,
+                    self.test_name, time_start, self.test_status, self.steps,
+                    duration, self.total_time, self.total_responses,
+                    self.total_pages, self.total_xmlrpc, self.total_redirects,
+                    self.total_images, self.total_links), extra)
+            return
+        self._logr(self._record_builder.testResult(
+                self.cycle, self.cvus, self.thread_id, time_start,
+                self.test_status, self.steps, duration, self.total_time,
+                self.total_responses, self.total_pages, self.total_xmlrpc,
+                self.total_redirects, self.total_images, self.total_links,
+                extra))
 
     def _dump_content(self, response, description):
         """Dump the html content in a file.
@@ -0,0 +1,67 @@
+# (C) Copyright 2005-2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Bench runner using gevent green threads as virtual users.
+
+A green thread costs a few KB instead of an OS thread stack, this makes
+possible to bench with thousands of mostly idle virtual users:
+
+  fl-run-bench -r funkload.GreenRunner.GreenBenchRunner -c 5000 ...
+
+The funkload package patches the stdlib with gevent when it is installed,
+sockets are then non blocking and virtual users switch on each I/O or sleep.
+The result file is the same as with the default runner.
+"""
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from BenchRunner import BenchRunner, LoopTestRunner
+from utils import set_cooperative_sleep
+
+
+class GreenLoopTestRunner(LoopTestRunner):
+    """Run a unit test in loop in a greenlet."""
+
+    def __init__(self, *args, **kw):
+        LoopTestRunner.__init__(self, *args, **kw)
+        self.greenlet = None
+
+    def start(self):
+        self.greenlet = gevent.spawn(self.run)
+
+    def join(self, timeout=None):
+        self.greenlet.join(timeout)
+
+    def isAlive(self):
+        return self.greenlet is not None and not self.greenlet.dead
+    is_alive = isAlive
+
+
+class GreenBenchRunner(BenchRunner):
+    """Run a unit test in bench mode with green threads."""
+    loop_runner_class = GreenLoopTestRunner
+
+    def __init__(self, module_name, class_name, method_name, options):
+        if gevent is None:
+            raise ImportError('GreenBenchRunner requires gevent, '
+                              'try: pip install gevent')
+        BenchRunner.__init__(self, module_name, class_name, method_name,
+                             options)
+        set_cooperative_sleep(gevent.sleep)
+
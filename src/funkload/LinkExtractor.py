@@ -0,0 +1,208 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Extract the links of an html page in a single scan.
+
+The images, links, scripts, anchors and base of a page are found using
+compiled patterns instead of an sgml parser or a DOM, comments and script
+contents are skipped. The result is cached on the response.
+
+Run this module with html files or urls to compare its speed with the
+webunit parsers:
+
+  python -m funkload.LinkExtractor page.html http://localhost/
+"""
+import re
+import sys
+import time
+import urllib
+import urlparse
+
+_TAG = re.compile(r'''<(?:!--.*?--\s*>|(img|link|script|a|base)\b((?:[^>"']|"[^"]*"|'[^']*')*)>)''',
+                  re.I | re.S)
+_ATTR = re.compile(r'''([^\s=/>"']+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]*))?''')
+_SCRIPT_END = re.compile(r'</script\s*>', re.I)
+_A_END = re.compile(r'</a\s*>', re.I)
+_REF = re.compile(r'&(#[0-9]+|amp|lt|gt|quot|apos);')
+_REFS = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# tag: (resource type, url attribute)
+_RESOURCES = {'img': ('image', 'src'),
+              'link': ('link', 'href'),
+              'script': ('script', 'src')}
+
+
+def _convert_ref(match):
+    ref = match.group(1)
+    if ref[0] == '#':
+        code = int(ref[1:])
+        if code < 128:
+            return chr(code)
+        return match.group(0)
+    return _REFS[ref]
+
+def _unescape(value):
+    if '&' in value:
+        return _REF.sub(_convert_ref, value)
+    return value
+
+def _get_attributes(text):
+    """Return the attributes of a tag as a dict with lower case names."""
+    attributes = {}
+    for name, value in _ATTR.findall(text):
+        name = name.lower()
+        if name in attributes:
+            continue
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attributes[name] = _unescape(value.strip())
+    return attributes
+
+
+class PageLinks:
+    """The links of an html page.
+
+    resources is the list of (rtype, url) for images, links and scripts in
+    the page order, rtype being image, link or script. anchors is the list
+    of (content, href) and base the href of the base tag or None. Urls are
+    returned as they are in the page."""
+    def __init__(self):
+        self.resources = []
+        self.anchors = []
+        self.base = None
+
+    def getBaseUrl(self, url):
+        """Return the url to resolve the links of the page loaded from url."""
+        if self.base:
+            return urlparse.urljoin(url, self.base)
+        return url
+
+    def getResources(self, rtype):
+        return [res_url for res_type, res_url in self.resources
+                if res_type == rtype]
+
+
+def extract_links(body):
+    """Return the PageLinks of an html body."""
+    links = PageLinks()
+    resources = links.resources
+    search = _TAG.search
+    pos = 0
+    while True:
+        match = search(body, pos)
+        if match is None:
+            break
+        pos = match.end()
+        tag = match.group(1)
+        if tag is None:
+            # comment
+            continue
+        tag = tag.lower()
+        attributes = _get_attributes(match.group(2))
+        if tag == 'a':
+            href = attributes.get('href')
+            if href is not None:
+                # keep scanning the content for images
+                end = _A_END.search(body, pos)
+                if end is None:
+                    content = ''
+                else:
+                    content = body[pos:end.start()]
+                links.anchors.append((content, href))
+        elif tag == 'base':
+            if links.base is None:
+                links.base = attributes.get('href')
+        else:
+            rtype, name = _RESOURCES[tag]
+            url = attributes.get(name)
+            if url:
+                resources.append((rtype, url))
+            if tag == 'script' and not match.group(2).rstrip().endswith('/'):
+                end = _SCRIPT_END.search(body, pos)
+                if end is not None:
+                    pos = end.end()
+    return links
+
+
+def get_page_links(response):
+    """Return the PageLinks of a response, extracted once."""
+    links = getattr(response, 'page_links', None)
+    if links is None:
+        links = extract_links(response.body or '')
+        response.page_links = links
+    return links
+
+
+# ------------------------------------------------------------
+# micro benchmark
+#
+class _NoFetchSession:
+    """A session for the webunit IMGSucker that fetches nothing."""
+    def __init__(self):
+        self.images = {}
+
+    def fetch(self, url):
+        return None
+
+
+def _webunit_extract(url, body):
+    """Find the same links with the webunit parsers."""
+    from webunit.IMGSucker import IMGSucker
+    from webunit.SimpleDOM import SimpleDOMParser
+    sucker = IMGSucker(url, _NoFetchSession())
+    sucker.feed(body)
+    sucker.close()
+    parser = SimpleDOMParser()
+    parser.parseString(body)
+    dom = parser.getDOM()
+    return dom.getByName('a'), dom.getByName('base')
+
+
+def _timeit(func, args, number):
+    t_start = time.time()
+    for i in xrange(number):
+        func(*args)
+    return (time.time() - t_start) / number
+
+
+def main():
+    """Compare the extractor with the webunit parsers."""
+    if len(sys.argv) < 2:
+        print __doc__
+        return
+    number = 20
+    print '%-40s %8s %10s %10s %8s' % ('PAGE', 'SIZE', 'WEBUNIT', 'EXTRACTOR',
+                                       'SPEEDUP')
+    for name in sys.argv[1:]:
+        if name.startswith('http://') or name.startswith('https://'):
+            url = name
+            body = urllib.urlopen(name).read()
+        else:
+            url = 'file://' + name
+            body = open(name).read()
+        try:
+            t_webunit = _timeit(_webunit_extract, (url, body), number)
+        except Exception, error:
+            print '%-40s webunit failed: %s' % (name[-40:], error)
+            continue
+        t_extractor = _timeit(extract_links, (body,), number)
+        print '%-40s %8d %9.2fms %9.2fms %7.1fx' % (
+            name[-40:], len(body), t_webunit * 1000, t_extractor * 1000,
+            t_webunit / max(t_extractor, 1e-9))
+
+if __name__ == '__main__':
+    main()
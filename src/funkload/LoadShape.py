@@ -0,0 +1,98 @@
+# (C) Copyright 2005-2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Load shapes, the number of concurrent users during a bench cycle.
+
+A load shape is selected in the bench section of the configuration file:
+
+  [bench]
+  load_shape = funkload.LoadShape.RampShape
+  ramp_up = 30
+  ramp_down = 10
+
+The bench runner asks the shape the number of users to run every
+load_shape_tick seconds and adds or removes threads accordingly. The
+cycle CUs is the maximum number of users of the shape.
+"""
+import math
+
+
+class LoadShape:
+    """Constant load, the base class of the load shapes.
+
+    Subclasses override getUsers, extra parameters are read from the bench
+    section of the configuration using test.conf_get*."""
+
+    def __init__(self, cvus, duration, test):
+        self.cvus = cvus
+        self.duration = duration
+
+    def getUsers(self, elapsed):
+        """Return the number of users elapsed seconds after the cycle
+        start."""
+        return self.cvus
+
+
+class RampShape(LoadShape):
+    """Ramp up to the cycle CUs in ramp_up seconds, hold the plateau then
+    ramp down to 0 during the last ramp_down seconds."""
+
+    def __init__(self, cvus, duration, test):
+        LoadShape.__init__(self, cvus, duration, test)
+        self.ramp_up = test.conf_getFloat('bench', 'ramp_up', 0, quiet=True)
+        self.ramp_down = test.conf_getFloat('bench', 'ramp_down', 0,
+                                            quiet=True)
+
+    def getUsers(self, elapsed):
+        ratio = 1.0
+        if self.ramp_up and elapsed < self.ramp_up:
+            ratio = elapsed / self.ramp_up
+        remaining = self.duration - elapsed
+        if self.ramp_down and remaining < self.ramp_down:
+            ratio = min(ratio, max(0, remaining) / self.ramp_down)
+        return int(math.ceil(ratio * self.cvus))
+
+
+class StepShape(LoadShape):
+    """Staircase from cycle CUs / steps to the cycle CUs in steps equal
+    stages."""
+
+    def __init__(self, cvus, duration, test):
+        LoadShape.__init__(self, cvus, duration, test)
+        self.steps = max(1, test.conf_getInt('bench', 'steps', 5, quiet=True))
+
+    def getUsers(self, elapsed):
+        step = min(self.steps, int(elapsed * self.steps / self.duration) + 1)
+        return int(math.ceil(float(self.cvus) * step / self.steps))
+
+
+class SpikeShape(LoadShape):
+    """Run spike_base ratio of the cycle CUs with a spike at the cycle
+    CUs starting at spike_start seconds during spike_duration seconds."""
+
+    def __init__(self, cvus, duration, test):
+        LoadShape.__init__(self, cvus, duration, test)
+        self.base = test.conf_getFloat('bench', 'spike_base', 0.2, quiet=True)
+        self.start = test.conf_getFloat('bench', 'spike_start',
+                                        duration / 2.0, quiet=True)
+        self.spike_duration = test.conf_getFloat('bench', 'spike_duration',
+                                                 duration / 10.0, quiet=True)
+
+    def getUsers(self, elapsed):
+        if self.start <= elapsed < self.start + self.spike_duration:
+            return self.cvus
+        return int(math.ceil(self.base * self.cvus))
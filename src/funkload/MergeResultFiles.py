@@ -19,6 +19,7 @@
 reports."""
 import xml.parsers.expat
 from utils import trace
+from ResultFile import open_result
 
 class EndOfConfig(Exception):
     pass
@@ -41,7 +42,7 @@ class FunkLoadConfigXmlParser:
         parser = xml.parsers.expat.ParserCreate()
         parser.StartElementHandler = self.handleStartElement
         try:
-            parser.ParseFile(file(xml_file))
+            parser.ParseFile(open_result(xml_file))
         except xml.parsers.expat.ExpatError, msg:
             if (self.current_element[-1]['name'] == 'funkload'
                 and str(msg).startswith('no element found')):
@@ -131,7 +132,7 @@ class MergeResultFiles:
                 dic['cycle="%3.3i" cvus="%3.3i"' % (c, node_cycles[c])] = 'cycle="%3.3i" cvus="%3.3i"' % (c, cycles[c])
                 c += 1
 
-            f = open(input_file)
+            f = open_result(input_file)
             for line in f.xreadlines():
                 if "</funkload>" in line:
                     continue
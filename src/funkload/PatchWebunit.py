@@ -26,15 +26,30 @@
 * fix HTTPResponse __repr__
 * patching webunit mimeEncode to be rfc 1945 3.6.2 compliant using CRLF
 * patching to remove cookie with a 'deleted' value
+* index the cookies by domain and path
 * patching to have application/x-www-form-urlencoded by default and only
   multipart when a file is posted
 * patch fetch postdata must be [(key, value) ...] no more dict or list value
+* stream the uploaded files instead of loading them in memory
+* keep alive connections in a pool per browser
+* fetch css and images in parallel
+* cache css and images following the http headers
+* keep only the metadata of the css and images
+* find the css and images without sgml parser
+* time the dns, connect, tls, send, ttfb and transfer phases of a request
+* count the bytes sent and received
+* open the connections with the process connection factory
+* hand the body of a streaming response to a stream reader
 
 $Id: PatchWebunit.py 24649 2005-08-29 14:20:19Z bdelbosc $
 """
 import os
 import sys
 import time
+import copy
+import errno
+import socket
+import threading
 import urlparse
 from urllib import urlencode
 import httplib
@@ -44,12 +59,16 @@ import datetime
 import Cookie
 
 from webunit import cookie
-from webunit.IMGSucker import IMGSucker
 from webunit.webunittest import WebTestCase, WebFetcher
 from webunit.webunittest import HTTPResponse, HTTPError, VERBOSE
 from webunit.utility import Upload
 
 from utils import thread_sleep, Data
+from ResourceCache import ResourceInfo
+from LinkExtractor import extract_links
+from CookieJar import CookieJar, parse_cookie_date
+from ConnectionFactory import get_connection_factory
+from StreamReader import Stream
 import re
 
 valid_url = re.compile(r'^(http|https)://[a-z0-9\.\-\:]+(\/[^\ \t\<\>]*)?$',
@@ -59,110 +78,104 @@ BOUNDARY = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
 SEP_BOUNDARY = '--' + BOUNDARY
 END_BOUNDARY = SEP_BOUNDARY + '--'
 
+class MultipartBody:
+    """A multipart/form-data body that reads the uploaded files from disk
+    while sending.
+
+    The body is a list of strings and file paths, its length is known
+    before sending and iterating on it returns chunks of at most
+    chunk_size bytes of the files."""
+    chunk_size = 65536
+
+    def __init__(self, data, sep_boundary=SEP_BOUNDARY,
+                 end_boundary=END_BOUNDARY):
+        self.parts = []
+        self.size = 0
+        ret = cStringIO.StringIO()
+        first_part = True
+        for key, value in data:
+            if not key:
+                continue
+            # Don't add newline before first part
+            if first_part:
+                first_part = False
+            else:
+                ret.write('\r\n')
+            ret.write(sep_boundary)
+            if isinstance(value, Upload):
+                ret.write('\r\nContent-Disposition: form-data; name="%s"'%key)
+                ret.write('; filename="%s"\r\n' % os.path.basename(value.filename))
+                if value.filename:
+                    mimetype = guess_type(value.filename)[0]
+                    if mimetype is not None:
+                        ret.write('Content-Type: %s\r\n' % mimetype)
+                    ret.write('\r\n')
+                    self.addString(ret.getvalue())
+                    ret = cStringIO.StringIO()
+                    last_char = self.addFile(value.filename)
+                else:
+                    ret.write('\r\n')
+                    last_char = ''
+            else:
+                ret.write('\r\nContent-Disposition: form-data; name="%s"'%key)
+                ret.write("\r\n\r\n")
+                value = str(value)
+                ret.write(value)
+                last_char = value[-1:]
+            if last_char == '\r':
+                ret.write('\r\n')  # write an extra newline
+        ret.write('\r\n')
+        ret.write(end_boundary)
+        ret.write('\r\n')
+        self.addString(ret.getvalue())
+
+    def addString(self, value):
+        if value:
+            self.parts.append(value)
+            self.size += len(value)
+
+    def addFile(self, path):
+        """Add a file, return its last char."""
+        size = os.path.getsize(path)
+        if not size:
+            return ''
+        self.parts.append((path, size))
+        self.size += size
+        f = open(path, 'rb')
+        try:
+            f.seek(-1, 2)
+            return f.read(1)
+        finally:
+            f.close()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield part
+                continue
+            f = open(part[0], 'rb')
+            try:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                f.close()
+
+    def __str__(self):
+        return ''.join(self)
+
+
 def mimeEncode(data, sep_boundary=SEP_BOUNDARY, end_boundary=END_BOUNDARY):
     '''Take the mapping of data and construct the body of a
     multipart/form-data message with it using the indicated boundaries.
     '''
-    ret = cStringIO.StringIO()
-    first_part = True
-    for key, value in data:
-        if not key:
-            continue
-        # Don't add newline before first part
-        if first_part:
-            first_part = False
-        else:
-            ret.write('\r\n')
-        ret.write(sep_boundary)
-        if isinstance(value, Upload):
-            ret.write('\r\nContent-Disposition: form-data; name="%s"'%key)
-            ret.write('; filename="%s"\r\n' % os.path.basename(value.filename))
-            if value.filename:
-                mimetype = guess_type(value.filename)[0]
-                if mimetype is not None:
-                    ret.write('Content-Type: %s\r\n' % mimetype)
-                value = open(os.path.join(value.filename), "rb").read()
-            else:
-                value = ''
-            ret.write('\r\n')
-        else:
-            ret.write('\r\nContent-Disposition: form-data; name="%s"'%key)
-            ret.write("\r\n\r\n")
-        ret.write(str(value))
-        if value and value[-1] == '\r':
-            ret.write('\r\n')  # write an extra newline
-    ret.write('\r\n')
-    ret.write(end_boundary)
-    ret.write('\r\n')
-    return ret.getvalue()
-
-
-class FKLIMGSucker(IMGSucker):
-    """Image and links loader, patched to log response stats."""
-    def __init__(self, url, session, ftestcase=None):
-        IMGSucker.__init__(self, url, session)
-        self.ftestcase = ftestcase
-
-    def do_img(self, attributes):
-        """Process img tag."""
-        newattributes = []
-        for name, value in attributes:
-            if name == 'src':
-                # construct full url
-                url = urlparse.urljoin(self.base, value)
-                # make sure it's syntactically valid
-                if not valid_url.match(url):
-                    continue
-                # TODO: figure the re-write path
-                # newattributes.append((name, path))
-                if not self.session.images.has_key(url):
-                    self.ftestcase.logdd('    img: %s ...' % url)
-                    t_start = time.time()
-                    self.session.images[url] = self.session.fetch(url)
-                    t_stop = time.time()
-                    self.ftestcase.logdd('     Done in %.3fs' %
-                                         (t_stop - t_start))
-                    self.session.history.append(('image', url))
-                    self.ftestcase.total_time += (t_stop - t_start)
-                    self.ftestcase.total_images += 1
-                    self.ftestcase._log_response(self.session.images[url],
-                                                 'image', None, t_start,
-                                                 t_stop)
-                    thread_sleep()      # give a chance to other threads
-            else:
-                newattributes.append((name, value))
-        # Write the img tag to file (with revised paths)
-        self.unknown_starttag('img', newattributes)
-
-    def do_link(self, attributes):
-        """Process link tag."""
-        newattributes = [('rel', 'stylesheet'), ('type', 'text/css')]
-        for name, value in attributes:
-            if name == 'href':
-                # construct full url
-                url = urlparse.urljoin(self.base, value)
-                # make sure it's syntactically valid
-                if not valid_url.match(url):
-                    continue
-                # TODO: figure the re-write path
-                # newattributes.append((name, path))
-                if not self.session.css.has_key(url):
-                    self.ftestcase.logdd('    link: %s ...' % url)
-                    t_start = time.time()
-                    self.session.css[url] = self.session.fetch(url)
-                    t_stop = time.time()
-                    self.ftestcase.logdd('     Done in %.3fs' %
-                                         (t_stop - t_start))
-                    self.session.history.append(('link', url))
-                    self.ftestcase.total_time += (t_stop - t_start)
-                    self.ftestcase.total_links += 1
-                    self.ftestcase._log_response(self.session.css[url],
-                                                 'link', None, t_start, t_stop)
-                    thread_sleep()      # give a chance to other threads
-            else:
-                newattributes.append((name, value))
-        # Write the link tag to file (with revised paths)
-        self.unknown_starttag('link', newattributes)
+    return str(MultipartBody(data, sep_boundary, end_boundary))
+
 
 # remove webunit logging
 def WTC_log(self, message, content):
@@ -171,8 +184,7 @@ def WTC_log(self, message, content):
 WebTestCase.log = WTC_log
 
 def decodeCookies(url, server, headers, cookies):
-    """Decode cookies into the supplied cookies dictionary,
-    according to RFC 6265.
+    """Decode cookies into the supplied CookieJar, according to RFC 6265.
 
     Relevant specs:
     http://www.ietf.org/rfc/rfc2109.txt (obsolete)
@@ -188,6 +200,7 @@ def decodeCookies(url, server, headers, cookies):
     else:
         request_path = '/'
 
+    now = time.time()
     # XXX - tried slurping all the set-cookie and joining them on
     # '\n', some cookies were not parsed. This below worked flawlessly.
     for ch in headers.getallmatchingheaders('set-cookie'):
@@ -209,49 +222,282 @@ def decodeCookies(url, server, headers, cookies):
         else:
             domain = server
 
-        # all date handling is done is UTC
-        # XXX - need reviewing by someone familiar with python datetime objects
-        now = datetime.datetime.utcnow()
-        expire = datetime.datetime.min
-        maxage = cookie['max-age']
         # see rfc 6265, section 5.3, step 3
+        # expires is kept as an utc datetime, datetime.max for a session
+        # cookie
+        maxage = cookie['max-age']
         if maxage != '':
-            timedelta = int(maxage)
-            if timedelta > 0:
-                expire = now + datetime.timedelta(seconds=timedelta)
+            expire = now + int(maxage)
+        elif cookie['expires'] != '':
+            # an invalid date is ignored, see rfc 6265, section 5.2.1
+            expire = parse_cookie_date(cookie['expires'])
         else:
-            if cookie['expires'] == '':
-                expire = datetime.datetime.max
-            else:
-                expire = datetime.datetime.strptime(cookie['expires'],"%a, %d-%b-%Y %H:%M:%S %Z")
+            expire = None
+
+        if expire is None:
+            cookie['expires'] = datetime.datetime.max
+            cookies.setCookie(domain, path, cookie)
+        elif expire > now:
+            cookie['expires'] = datetime.datetime.utcfromtimestamp(expire)
+            cookies.setCookie(domain, path, cookie)
+        else:
+            cookies.deleteCookie(domain, path, cookie.key)
+
+
+# the methods a browser may send again on a new connection, rfc 7231 4.2.2
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE')
+
+
+def is_stale_connection_error(error):
+    """Return True if the error tells that the server has closed an idle
+    keep alive connection before reading the request."""
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        # the connection was closed without a response byte
+        return True
+    if isinstance(error, socket.error):
+        return error.errno in (errno.ECONNRESET, errno.EPIPE)
+    return False
+
+
+class NoLock:
+    """The lock of a browser that fetches from a single thread."""
+    def acquire(self):
+        pass
 
-        cookie['expires'] = expire
-        bydom = cookies.setdefault(domain, {})
-        bypath = bydom.setdefault(path, {})
+    def release(self):
+        pass
 
-        if expire > now:
-            bypath[cookie.key] = cookie
-        elif cookie.key in bypath:
-            del bypath[cookie.key]
+_no_lock = NoLock()
+
+
+class ConnectionPool:
+    """Idle keep alive connections of a browser.
+
+    Connections are keyed by route and client certificate, a connection is
+    taken out of the pool while its request is running. The pool is thread
+    safe so it can be shared by the resource workers of a browser."""
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return an idle connection or None."""
+        self.lock.acquire()
+        try:
+            idle = self.connections.get(key)
+            if idle:
+                return idle.pop()
+            return None
+        finally:
+            self.lock.release()
+
+    def put(self, key, connection):
+        """Give back a connection once its response is read."""
+        self.lock.acquire()
+        try:
+            self.connections.setdefault(key, []).append(connection)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Close all the connections."""
+        self.lock.acquire()
+        try:
+            connections = self.connections
+            self.connections = {}
+        finally:
+            self.lock.release()
+        for idle in connections.values():
+            for connection in idle:
+                connection.close()
+
+
+def is_stream(consumer, code, headers, ok_codes):
+    """Return True if the body of a response is read by a stream reader,
+    only a successful response with a body is streamed."""
+    if consumer is None or code not in ok_codes or not 200 <= code < 300:
+        return False
+    return headers is not None and headers.get('content-length') != '0'
+
+
+def get_response_size(code, message, headers, body):
+    """Return the size of a response on the wire, without the chunked
+    encoding."""
+    size = len('HTTP/1.1 %s %s\r\n\r\n' % (code, message)) + len(body or '')
+    if headers is not None:
+        size += sum([len(line) for line in headers.headers])
+    return size
+
+
+def fetch_resource(session, url):
+    """Fetch a css or an image using the browser cache if any.
+
+    A cached response has a cache attribute set to hit, revalidated or
+    miss."""
+    cache = getattr(session, 'resource_cache', None)
+    if cache is None:
+        return session.fetch(url)
+    entry = cache.get(url)
+    if entry is not None and entry.isFresh(time.time()):
+        response = copy.copy(entry.response)
+        response.cache = 'hit'
+        response.connection = None
+        response.timings = None
+        response.wire_bytes = None
+        return response
+    headers = None
+    if entry is not None:
+        headers = entry.getConditionalHeaders()
+    response = session.fetch(url, ok_codes=list(session.expect_codes) + [304],
+                             extra_headers=headers)
+    if response.code == 304 and entry is not None:
+        cache.refresh(entry, response, time.time())
+        response.cache = 'revalidated'
+    else:
+        cache.put(url, response, time.time())
+        response.cache = 'miss'
+    return response
 
 
-# use fl img sucker
-def WTC_pageImages(self, url, page, testcase=None):
+def fetch_resources(session, resources, max_per_host=6):
+    """Fetch resources concurrently, like a browser does using at most
+    max_per_host connections per host.
+
+    Return a list of (rtype, url, response, time_start, time_stop, exc_info)
+    in the order of completion, exc_info is None on success. The cookies of
+    the browser are guarded by its browser_lock while the workers run."""
+    lock = getattr(session, 'browser_lock', None)
+    if lock is None:
+        lock = session.browser_lock = threading.Lock()
+    by_host = {}
+    for rtype, url in resources:
+        by_host.setdefault(urlparse.urlparse(url)[1], []).append((rtype, url))
+    results = []
+
+    def worker(queue):
+        while True:
+            # the queue is shared by the workers of a host
+            try:
+                rtype, url = queue.pop(0)
+            except IndexError:
+                break
+            t_start = time.time()
+            try:
+                response = fetch_resource(session, url)
+                exc_info = None
+            except:
+                response = None
+                exc_info = sys.exc_info()
+            t_stop = time.time()
+            lock.acquire()
+            try:
+                results.append((rtype, url, response, t_start, t_stop,
+                                exc_info))
+            finally:
+                lock.release()
+
+    threads = []
+    for queue in by_host.values():
+        for i in range(min(max_per_host, len(queue))):
+            thread = threading.Thread(target=worker, args=(queue,))
+            thread.setDaemon(1)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def get_page_resources(url, links, session):
+    """Return the (rtype, url) of the images and css of a page to load,
+    skipping the ones already in the browser."""
+    base = links.getBaseUrl(url)
+    caches = {'image': session.images, 'link': session.css}
+    resources = []
+    seen = {}
+    for rtype, value in links.resources:
+        cache = caches.get(rtype)
+        if cache is None:
+            # scripts are not loaded
+            continue
+        res_url = urlparse.urljoin(base, value)
+        # make sure it's syntactically valid
+        if not valid_url.match(res_url):
+            continue
+        if not cache.has_key(res_url) and not seen.has_key(res_url):
+            seen[res_url] = True
+            resources.append((rtype, res_url))
+    return resources
+
+
+def WTC_pageImages(self, url, page, testcase=None, links=None):
     '''Given the HTML page that was loaded from url, grab all the images.
+
+    links is the PageLinks of the page if already extracted.
     '''
-    sucker = FKLIMGSucker(url, self, testcase)
-    sucker.feed(page)
-    sucker.close()
+    if links is None:
+        links = extract_links(page)
+    resources = get_page_resources(url, links, self)
+    if not resources:
+        return
+    if not getattr(self, 'parallel_fetch', False):
+        for rtype, res_url in resources:
+            testcase.logdd('    %s: %s ...' % (rtype, res_url))
+            t_start = time.time()
+            response = fetch_resource(self, res_url)
+            t_stop = time.time()
+            testcase.logdd('     Done in %.3fs' % (t_stop - t_start))
+            self.history.append((rtype, res_url))
+            testcase.total_time += (t_stop - t_start)
+            testcase._log_response(response, rtype, None, t_start, t_stop)
+            if rtype == 'image':
+                self.images[res_url] = ResourceInfo(response)
+                testcase.total_images += 1
+            else:
+                self.css[res_url] = ResourceInfo(response)
+                testcase.total_links += 1
+            thread_sleep()      # give a chance to other threads
+        return
+    t_start = time.time()
+    results = fetch_resources(self, resources,
+                              self.max_connections_per_host)
+    # the page takes the wall clock time of the downloads
+    testcase.total_time += time.time() - t_start
+    results.sort(key=lambda result: result[3])
+    error = None
+    for rtype, res_url, response, r_start, r_stop, exc_info in results:
+        if exc_info is not None:
+            if error is None:
+                error = exc_info
+                # let the caller log the response with its own times
+                error[1].time_start = r_start
+                error[1].time_stop = r_stop
+            continue
+        testcase.logdd('    %s: %s done in %.3fs' % (rtype, res_url,
+                                                     r_stop - r_start))
+        if rtype == 'image':
+            self.images[res_url] = ResourceInfo(response)
+            testcase.total_images += 1
+        else:
+            self.css[res_url] = ResourceInfo(response)
+            testcase.total_links += 1
+        self.history.append((rtype, res_url))
+        testcase._log_response(response, rtype, None, r_start, r_stop)
+    if error is not None:
+        raise error[0], error[1], error[2]
 
 WebTestCase.pageImages = WTC_pageImages
 
 
 # WebFetcher fetch
 def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
-             ok_codes=None, key_file=None, cert_file=None, method="GET", consumer=None):
+             ok_codes=None, key_file=None, cert_file=None, method="GET", consumer=None,
+             extra_headers=None):
     '''Run a single test request to the indicated url. Use the POST data
     if supplied. Accepts key and certificate file paths for https (ssl/tls)
-    connections.
+    connections. Extra headers are added to the headers of the browser.
 
     Raises failureException if the returned data contains any of the
     strings indicated to be Error Content.
@@ -297,61 +543,18 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
         protocol = self.protocol
     if ok_codes is None:
         ok_codes = self.expect_codes
-    webproxy = {}
-
-    if protocol == 'http':
-        try:
-            proxystring = os.environ["http_proxy"].replace("http://", "")
-            webproxy['host'] = proxystring.split(":")[0]
-            webproxy['port'] = int(proxystring.split(":")[1])
-        except (KeyError, IndexError, ValueError):
-            webproxy = False
-
-        if webproxy:
-            h = httplib.HTTPConnection(webproxy['host'], webproxy['port'])
-        else:
-            h = httplib.HTTP(server, int(port))
-        if int(port) == 80:
-            host_header = server
-        else:
-            host_header = '%s:%s' % (server, port)
-    elif protocol == 'https':
-        #if httpslib is None:
-            #raise ValueError, "Can't fetch HTTPS: M2Crypto not installed"
-
-        # FL Patch -------------------------
-        try:
-            proxystring = os.environ["https_proxy"].replace("http://", "").replace("https://", "")
-            webproxy['host'] = proxystring.split(":")[0]
-            webproxy['port'] = int(proxystring.split(":")[1])
-        except (KeyError, IndexError, ValueError):
-            webproxy = False
-
-        # patched to use the given key and cert file
-        if webproxy:
-            h = httplib.HTTPSConnection(webproxy['host'], webproxy['port'],
-                                        key_file, cert_file)
-        else:
-            h = httplib.HTTPS(server, int(port), key_file, cert_file)
-
-        # FL Patch end  -------------------------
-
-        if int(port) == 443:
-            host_header = server
-        else:
-            host_header = '%s:%s' % (server, port)
-    else:
-        raise ValueError, protocol
+    factory = get_connection_factory()
+    route = factory.getRoute(protocol, server, port)
+    host_header = route.host_header
+    request_url = route.prefix + url
+    pool = getattr(self, 'connection_pool', None)
+    if consumer is not None:
+        # the consumer reads the response as it comes
+        pool = None
 
     headers = []
     params = None
     if postdata is not None:
-        if webproxy:
-            h.putrequest(method.upper(), "%s://%s%s" % (protocol,
-                                                        host_header, url))
-        else:
-            # Normal post
-            h.putrequest(method.upper(), url)
         if postdata:
             if isinstance(postdata, Data):
                 # User data and content_type
@@ -367,64 +570,44 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
                         is_multipart = True
                         break
                 if is_multipart:
-                    params = mimeEncode(postdata)
+                    params = MultipartBody(postdata)
                     headers.append(('Content-type', 'multipart/form-data; boundary=%s'%
                                     BOUNDARY))
                 else:
                     params = urlencode(postdata)
                     headers.append(('Content-type', 'application/x-www-form-urlencoded'))
             headers.append(('Content-length', str(len(params))))
-    else:
-        if webproxy:
-            h.putrequest(method.upper(), "%s://%s%s" % (protocol,
-                                                        host_header, url))
-        else:
-            h.putrequest(method.upper(), url)
 
     # Other Full Request headers
     if self.authinfo:
         headers.append(('Authorization', "Basic %s"%self.authinfo))
-    if not webproxy:
-        # HTTPConnection seems to add a host header itself.
-        # So we only need to do this if we are not using a proxy.
-        headers.append(('Host', host_header))
+    # the host of the absolute url of a forwarded request too
+    headers.append(('Host', host_header))
 
     # FL Patch -------------------------
     for key, value in self.extra_headers:
         headers.append((key, value))
+    if extra_headers:
+        headers.extend(extra_headers)
 
     # FL Patch end ---------------------
 
     # Send cookies
-    #  - check the domain, max-age (seconds), path and secure
-    #    (http://www.ietf.org/rfc/rfc2109.txt)
-    cookies_used = []
-    cookie_list = []
-    for domain, cookies in self.cookies.items():
-        # check cookie domain
-        if not server.endswith(domain) and domain[1:] != server:
-            continue
-        for path, cookies in cookies.items():
-            # check that the path matches
-            urlpath = urlparse.urlparse(url)[2]
-            if not urlpath.startswith(path) and not (path == '/' and
-                    urlpath == ''):
-                continue
-            for sendcookie in cookies.values():
-                # and that the cookie is or isn't secure
-                if sendcookie['secure'] and protocol != 'https':
-                    continue
-                # TODO: check for expires (max-age is working)
-                # hard coded value that application can use to work
-                # around expires
-                if sendcookie.coded_value in ('"deleted"', "null", "deleted"):
-                    continue
-                cookie_list.append("%s=%s;"%(sendcookie.key,
-                                            sendcookie.coded_value))
-                cookies_used.append(sendcookie.key)
-
-    if cookie_list:
-        headers.append(('Cookie', ' '.join(cookie_list)))
+    #  - check the domain, expires, path and secure
+    #    (http://www.ietf.org/rfc/rfc6265.txt)
+    # the cookies are shared with the resource workers of the browser
+    lock = getattr(self, 'browser_lock', None) or _no_lock
+    lock.acquire()
+    try:
+        if not isinstance(self.cookies, CookieJar):
+            # webunit clearCookies or a test set a dict
+            self.cookies = CookieJar(self.cookies)
+        cookie_header, cookies_used = self.cookies.getCookies(
+            server, urlparse.urlparse(url)[2], protocol == 'https')
+    finally:
+        lock.release()
+    if cookie_header:
+        headers.append(('Cookie', cookie_header))
 
     # check that we sent the cookies we expected to
     if self.expect_cookies is not None:
@@ -433,61 +616,143 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
             self.expect_cookies, cookies_used)
 
 
-    # write and finish the headers
-    for header in headers:
-        h.putheader(*header)
-    h.endheaders()
-
-    if self.debug_headers:
-        for header in headers:
-            print "Putting header -- %s: %s" % header
-
-    if params is not None:
-        h.send(params)
+    connection = 'new'
+    h = None
+    if pool is not None:
+        pool_key = (route.key, key_file, cert_file)
+        h = pool.get(pool_key)
+        if h is not None:
+            connection = 'reused'
+    if h is None:
+        h = factory.newConnection(route, key_file, cert_file,
+                                  pool is not None)
+    request_headers = headers
+    timings = {}
+    sizes = {}
+
+    def send_request(h):
+        # httplib.HTTP wraps a connection
+        conn = getattr(h, '_conn', h)
+        if conn.sock is None:
+            factory.connect(conn, timings)
+        t_start = time.time()
+        if isinstance(h, httplib.HTTP):
+            http_version = 'HTTP/1.0'
+            sent_headers = request_headers
+        else:
+            http_version = 'HTTP/1.1'
+            sent_headers = list(request_headers)
+            if not [key for key, value in sent_headers
+                    if key.lower() == 'accept-encoding']:
+                # the default of HTTPConnection
+                sent_headers.append(('Accept-Encoding', 'identity'))
+        # httplib adds no header itself, all the lines sent are ours
+        h.putrequest(method.upper(), request_url, skip_host=1,
+                     skip_accept_encoding=1)
+        # write and finish the headers
+        for header in sent_headers:
+            h.putheader(*header)
+        h.endheaders()
+        # the request line and headers joined by CRLF and a blank line
+        lines = ['%s %s %s' % (method.upper(), request_url, http_version)]
+        lines.extend(['%s: %s' % header for header in sent_headers])
+        sizes['sent'] = sum([len(line) + 2 for line in lines]) + 2
+
+        if self.debug_headers:
+            for header in sent_headers:
+                print "Putting header -- %s: %s" % header
+
+        if isinstance(params, MultipartBody):
+            # the files are read while sending
+            for chunk in params:
+                h.send(chunk)
+            sizes['sent'] += len(params)
+        elif params is not None:
+            h.send(params)
+            sizes['sent'] += len(params)
+        timings['send'] = time.time() - t_start
 
     # handle the reply
-    if webproxy:
-        r = h.getresponse()
+    if isinstance(h, httplib.HTTPConnection):
+        retry = (connection == 'reused' and
+                 method.upper() in IDEMPOTENT_METHODS)
+        while True:
+            try:
+                timings.clear()
+                send_request(h)
+                t_sent = time.time()
+                r = h.getresponse()
+                break
+            except (httplib.HTTPException, socket.error), error:
+                if not retry or not is_stale_connection_error(error):
+                    raise
+                # the server has closed the idle connection, retry once
+                h.close()
+                h = factory.newConnection(route, key_file, cert_file, True)
+                connection = 'new'
+                retry = False
+        t_headers = time.time()
+        timings['ttfb'] = t_headers - t_sent
         errcode = r.status
         errmsg = r.reason
         headers = r.msg
-        if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
-            data = None
+        if is_stream(consumer, errcode, headers, ok_codes):
+            # the connection is not pooled, the body is read by the stream
+            # selector once the stream is started
+            response = HTTPResponse(self.cookies, protocol, server, port, url,
+                                    errcode, errmsg, headers, '',
+                                    self.error_content)
+            response.stream = Stream(r.fp, headers, consumer, t_headers)
         else:
+            # read the whole body so the connection can be reused
             data = r.read()
-        response = HTTPResponse(self.cookies, protocol, server, port, url,
-                                errcode, errmsg, headers, data,
-                                self.error_content)
+            if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
+                data = None
+            response = HTTPResponse(self.cookies, protocol, server, port, url,
+                                    errcode, errmsg, headers, data,
+                                    self.error_content)
+        timings['transfer'] = time.time() - t_headers
+        if pool is not None:
+            response.connection = connection
+            if r.will_close:
+                h.close()
+            else:
+                pool.put(pool_key, h)
 
     else:
+        send_request(h)
+        t_sent = time.time()
         # get the body and save it
         errcode, errmsg, headers = h.getreply()
+        t_headers = time.time()
+        timings['ttfb'] = t_headers - t_sent
         if headers is None or headers.has_key('content-length') and headers['content-length'] == "0":
             response = HTTPResponse(self.cookies, protocol, server, port, url,
                                     errcode, errmsg, headers, None,
                                     self.error_content)
+        elif is_stream(consumer, errcode, headers, ok_codes):
+            # the body is read by the stream selector once the stream is
+            # started
+            response = HTTPResponse(self.cookies, protocol, server, port, url,
+                                    errcode, errmsg, headers, '',
+                                    self.error_content)
+            response.stream = Stream(h.getfile(), headers, consumer,
+                                     t_headers)
         else:
             f = h.getfile()
             g = cStringIO.StringIO()
-            if consumer is None:
-                d = f.read()
-            else:
-                d = f.readline(1)
+            d = f.read()
             while d:
                 g.write(d)
-                if consumer is None:
-                    d = f.read()
-                else:
-                    ret = consumer(d)
-                    if ret == 0:
-                        # consumer close connection
-                        d = None
-                    else:
-                        d = f.readline(1)
+                d = f.read()
             response = HTTPResponse(self.cookies, protocol, server, port, url,
                                     errcode, errmsg, headers, g.getvalue(),
                                     self.error_content)
             f.close()
+        timings['transfer'] = time.time() - t_headers
+    response.timings = timings
+    response.wire_bytes = (sizes['sent'], get_response_size(
+        errcode, errmsg, headers, response.body))
 
     if errcode not in ok_codes:
         if VERBOSE:
@@ -497,6 +762,7 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
 
     # decode the cookies
     if self.accept_cookies:
+        lock.acquire()
         try:
             # decode the cookies and update the cookies store
             decodeCookies(url, server, headers, self.cookies)
@@ -505,6 +771,8 @@ def WF_fetch(self, url, postdata=None, server=None, port=None, protocol=None,
                 sys.stdout.write('c')
                 sys.stdout.flush()
             raise
+        finally:
+            lock.release()
 
     # Check errors
     if self.error_content:
@@ -30,8 +30,13 @@ or
 
   %prog --diff REPORT_PATH1 REPORT_PATH2
 
+or
+
+  %prog --to-xml RESULT_FILE > XML_FILE
+
 %prog analyze a FunkLoad bench xml result file and output a report.
 If there are more than one file the xml results are merged.
+A result file in the binary format is read like an xml one.
 
 See http://funkload.nuxeo.org/ for more information.
 
@@ -48,6 +53,8 @@ Examples
                         requires gnuplot.
   %prog --trend /path/to/report-dir1 /path/to/report-1 ... /path/to/report-n
                         Build a trend report using multiple reports.
+  %prog --to-xml funkload.bin > funkload.xml
+                        Convert a binary result file into the xml format.
   %prog -h
                         More options.
 """
@@ -57,17 +64,24 @@ try:
 except ImportError:
     pass
 import os
+import sys
 import xml.parsers.expat
 from optparse import OptionParser, TitledHelpFormatter
 from tempfile import NamedTemporaryFile
+from hashlib import sha1
 
 from ReportStats import AllResponseStat, PageStat, ResponseStat, TestStat
-from ReportStats import MonitorStat, ErrorStat
+from ReportStats import MonitorStat, ErrorStat, ArrivalStat
+from ReportStats import ConcurrencyStat, CacheStat
 from ReportRenderRst import RenderRst
 from ReportRenderHtml import RenderHtml
 from ReportRenderDiff import RenderDiff
 from ReportRenderTrend import RenderTrend
+from utils import REQUEST_PHASES
 from MergeResultFiles import MergeResultFiles
+from ResultFile import is_binary_result, read_results, convert_to_xml, \
+     open_result
+from BodyStore import BodyStoreReader, get_body_store_path
 from utils import trace, get_version
 from apdex import Apdex
 
@@ -97,11 +111,17 @@ class FunkLoadXmlParser:
         self.monitorconfig = {}         # monitoring config
         self.config = {}
         self.error = {}
+        self.body_store = BodyStoreReader()
+        self.bodies = {}                # inlined bodies by hash
 
     def parse(self, xml_file):
         """Do the parsing."""
+        self.body_store.addPath(get_body_store_path(xml_file))
         try:
-            self.parser.ParseFile(file(xml_file))
+            if is_binary_result(xml_file):
+                self.parseBinary(xml_file)
+            else:
+                self.parser.ParseFile(open_result(xml_file))
         except xml.parsers.expat.ExpatError, msg:
             if (self.current_element[-1]['name'] == 'funkload'
                 and str(msg).startswith('no element found')):
@@ -121,6 +141,16 @@ class FunkLoadXmlParser:
                     x['name'] for x in self.current_element]
                 raise
 
+    def parseBinary(self, path):
+        """Parse a binary result file, its xml records go through expat."""
+        for name, attrs in read_results(path):
+            if name is None:
+                self.parser.Parse(attrs, False)
+            else:
+                self.handleStartElement(name, attrs)
+                self.handleEndElement(name)
+        self.parser.Parse('', True)
+
     def handleStartElement(self, name, attrs):
         """Called by expat parser on start element."""
         if name == 'funkload':
@@ -130,6 +160,8 @@ class FunkLoadXmlParser:
             self.config[attrs['key']] = attrs['value']
             if attrs['key'] == 'duration':
                 self.cycle_duration = attrs['value']
+            elif attrs['key'] == 'body_store':
+                self.body_store.addPath(attrs['value'])
         elif name == 'header':
             # save header as extra response attribute
             headers = self.current_element[-2]['attrs'].setdefault(
@@ -154,32 +186,79 @@ class FunkLoadXmlParser:
         elif name == 'response':
             cycle = attrs['cycle']
             stats = self.stats.setdefault(cycle, {'response_step':{}})
+            if attrs['type'] == 'event':
+                # a message received on a stream, not a request
+                stat = stats.setdefault('event', AllResponseStat(
+                    cycle, self.cycle_duration, attrs['cvus']))
+                stat.add(attrs['time'], attrs['result'], attrs['duration'])
+                return
+            if attrs.has_key('cache'):
+                stat = stats.setdefault('cache', CacheStat(cycle,
+                                                           attrs['cvus']))
+                stat.add(attrs['cache'])
+                if attrs['cache'] == 'hit':
+                    # served by the browser cache, not a request
+                    return
+            wire_bytes = None
+            if attrs.has_key('response_bytes'):
+                wire_bytes = (attrs['request_bytes'], attrs['response_bytes'],
+                              attrs['decoded_bytes'])
             stat = stats.setdefault(
                 'response', AllResponseStat(cycle, self.cycle_duration,
                                             attrs['cvus']))
-            stat.add(attrs['time'], attrs['result'], attrs['duration'])
+            stat.add(attrs['time'], attrs['result'], attrs['duration'],
+                     attrs.get('corrected_duration'), wire_bytes)
             stats['response'] = stat
 
             stat = stats.setdefault(
                 'page', PageStat(cycle, self.cycle_duration, attrs['cvus']))
             stat.add(attrs['thread'], attrs['step'], attrs['time'],
-                     attrs['result'], attrs['duration'], attrs['type'])
+                     attrs['result'], attrs['duration'], attrs['type'],
+                     wire_bytes)
             stats['page'] = stat
 
             step = '%s.%s' % (attrs['step'], attrs['number'])
             stat = stats['response_step'].setdefault(
                 step, ResponseStat(attrs['step'], attrs['number'],
                                    attrs['cvus']))
+            phases = None
+            if attrs.has_key('ttfb'):
+                phases = dict([(phase, float(attrs.get(phase, 0)))
+                               for phase in REQUEST_PHASES])
             stat.add(attrs['type'], attrs['result'], attrs['url'],
-                     attrs['duration'], attrs.get('description'))
+                     attrs['duration'], attrs.get('description'), phases)
             stats['response_step'][step] = stat
+            if attrs.has_key('active_cvus'):
+                active_cvus = int(attrs['active_cvus'])
+                stat = stats.setdefault('concurrency', {}).setdefault(
+                    active_cvus, ConcurrencyStat(cycle, attrs['cvus'],
+                                                 active_cvus))
+                stat.add(attrs['result'], attrs['duration'])
             if attrs['result'] != 'Successful':
                 result = str(attrs['result'])
                 stats = self.error.setdefault(result, [])
+                headers = attrs.get('headers')
+                if attrs.has_key('headers_hash'):
+                    headers = self.body_store.getHeaders(
+                        attrs['headers_hash'])
+                body = attrs.get('body')
+                body_hash = attrs.get('body_hash')
+                if body and body_hash is None:
+                    # the same inlined bodies are kept once
+                    body_hash = sha1(body.encode('utf-8')).hexdigest()
+                    body = self.bodies.setdefault(body_hash, body)
                 stats.append(ErrorStat(
                     attrs['cycle'], attrs['step'], attrs['number'],
-                    attrs.get('code'), attrs.get('headers'),
-                    attrs.get('body'), attrs.get('traceback')))
+                    attrs.get('code'), headers, body, attrs.get('traceback'),
+                    body_hash, self.body_store))
+        elif name == 'arrival':
+            cycle = attrs['cycle']
+            stats = self.stats.setdefault(cycle, {'response_step': {}})
+            stat = stats.setdefault(
+                'arrival', ArrivalStat(cycle, self.cycle_duration,
+                                       attrs['cvus']))
+            stat.add(attrs['rate'], attrs['offered'], attrs['backlog'],
+                     attrs['workers'])
         elif name == 'monitor':
             host = attrs.get('host')
             stats = self.monitor.setdefault(host, [])
@@ -261,9 +340,17 @@ def main():
                       default=False, dest="quiet",
                       help=("Report no system messages when generating"
                             " html from rst."))
+    parser.add_option("--to-xml", action="store_true",
+                      default=False, dest="to_xml",
+                      help="Write a binary result file in the xml format "
+                      "into stdout.")
 
     options, args = parser.parse_args()
-    if options.diffreport:
+    if options.to_xml:
+        if len(args) != 1:
+            parser.error("incorrect number of arguments")
+        convert_to_xml(args[0], sys.stdout)
+    elif options.diffreport:
         if len(args) != 2:
             parser.error("incorrect number of arguments")
         trace("Creating diff report ... ")
@@ -283,17 +370,35 @@ def main():
     else:
         if len(args) < 1:
             parser.error("incorrect number of arguments")
+        result_paths = args[:]
         if len(args) > 1:
-            trace("Merging results files: ")
-            f = NamedTemporaryFile(prefix='fl-mrg-', suffix='.xml')
-            tmp_file = f.name
-            f.close()
-            MergeResultFiles(args, tmp_file)
+            # the results are merged in the xml format
+            xml_paths = []
+            try:
+                for i in range(len(args)):
+                    if is_binary_result(args[i]):
+                        f = NamedTemporaryFile(prefix='fl-xml-',
+                                               suffix='.xml', delete=False)
+                        xml_paths.append(f.name)
+                        convert_to_xml(args[i], f)
+                        f.close()
+                        args[i] = f.name
+                trace("Merging results files: ")
+                f = NamedTemporaryFile(prefix='fl-mrg-', suffix='.xml')
+                tmp_file = f.name
+                f.close()
+                MergeResultFiles(args, tmp_file)
+            finally:
+                for path in xml_paths:
+                    os.remove(path)
             trace("Results merged in tmp file: %s\n" % os.path.abspath(tmp_file))
             args = [tmp_file]
         options.xml_file = args[0]
         Apdex.T = options.apdex_t
         xml_parser = FunkLoadXmlParser()
+        for path in result_paths:
+            # the stores of merged results
+            xml_parser.body_store.addPath(get_body_store_path(path))
         xml_parser.parse(options.xml_file)
         if options.html:
             trace("Creating html report: ...")
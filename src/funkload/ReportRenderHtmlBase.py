@@ -23,8 +23,10 @@
 $Id$
 """
 import os
-from shutil import copyfile
+from shutil import copyfile, copytree
 from ReportRenderRst import RenderRst, rst_title
+from ResultFile import get_codec
+from BodyStore import get_body_store_path
 
 
 class RenderHtmlBase(RenderRst):
@@ -109,8 +111,13 @@ class RenderHtmlBase(RenderRst):
     def copyXmlResult(self):
         """Make a copy of the xml result."""
         xml_src_path = self.options.xml_file
-        xml_dest_path = os.path.join(self.report_dir, 'funkload.xml')
+        # a compressed result is copied as is
+        xml_dest_path = os.path.join(self.report_dir, 'funkload.xml' + (
+                get_codec(xml_src_path) or ''))
         copyfile(xml_src_path, xml_dest_path)
+        store_path = get_body_store_path(xml_src_path)
+        if os.path.isdir(store_path):
+            copytree(store_path, get_body_store_path(xml_dest_path))
 
     def generateHtml(self):
         """Ask docutils to convert our rst file into html."""
@@ -147,8 +154,10 @@ class RenderHtmlBase(RenderRst):
         self.createTestChart()
         self.createPageChart()
         self.createAllResponseChart()
+        self.createConcurrencyChart()
         for step_name in self.steps:
             self.createResponseChart(step_name)
+            self.createResponsePhaseChart(step_name)
 
     # monitoring charts
     def createMonitorCharts(self):
@@ -170,9 +179,15 @@ class RenderHtmlBase(RenderRst):
     def createAllResponseChart(self):
         """Create global responses chart."""
 
+    def createConcurrencyChart(self):
+        """Create the response time by active users chart."""
+
     def createResponseChart(self, step):
         """Create responses chart."""
 
+    def createResponsePhaseChart(self, step):
+        """Create the request phases chart of a step."""
+
     def createMonitorChart(self, host):
         """Create monitrored server charts."""
 
@@ -31,6 +31,7 @@ from ReportRenderHtmlBase import RenderHtmlBase
 from datetime import datetime
 from MonitorPlugins import MonitorPlugins
 from MonitorPluginsDefault import MonitorCPU, MonitorMemFree, MonitorNetwork, MonitorCUs
+from utils import REQUEST_PHASES
 
 def gnuplot(script_path):
     """Execute a gnuplot script."""
@@ -410,9 +411,50 @@ class RenderHtmlGnuPlot(RenderHtmlBase):
         gnuplot(plot_path)
         return
 
+    def createBandwidthTimeChart(self):
+        """Create a received MB/s chart where X-axis represent the time in
+        seconds."""
+        img_path = gnuplot_scriptpath(self.report_dir, 'time_bandwidth.png')
+        plot_path = gnuplot_scriptpath(self.report_dir, 'time_bandwidth.gplot')
+        stats = self.stats
+        plots = []
+        for cycle in self.cycles:
+            st = stats[cycle].get('response')
+            if st is None or not st.bytes_count:
+                continue
+            dpath = gnuplot_scriptpath(self.report_dir,
+                                       'time_bandwidth-{0}.data'.format(cycle))
+            f = open(dpath, 'w')
+            f.write('Timeline MBPS\n')
+            for k in sorted(st.bytes_per_second.iterkeys()):
+                f.write('{0} {1}\n'.format(k, st.bytes_per_second[k] / 1e6))
+            f.close()
+            plots.append('"{0}" u ($1):($2) w linespoints lw 1 lt {1} '
+                         't "{2} CUs"'.format(dpath, len(plots) + 1,
+                                              st.cvus))
+        if not plots:
+            return
+        lines = []
+        lines.append('set output "{0}"'.format(img_path))
+        lines.append('set title "MegaBytes received per second over time"')
+        lines.append('set xlabel "Time line"')
+        lines.append('set xdata time')
+        lines.append('set timefmt "%s"')
+        lines.append('set format x "%H:%M"')
+        lines.append('set ylabel "MB/s"')
+        lines.append('set grid')
+        lines.append('set yrange [0:]')
+        lines.append('set terminal png size ' + self.getChartSizeTmp([]))
+        lines.append('plot ' + ', \\\n'.join(plots))
+        f = open(plot_path, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        gnuplot(plot_path)
+
     def createAllResponseChart(self):
         """Create global responses chart."""
         self.createRPSTimeChart()
+        self.createBandwidthTimeChart()
         
         image_path = gnuplot_scriptpath(self.report_dir, 'requests_rps.png')
         image2_path = gnuplot_scriptpath(self.report_dir, 'requests.png')
@@ -499,6 +541,46 @@ class RenderHtmlGnuPlot(RenderHtmlBase):
         return
 
 
+    def createConcurrencyChart(self):
+        """Create the response time by active users chart."""
+        image_path = gnuplot_scriptpath(self.report_dir, 'concurrency.png')
+        gplot_path = str(os.path.join(self.report_dir, 'concurrency.gplot'))
+        data_path = gnuplot_scriptpath(self.report_dir, 'concurrency.data')
+        stats = self.stats
+        # data
+        concurrency = []
+        for cycle in self.cycles:
+            concurrency.extend(stats[cycle].get('concurrency', {}).values())
+        if not concurrency:
+            return
+        concurrency.sort(key=lambda stat: stat.active_cvus)
+        lines = ["CUs MIN AVG MAX P10 P50 P90 P95"]
+        cvus = []
+        for stat in concurrency:
+            stat.finalize()
+            cvus.append(str(stat.active_cvus))
+            lines.append(' '.join([str(value) for value in (
+                stat.active_cvus, stat.min, stat.avg, stat.max,
+                stat.percentiles.perc10, stat.percentiles.perc50,
+                stat.percentiles.perc90, stat.percentiles.perc95)]))
+        f = open(data_path, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        # script
+        lines = ['set output "' + image_path +'"']
+        lines.append('set title "Requests Response time over active users"')
+        lines.append('set terminal png size ' + self.getChartSizeTmp(cvus))
+        lines.append('set xlabel "Active Users"')
+        lines.append('set ylabel "Duration (s)"')
+        lines.append('set bars 5.0')
+        lines.append('set grid back')
+        lines.append('set style fill solid .25')
+        lines.append('plot "%s" u 1:6:6:8:7 t "med/p90/p95" w candlesticks lt 1 lw 1 whiskerbars 0.5, "" u 1:5:2:6:6 w candlesticks lt 2 lw 1 t "min/p10/med" whiskerbars 0.5, "" u 1:3 t "avg" w points lt 3 lw 2' % data_path)
+        f = open(gplot_path, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        gnuplot(gplot_path)
+
     def createResponseChart(self, step):
         """Create responses chart."""
         image_path = gnuplot_scriptpath(self.report_dir,
@@ -583,6 +665,54 @@ class RenderHtmlGnuPlot(RenderHtmlBase):
         gnuplot(gplot_path)
         return
 
+    def createResponsePhaseChart(self, step):
+        """Create the request phases stacked chart of a step."""
+        image_path = gnuplot_scriptpath(self.report_dir,
+                                        'request_phases_%s.png' % step)
+        gplot_path = str(os.path.join(self.report_dir,
+                                      'request_phases_%s.gplot' % step))
+        data_path = gnuplot_scriptpath(self.report_dir,
+                                       'request_phases_%s.data' % step)
+        stats = self.stats
+        # data
+        lines = ["CUs " + ' '.join([phase.upper()
+                                    for phase in REQUEST_PHASES])]
+        cvus = []
+        for cycle in self.cycles:
+            resp = stats[cycle]['response_step'].get(step)
+            if resp is None or not resp.phase_count:
+                continue
+            resp.finalize()
+            cvus.append(str(resp.cvus))
+            lines.append(' '.join([str(resp.cvus)] + [
+                str(resp.phase_avg[phase]) for phase in REQUEST_PHASES]))
+        if len(lines) == 1:
+            return
+        f = open(data_path, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        # script
+        lines = []
+        lines.append('set output "%s"' % image_path)
+        lines.append('set terminal png size ' + self.getChartSizeTmp(cvus))
+        lines.append('set title "Request %s Average time by phase"' % step)
+        lines.append('set xlabel "Concurrent Users"')
+        lines.append('set ylabel "Duration (s)"')
+        lines.append('set grid back')
+        lines.append('set key outside right')
+        lines.append('set style data histograms')
+        lines.append('set style histogram rowstacked')
+        lines.append('set style fill solid .5 border -1')
+        lines.append('set boxwidth 0.75')
+        plots = ['"%s" u 2:xtic(1) t "%s"' % (data_path, REQUEST_PHASES[0])]
+        for i, phase in enumerate(REQUEST_PHASES[1:]):
+            plots.append('"" u %d t "%s"' % (i + 3, phase))
+        lines.append('plot ' + ', '.join(plots))
+        f = open(gplot_path, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        gnuplot(gplot_path)
+
     def createMonitorChart(self, host):
         """Create monitrored server charts."""
         stats = self.monitor[host]
@@ -20,7 +20,7 @@
 $Id$
 """
 import os
-from utils import get_version
+from utils import get_version, REQUEST_PHASES
 from apdex import Apdex
 from MonitorPluginsDefault import MonitorCPU, MonitorMemFree, MonitorNetwork, MonitorCUs
 
@@ -40,6 +40,17 @@ def rst_title(title, level=1, newpage=True):
     rst.append('')
     return '\n'.join(rst)
 
+def rst_body_sample(body, lines=20, width=120):
+    """Return the first lines of a response body as a literal block."""
+    if not isinstance(body, unicode):
+        body = body.decode('utf-8', 'replace')
+    body_lines = body.encode('ascii', 'replace').strip().splitlines()
+    sample = [line[:width] for line in body_lines[:lines]]
+    if len(body_lines) > lines:
+        sample.append('...')
+    return '\n'.join(['    ' + line for line in sample])
+
+
 def dumb_pluralize(num, word):
     #Doesn't follow all English rules, but sufficent for our purpose
     return ' %s %s' % (num, word + ['s',''][num==1])
@@ -199,6 +210,30 @@ class ResponseRst(BaseRst):
         return ret
 
 
+class PhaseRst(BaseRst):
+    """Response time breakdown by request phase rendering."""
+    headers = ["CUs", "DNS", "CONNECT", "TLS", "SEND", "TTFB", "TRANSFER"]
+    indent = 4
+    image_names = ['request_phases_']
+    with_percentiles = False
+
+    def __init__(self, stats):
+        BaseRst.__init__(self, stats)
+        self.image_names = [name + str(stats.step) + '.' + str(stats.number)
+                            for name in self.image_names]
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        for phase in REQUEST_PHASES:
+            ret.append(self.fmt_float % stats.phase_avg[phase])
+        ret = self.sep.join(ret)
+        return ret
+
+
 class TestRst(BaseRst):
     """Test Rendering."""
     headers = ["CUs", "STPS", "TOTAL", "SUCCESS", "ERROR"]
@@ -219,6 +254,153 @@ class TestRst(BaseRst):
         return ret
 
 
+class CorrectedResponseRst(BaseRst):
+    """Service versus corrected response times rendering."""
+    headers = ["CUs", "MED", "P95", "P99", "MAX", "CORRECTED MED",
+               "CORRECTED P95", "CORRECTED P99", "CORRECTED MAX"]
+    with_percentiles = False
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        percentiles = stats.percentiles
+        corrected = stats.corrected_percentiles
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        ret.append(self.fmt_float % percentiles.perc50)
+        ret.append(self.fmt_float % percentiles.perc95)
+        ret.append(self.fmt_float % percentiles.getPercentile(99))
+        ret.append(self.fmt_float % stats.max)
+        ret.append(self.fmt_float % corrected.perc50)
+        ret.append(self.fmt_float % corrected.perc95)
+        ret.append(self.fmt_float % corrected.getPercentile(99))
+        ret.append(self.fmt_float % stats.corrected_max)
+        ret = self.sep.join(ret)
+        return ret
+
+
+class BandwidthRst(BaseRst):
+    """Network throughput rendering."""
+    headers = ["CUs", "MB/s IN", "maxMB/s IN", "MB/s OUT", "DECODED MB/s",
+               "PAGE KB"]
+    image_names = ['time_bandwidth']
+    with_percentiles = False
+
+    def __init__(self, stats, page_stats=None):
+        BaseRst.__init__(self, stats)
+        self.page_stats = page_stats
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        page_kb = 0
+        if self.page_stats is not None:
+            self.page_stats.finalize()
+            page_kb = self.page_stats.page_kb
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        ret.append(self.fmt_float % stats.mbps_received)
+        ret.append(self.fmt_float % stats.mbps_received_max)
+        ret.append(self.fmt_float % stats.mbps_sent)
+        ret.append(self.fmt_float % stats.mbps_decoded)
+        ret.append(self.fmt_float % page_kb)
+        ret = self.sep.join(ret)
+        return ret
+
+
+class ConcurrencyRst(BaseRst):
+    """ConcurrencyStat rendering."""
+    headers = ["CUs", "ACTIVE CUs", "TOTAL", "ERROR", "MIN", "AVG", "MAX"]
+    image_names = ['concurrency']
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        ret.append(self.fmt_int % stats.active_cvus)
+        ret.append(self.fmt_int % stats.count)
+        ret.append(self.fmt_percent % stats.error_percent)
+        ret.append(self.fmt_float % stats.min)
+        ret.append(self.fmt_float % stats.avg)
+        ret.append(self.fmt_float % stats.max)
+        if self.with_percentiles:
+            self._attach_percentiles(ret)
+        ret = self.sep.join(ret)
+        return ret
+
+
+class ArrivalRst(BaseRst):
+    """Offered load rendering."""
+    headers = ["TARGET", "OFFERED", "STPS", "BACKLOG", "WORKERS"]
+    with_percentiles = False
+
+    def __init__(self, stats, test_stats=None):
+        BaseRst.__init__(self, stats)
+        self.test_stats = test_stats
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        tps = 0
+        if self.test_stats is not None:
+            self.test_stats.finalize()
+            tps = self.test_stats.tps
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_float % stats.rate)
+        ret.append(self.fmt_float % stats.offered_tps)
+        ret.append(self.fmt_float % tps)
+        ret.append(self.fmt_int % stats.backlog)
+        ret.append(self.fmt_int % stats.workers)
+        ret = self.sep.join(ret)
+        return ret
+
+
+class EventRst(BaseRst):
+    """Stream messages rendering."""
+    headers = ["CUs", "MPS", "maxMPS", "TOTAL", "MIN", "AVG", "MAX"]
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        ret.append(self.fmt_float % stats.rps)
+        ret.append(self.fmt_float % stats.rps_max)
+        ret.append(self.fmt_int % stats.count)
+        ret.append(self.fmt_float % stats.min)
+        ret.append(self.fmt_float % stats.avg)
+        ret.append(self.fmt_float % stats.max)
+        if self.with_percentiles:
+            self._attach_percentiles(ret)
+        ret = self.sep.join(ret)
+        return ret
+
+
+class CacheRst(BaseRst):
+    """CacheStat rendering."""
+    headers = ["CUs", "HITS", "REVALIDATED", "MISSES", "HIT RATIO"]
+    with_percentiles = False
+
+    def render_stat(self):
+        """Render rst stat."""
+        stats = self.stats
+        stats.finalize()
+        ret = [' ' * self.indent]
+        ret.append(self.fmt_int % stats.cvus)
+        ret.append(self.fmt_int % stats.hit)
+        ret.append(self.fmt_int % stats.revalidated)
+        ret.append(self.fmt_int % stats.miss)
+        ret.append(self.fmt_percent % stats.hit_percent)
+        ret = self.sep.join(ret)
+        return ret
+
+
 class RenderRst:
     """Render stats in ReST format."""
     # number of slowest requests to display
@@ -430,6 +612,150 @@ class RenderRst:
                         'the cycle duration is too short.\n' % key)
 
 
+    def renderArrivalStat(self):
+        """Render the offered load next to the achieved throughput."""
+        stats = self.stats
+        cycles = [cycle for cycle in self.cycles
+                  if stats[cycle].has_key('arrival')]
+        if not cycles:
+            return
+        self.append(rst_title('Arrival stats', 2))
+        self.append('The tests started per second at a **TARGET** rate, '
+                    'the **OFFERED** tests per second during the cycle and '
+                    'the Successful **Tests** Per Second (STPS) achieved.\n'
+                    'The **BACKLOG** is the number of arrivals still '
+                    'waiting for a worker at the end of the cycle.')
+        self.append('')
+        renderer = None
+        for cycle in cycles:
+            renderer = ArrivalRst(stats[cycle]['arrival'],
+                                  stats[cycle].get('test'))
+            if cycle == cycles[0]:
+                self.append(renderer.render_header())
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
+    def renderCorrectedStat(self):
+        """Render the service and corrected response times."""
+        stats = self.stats
+        cycles = [cycle for cycle in self.cycles
+                  if stats[cycle].has_key('response') and
+                  stats[cycle]['response'].corrected_percentiles.results]
+        if not cycles:
+            return
+        self.append(rst_title('Corrected request stats', 2))
+        self.append('The service time of the **Requests** next to the '
+                    'response time **CORRECTED** with the delay between '
+                    'the scheduled and the actual start of the test, '
+                    'requests that should have been sent while a virtual '
+                    'user was stuck are no more omitted.')
+        self.append('')
+        renderer = None
+        for cycle in cycles:
+            renderer = CorrectedResponseRst(stats[cycle]['response'])
+            if cycle == cycles[0]:
+                self.append(renderer.render_header())
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
+    def renderConcurrencyStat(self):
+        """Render the response times by number of active users."""
+        stats = self.stats
+        cycles = [cycle for cycle in self.cycles
+                  if stats[cycle].has_key('concurrency')]
+        if not cycles:
+            return
+        self.append(rst_title('Concurrency stats', 2))
+        self.append('The response times of the **Requests** over the number '
+                    'of users that were active when the load shape changes '
+                    'the Concurrent Users (CUs) during a cycle.')
+        self.append('')
+        first = True
+        renderer = None
+        for cycle in cycles:
+            concurrency = stats[cycle]['concurrency']
+            for active_cvus in sorted(concurrency.keys()):
+                renderer = ConcurrencyRst(concurrency[active_cvus])
+                if first:
+                    self.append(renderer.render_header(self.with_chart))
+                    first = False
+                self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
+    def getBandwidthCycles(self):
+        """Return the cycles with bytes counted on the wire."""
+        return [cycle for cycle in self.cycles
+                if self.stats[cycle].has_key('response') and
+                self.stats[cycle]['response'].bytes_count]
+
+    def renderBandwidthStat(self):
+        """Render the network throughput."""
+        stats = self.stats
+        cycles = self.getBandwidthCycles()
+        if not cycles:
+            return
+        self.append(rst_title('Bandwidth stats', 2))
+        self.append('The MegaBytes per second received (**IN**) and sent '
+                    '(**OUT**) on the wire, the **DECODED** throughput of '
+                    'the response bodies and the average decoded size of a '
+                    'page with its resources.')
+        self.append('')
+        renderer = None
+        for cycle in cycles:
+            renderer = BandwidthRst(stats[cycle]['response'],
+                                    stats[cycle].get('page'))
+            if cycle == cycles[0]:
+                self.append(renderer.render_header(self.with_chart))
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
+    def renderCacheStat(self):
+        """Render the browser cache usage."""
+        stats = self.stats
+        cycles = [cycle for cycle in self.cycles
+                  if stats[cycle].has_key('cache')]
+        if not cycles:
+            return
+        self.append(rst_title('Cache stats', 2))
+        self.append('The css and images served by the browser cache '
+                    '(**HITS**), the stale ones **REVALIDATED** by the '
+                    'server with a 304 response and the **MISSES**. Cache '
+                    'hits are not counted as requests in the other '
+                    'tables.')
+        self.append('')
+        renderer = None
+        for cycle in cycles:
+            renderer = CacheRst(stats[cycle]['cache'])
+            if cycle == cycles[0]:
+                self.append(renderer.render_header())
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
+    def getEventCycles(self):
+        """Return the cycles with messages received on streams."""
+        return [cycle for cycle in self.cycles
+                if self.stats[cycle].has_key('event')]
+
+    def renderEventStat(self):
+        """Render the messages received on streams."""
+        stats = self.stats
+        cycles = self.getEventCycles()
+        if not cycles:
+            return
+        self.append(rst_title('Stream stats', 2))
+        self.append('The **Messages** Per Second (MPS) received on comet '
+                    'and Server-Sent Events streams and the time waited '
+                    'between two messages of a stream. Messages are not '
+                    'counted as requests in the other tables.')
+        self.append('')
+        renderer = None
+        for cycle in cycles:
+            renderer = EventRst(stats[cycle]['event'])
+            if cycle == cycles[0]:
+                self.append(renderer.render_header())
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
+
     def renderCyclesStepStat(self, step):
         """Render a step stats for all cycle."""
         stats = self.stats
@@ -446,6 +772,36 @@ class RenderRst:
             self.append(renderer.render_stat())
         if renderer is not None:
             self.append(renderer.render_footer())
+        self.renderCyclesStepPhases(step)
+
+    def hasRequestPhases(self):
+        """Return True if the duration of the request phases is recorded."""
+        for cycle in self.cycles:
+            for stat in self.stats[cycle].get('response_step', {}).values():
+                if stat.phase_count:
+                    return True
+        return False
+
+    def renderCyclesStepPhases(self, step):
+        """Render the average duration of the request phases of a step for
+        all cycle."""
+        stats = self.stats
+        step_stats = [stats[cycle]['response_step'][step]
+                      for cycle in self.cycles
+                      if stats[cycle]['response_step'].has_key(step)]
+        step_stats = [stat for stat in step_stats if stat.phase_count]
+        if not step_stats:
+            return
+        self.append('')
+        self.append(' ' * 4 + 'Average duration of the request phases:')
+        self.append('')
+        renderer = None
+        for stat in step_stats:
+            renderer = PhaseRst(stat)
+            if stat is step_stats[0]:
+                self.append(renderer.render_header(self.with_chart))
+            self.append(renderer.render_stat())
+        self.append(renderer.render_footer())
 
     def renderPageDetail(self, cycle_r):
         """Render a page detail."""
@@ -536,6 +892,7 @@ class RenderRst:
                 key = (stat.code,
                        header.get('bobo-exception-file'),
                        header.get('bobo-exception-line'),
+                       stat.body_hash,
                        )
                 err_list = errors.setdefault(key, [])
                 err_list.append(stat)
@@ -544,7 +901,9 @@ class RenderRst:
             self.append(rst_title(status + 's', 3))
             for err_type in err_types:
                 stat = errors[err_type][0]
+                header = stat.header
                 pluralized_times = dumb_pluralize(len(errors[err_type]), 'time')
+                body = stat.getBody()
                 if err_type[1]:
                     self.append(LI + '%s, code: %s, %s\n'
                                 '  in %s, line %s: %s' %(
@@ -553,6 +912,11 @@ class RenderRst:
                         header.get('bobo-exception-type'),
                         err_type[1], err_type[2],
                         header.get('bobo-exception-value')))
+                elif body and body.strip() and not stat.traceback:
+                    # one sample of the responses with the same body
+                    self.append(LI + '%s, code: %s, body %s::\n\n%s\n' % (
+                        pluralized_times, err_type[0], err_type[3][:12],
+                        rst_body_sample(body)))
                 else:
                     traceback = stat.traceback and stat.traceback.replace(
                         'File ', '\n    File ') or 'No traceback.'
@@ -585,6 +949,18 @@ class RenderRst:
                     ' of pages or requests are delivered.')
         self.append(LI + ' P95: 95th percentile, response time where 95 percent'
                     ' of pages or requests are delivered.')
+        if self.getBandwidthCycles():
+            self.append(LI + ' MB/s IN, MB/s OUT: MegaBytes per second'
+                        ' received and sent on the wire, headers included.')
+        if self.hasRequestPhases():
+            self.append(LI + ' DNS, CONNECT, TLS: Name resolution, TCP'
+                        ' connection and TLS handshake times, 0 on a reused'
+                        ' connection.')
+            self.append(LI + ' SEND, TTFB, TRANSFER: Time to send the'
+                        ' request, to receive the response headers and to'
+                        ' read the body.')
+        if self.getEventCycles():
+            self.append(LI + ' MPS: Messages received on streams per second.')
         self.append(LI + Apdex.description_para)
         self.append(LI + Apdex.rating_para)
         self.append('')
@@ -609,6 +985,7 @@ class RenderRst:
         self.renderCyclesStat('test', 'Test stats',
                               'The number of Successful **Tests** Per Second '
                               '(STPS) over Concurrent Users (CUs).')
+        self.renderArrivalStat()
         self.renderCyclesStat('page', 'Page stats',
                               'The number of Successful **Pages** Per Second '
                               '(SPPS) over Concurrent Users (CUs).\n'
@@ -616,6 +993,11 @@ class RenderRst:
         self.renderCyclesStat('response', 'Request stats',
                               'The number of **Requests** Per Second (RPS) '
                               '(successful or not) over Concurrent Users (CUs).')
+        self.renderBandwidthStat()
+        self.renderCorrectedStat()
+        self.renderConcurrencyStat()
+        self.renderCacheStat()
+        self.renderEventStat()
         self.renderSlowestRequests(self.slowest_items)
         self.renderMonitors()
         self.renderPageDetail(cycle_r)
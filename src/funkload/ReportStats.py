@@ -21,6 +21,7 @@ $Id: ReportStats.py 24737 2005-08-31 09:00:16Z bdelbosc $
 """
 
 from apdex import Apdex
+from utils import REQUEST_PHASES
 
 
 class MonitorStat:
@@ -31,15 +32,28 @@ class MonitorStat:
 
 
 class ErrorStat:
-    """Collect Error or Failure stats."""
-    def __init__(self, cycle, step, number, code, header, body, traceback):
+    """Collect Error or Failure stats.
+
+    A body that is not inlined in the result file is read from the body
+    store when rendered."""
+    def __init__(self, cycle, step, number, code, header, body, traceback,
+                 body_hash=None, body_store=None):
         self.cycle = cycle
         self.step = step
         self.number = number
         self.code = code
-        self.header = header and header.copy() or {}
+        # the headers of the body store are shared by the errors
+        self.header = header or {}
         self.body = body or None
         self.traceback = traceback
+        self.body_hash = body_hash
+        self.body_store = body_store
+
+    def getBody(self):
+        """Return the body of the response."""
+        if self.body is None and self.body_hash and self.body_store:
+            return self.body_store.get(self.body_hash)
+        return self.body
 
 
 class Percentiles:
@@ -59,18 +73,17 @@ class Percentiles:
 
     def calcPercentiles(self):
         """Compute percentiles."""
-        results = self.results
-        results.sort()
-        len_results = len(results)
-        old_value = -1
+        self.results.sort()
         for perc in range(0, 100, self.stepsize):
-            index = int(perc / 100.0 * len_results)
-            try:
-                value = results[index]
-            except IndexError:
-                value = -1.0
-            setattr(self, "perc%02d" % perc, float(value))
-            old_value = value
+            setattr(self, "perc%02d" % perc, self.getPercentile(perc))
+
+    def getPercentile(self, perc):
+        """Return any percentile, results must be sorted."""
+        index = int(perc / 100.0 * len(self.results))
+        try:
+            return float(self.results[index])
+        except IndexError:
+            return -1.0
 
     def __str__(self):
         self.calcPercentiles()
@@ -128,10 +141,38 @@ class AllResponseStat:
         self.percentiles = Percentiles(stepsize=5, name=cycle)
         self.apdex = ApdexStat()
         self.apdex_score = None
+        # response times corrected for coordinated omission
+        self.corrected_percentiles = Percentiles(stepsize=5, name=cycle)
+        self.corrected_max = 0
+        # bytes on the wire and decoded bytes of the responses
+        self.bytes_count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.bytes_per_second = {}
+        self.mbps_sent = 0
+        self.mbps_received = 0
+        self.mbps_received_max = 0
+        self.mbps_decoded = 0
+
+    def addBytes(self, date, sent, received, decoded):
+        """Add the bytes of a response."""
+        date_s = int(float(date))
+        self.bytes_count += 1
+        self.bytes_sent += int(sent)
+        self.bytes_received += int(received)
+        self.bytes_decoded += int(decoded)
+        self.bytes_per_second[date_s] = self.bytes_per_second.get(
+            date_s, 0) + int(received)
+        self.finalized = False
 
-    def add(self, date, result, duration):
-        """Add a new response to stat."""
+    def add(self, date, result, duration, corrected_duration=None,
+            wire_bytes=None):
+        """Add a new response to stat, wire_bytes is a tuple of bytes sent,
+        received and decoded if recorded."""
         date_s = int(float(date))
+        if wire_bytes is not None:
+            self.addBytes(date, *wire_bytes)
         self.per_second[date_s] = self.per_second.setdefault(
             int(date_s), 0) + 1
         self.count += 1
@@ -146,6 +187,10 @@ class AllResponseStat:
         self.finalized = False
         self.percentiles.addResult(duration_f)
         self.apdex.add(duration_f)
+        if corrected_duration is not None:
+            corrected_f = float(corrected_duration)
+            self.corrected_max = max(self.corrected_max, corrected_f)
+            self.corrected_percentiles.addResult(corrected_f)
 
     def finalize(self):
         """Compute avg times."""
@@ -170,26 +215,47 @@ class AllResponseStat:
             self.rps = rps
         self.rps_max = rps_max
         self.rps_min = rps_min
+        if self.cycle_duration:
+            duration = float(self.cycle_duration)
+            self.mbps_sent = self.bytes_sent / 1e6 / duration
+            self.mbps_received = self.bytes_received / 1e6 / duration
+            self.mbps_decoded = self.bytes_decoded / 1e6 / duration
+        if self.bytes_per_second:
+            self.mbps_received_max = max(self.bytes_per_second.values()) / 1e6
         self.percentiles.calcPercentiles()
+        self.corrected_percentiles.calcPercentiles()
         self.apdex_score = self.apdex.getScore()
         self.finalized = True
 
 
 class SinglePageStat:
-    """Collect stat for a single page."""
+    """Collect stat for a single page.
+
+    The page duration is the sum of its responses durations, or the wall
+    clock time when responses were fetched in parallel."""
     def __init__(self, step):
         self.step = step
         self.count = 0
         self.date_s = None
+        self.start = self.stop = None
+        self.total = 0.0
         self.duration = 0.0
         self.result = 'Successful'
 
     def addResponse(self, date, result, duration):
         """Add a response to a page."""
         self.count += 1
+        date = float(date)
+        duration = float(duration)
         if self.date_s is None:
-            self.date_s = int(float(date))
-        self.duration += float(duration)
+            self.date_s = int(date)
+            self.start = date
+            self.stop = date + duration
+        else:
+            self.start = min(self.start, date)
+            self.stop = max(self.stop, date + duration)
+        self.total += duration
+        self.duration = min(self.total, self.stop - self.start)
         if result != 'Successful':
             self.result = result
 
@@ -204,8 +270,10 @@ class PageStat(AllResponseStat):
     def __init__(self, cycle, cycle_duration, cvus):
         AllResponseStat.__init__(self, cycle, cycle_duration, cvus)
         self.threads = {}
+        self.page_kb = 0
 
-    def add(self, thread, step,  date, result, duration, rtype):
+    def add(self, thread, step,  date, result, duration, rtype,
+            wire_bytes=None):
         """Add a new response to stat."""
         thread = self.threads.setdefault(thread, {'count': 0,
                                                   'pages': {}})
@@ -223,6 +291,8 @@ class PageStat(AllResponseStat):
                                           SinglePageStat(step))
         stat.addResponse(date, result, duration)
         self.apdex.add(float(duration))
+        if wire_bytes is not None:
+            self.addBytes(date, *wire_bytes)
         self.finalized = False
 
     def finalize(self):
@@ -248,6 +318,8 @@ class PageStat(AllResponseStat):
         if self.cycle_duration:
             # override rps to srps
             self.rps = self.success / float(self.cycle_duration)
+        if self.count:
+            self.page_kb = self.bytes_decoded / 1024.0 / self.count
         self.percentiles.calcPercentiles()
         self.finalized = True
 
@@ -273,9 +345,14 @@ class ResponseStat:
         self.percentiles = Percentiles(stepsize=5, name=step)
         self.apdex = ApdexStat()
         self.apdex_score = None
-
-    def add(self, rtype, result, url, duration, description=None):
-        """Add a new response to stat."""
+        self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.phase_count = 0
+        self.phase_avg = {}
+
+    def add(self, rtype, result, url, duration, description=None,
+            phases=None):
+        """Add a new response to stat, phases is a dict of the request phase
+        durations if recorded."""
         self.count += 1
         if result == 'Successful':
             self.success += 1
@@ -291,6 +368,10 @@ class ResponseStat:
             self.description = description
         self.finalized = False
         self.apdex.add(float(duration))
+        if phases is not None:
+            self.phase_count += 1
+            for phase in REQUEST_PHASES:
+                self.phases[phase] += phases.get(phase, 0)
 
     def finalize(self):
         """Compute avg times."""
@@ -303,6 +384,10 @@ class ResponseStat:
             self.error_percent = 100.0 * self.error / float(self.count)
         self.percentiles.calcPercentiles()
         self.apdex_score = self.apdex.getScore()
+        if self.phase_count:
+            for phase in REQUEST_PHASES:
+                self.phase_avg[phase] = (self.phases[phase] /
+                                         self.phase_count)
         self.finalized = True
 
 
@@ -365,3 +450,106 @@ class TestStat:
             self.tps = self.success / float(self.cycle_duration)
         self.percentiles.calcPercentiles()
         self.finalized = True
+
+
+class ArrivalStat:
+    """Collect the arrivals offered during a cycle of an open model bench."""
+    def __init__(self, cycle, cycle_duration, cvus):
+        self.cycle = cycle
+        self.cycle_duration = float(cycle_duration)
+        self.cvus = int(cvus)
+        self.rate = 0.0
+        self.offered = 0
+        self.backlog = 0
+        self.workers = 0
+        self.offered_tps = 0
+        self.finalized = False
+
+    def add(self, rate, offered, backlog, workers):
+        """Add the arrivals of a dispatcher."""
+        self.finalized = False
+        self.rate += float(rate)
+        self.offered += int(offered)
+        self.backlog += int(backlog)
+        self.workers += int(workers)
+
+    def finalize(self):
+        """Compute the offered load."""
+        if self.finalized:
+            return
+        if self.cycle_duration:
+            self.offered_tps = self.offered / self.cycle_duration
+        self.finalized = True
+
+
+class ConcurrencyStat:
+    """Collect stat for the responses received while a number of users
+    were active."""
+    def __init__(self, cycle, cvus, active_cvus):
+        self.cycle = cycle
+        self.cvus = int(cvus)
+        self.active_cvus = int(active_cvus)
+        self.max = 0
+        self.min = 999999999
+        self.avg = 0
+        self.total = 0
+        self.count = 0
+        self.error = 0
+        self.error_percent = 0
+        self.finalized = False
+        self.percentiles = Percentiles(stepsize=5, name=cycle)
+
+    def add(self, result, duration):
+        """Add a new response to stat."""
+        self.finalized = False
+        self.count += 1
+        if result != 'Successful':
+            self.error += 1
+        duration_f = float(duration)
+        self.max = max(self.max, duration_f)
+        self.min = min(self.min, duration_f)
+        self.total += duration_f
+        self.percentiles.addResult(duration_f)
+
+    def finalize(self):
+        """Compute avg times."""
+        if self.finalized:
+            return
+        if self.count:
+            self.avg = self.total / float(self.count)
+        self.min = min(self.max, self.min)
+        if self.error:
+            self.error_percent = 100.0 * self.error / float(self.count)
+        self.percentiles.calcPercentiles()
+        self.finalized = True
+
+
+class CacheStat:
+    """Collect the cache hits, revalidations and misses of a cycle."""
+    def __init__(self, cycle, cvus):
+        self.cycle = cycle
+        self.cvus = int(cvus)
+        self.hit = 0
+        self.revalidated = 0
+        self.miss = 0
+        self.hit_percent = 0
+        self.finalized = False
+
+    def add(self, cache):
+        """Add a cached response."""
+        self.finalized = False
+        if cache == 'hit':
+            self.hit += 1
+        elif cache == 'revalidated':
+            self.revalidated += 1
+        else:
+            self.miss += 1
+
+    def finalize(self):
+        """Compute the hit ratio."""
+        if self.finalized:
+            return
+        count = self.hit + self.revalidated + self.miss
+        if count:
+            self.hit_percent = 100.0 * self.hit / count
+        self.finalized = True
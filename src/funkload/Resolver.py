@@ -0,0 +1,112 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A process wide cache of the host name resolutions.
+
+The cache is enabled in the bench or ftest section of the configuration,
+the ttl is in seconds as the system resolver does not give the records
+ttl:
+
+  dns_cache_ttl = 60
+
+Host names can be pinned to addresses in a hosts section, like in
+/etc/hosts:
+
+  [hosts]
+  www.example.com = 10.0.0.1 10.0.0.2
+
+The new connections to a host use its addresses in turn.
+"""
+import time
+import socket
+import threading
+
+
+class Resolver:
+    """Resolve host names for the connections of a process."""
+    def __init__(self, ttl=0, hosts=None):
+        self.ttl = ttl
+        self.hosts = hosts or {}
+        # (host, port) -> (expires, addresses)
+        self.entries = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def configure(self, ttl, hosts):
+        """Change the ttl and the pinned hosts, clearing the cache if they
+        change."""
+        if ttl != self.ttl or hosts != self.hosts:
+            self.lock.acquire()
+            try:
+                self.ttl = ttl
+                self.hosts = hosts
+                self.entries.clear()
+            finally:
+                self.lock.release()
+
+    def resolve(self, host, port):
+        """Return the uncached getaddrinfo of a host."""
+        addresses = self.hosts.get(host.lower())
+        if not addresses:
+            return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        ret = []
+        for address in addresses:
+            ret.extend(socket.getaddrinfo(address, port, 0,
+                                          socket.SOCK_STREAM, 0,
+                                          socket.AI_NUMERICHOST))
+        return ret
+
+    def getaddrinfo(self, host, port):
+        """Return the getaddrinfo of a host, starting with the next address
+        of the round robin."""
+        key = (host, port)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now:
+            addresses = self.resolve(host, port)
+            if host.lower() in self.hosts:
+                entry = (float('inf'), addresses)
+            else:
+                entry = (now + self.ttl, addresses)
+            if entry[0] > now:
+                self.entries[key] = entry
+        addresses = entry[1]
+        if len(addresses) < 2:
+            return addresses
+        self.lock.acquire()
+        try:
+            index = self.counters.get(key, 0)
+            self.counters[key] = (index + 1) % len(addresses)
+        finally:
+            self.lock.release()
+        index = index % len(addresses)
+        return addresses[index:] + addresses[:index]
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.counters.clear()
+        finally:
+            self.lock.release()
+
+
+_resolver = Resolver()
+
+def get_resolver():
+    """Return the resolver of the process."""
+    return _resolver
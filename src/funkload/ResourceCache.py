@@ -0,0 +1,207 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A browser cache for the css and images of the pages.
+
+The cache is enabled in the bench or ftest section of the configuration:
+
+  http_cache = 1
+  http_cache_scope = vu
+  http_cache_size = 10
+
+The scope is either vu, a cache per virtual user kept across its tests,
+or process, a cache shared by the virtual users of a process. The size is
+in MB of kept response headers, the least recently used responses are
+evicted first.
+
+Responses are fresh according to their Cache-Control max-age or Expires
+headers, a stale response with an ETag or a Last-Modified header is
+revalidated using a conditional request. Cached responses are kept
+without their body, it is not needed to log a cache hit.
+"""
+import copy
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+
+
+def get_expires(headers, now):
+    """Return the time until which a response is fresh, None when it must
+    not be stored."""
+    if headers is None:
+        return now
+    directives = [directive.strip() for directive in
+                  headers.get('cache-control', '').lower().split(',')]
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return now
+    for directive in directives:
+        if directive.startswith('max-age='):
+            try:
+                return now + int(directive[8:])
+            except ValueError:
+                pass
+    expires = headers.get('expires')
+    if expires:
+        parsed = parsedate_tz(expires)
+        if parsed is not None:
+            return mktime_tz(parsed)
+    # an invalid Expires is already expired
+    return now
+
+
+def get_headers_size(headers):
+    """Return the size of the header lines of a response."""
+    if headers is None:
+        return 0
+    lines = getattr(headers, 'headers', None)
+    if lines is None:
+        # a mapping of the headers
+        return sum([len(key) + len(value) + 4
+                    for key, value in headers.items()])
+    return sum([len(line) for line in lines])
+
+
+class ResourceInfo(object):
+    """What the browser keeps of a css or an image: its status, size and
+    validators."""
+    __slots__ = ('code', 'size', 'etag', 'last_modified')
+
+    def __init__(self, response):
+        self.code = response.code
+        self.size = len(response.body or '')
+        headers = response.headers
+        if headers is None:
+            self.etag = self.last_modified = None
+        else:
+            self.etag = headers.get('etag')
+            self.last_modified = headers.get('last-modified')
+
+    def canRevalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def getConditionalHeaders(self):
+        """Return the headers of a conditional request."""
+        headers = []
+        if self.etag is not None:
+            headers.append(('If-None-Match', self.etag))
+        if self.last_modified is not None:
+            headers.append(('If-Modified-Since', self.last_modified))
+        return headers
+
+
+class CacheEntry(ResourceInfo):
+    """A cached response, kept_size is the size it takes in the cache."""
+    def __init__(self, response, expires):
+        ResourceInfo.__init__(self, response)
+        self.expires = expires
+        self.response = copy.copy(response)
+        self.response.body = None
+        self.kept_size = get_headers_size(response.headers)
+
+    def isFresh(self, now):
+        return self.expires > now
+
+
+class ResourceCache:
+    """A size bounded LRU cache of responses keyed by url.
+
+    The cache is thread safe so it can be shared by the virtual users of a
+    process."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """Return the entry of an url or None."""
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                # most recently used
+                self.entries[url] = entry
+            return entry
+        finally:
+            self.lock.release()
+
+    def put(self, url, response, now):
+        """Store a response if it is cacheable."""
+        if response.code == 304:
+            # not modified since an entry that is no longer in the cache
+            return
+        expires = get_expires(response.headers, now)
+        if expires is None:
+            self.remove(url)
+            return
+        entry = CacheEntry(response, expires)
+        if entry.kept_size > self.max_size or (
+            not entry.isFresh(now) and not entry.canRevalidate()):
+            self.remove(url)
+            return
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.size -= old.kept_size
+            self.entries[url] = entry
+            self.size += entry.kept_size
+            while self.size > self.max_size:
+                url, old = self.entries.popitem(last=False)
+                self.size -= old.kept_size
+        finally:
+            self.lock.release()
+
+    def refresh(self, entry, response, now):
+        """Update the freshness of an entry revalidated by a 304 response."""
+        expires = get_expires(response.headers, now)
+        if expires is not None:
+            entry.expires = expires
+
+    def remove(self, url):
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.size -= old.kept_size
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.size = 0
+        finally:
+            self.lock.release()
+
+
+_process_cache = None
+_process_cache_lock = threading.Lock()
+
+def get_process_cache(max_size):
+    """Return the cache shared by the virtual users of the process."""
+    global _process_cache
+    _process_cache_lock.acquire()
+    try:
+        if _process_cache is None:
+            _process_cache = ResourceCache(max_size)
+        return _process_cache
+    finally:
+        _process_cache_lock.release()
@@ -0,0 +1,592 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""A compact binary format for the result files.
+
+The format is selected in the bench or ftest section of the configuration:
+
+  result_format = binary
+
+The file starts with a magic string followed by records made of a type
+byte, the length of the payload and the payload:
+
+  * S: an entry of the string table, its id followed by the utf-8 text,
+    written before the first record using it
+  * X: xml text, the config, monitor and failure records are kept in the
+    legacy format
+  * R: a response record
+  * T: a test result record
+
+The response and test result records have fixed fields packed using their
+schema: integers, doubles and string table ids. The optional attributes
+follow as (name id, type, value) where type is i for an integer, f for a
+double, s for a string id and t for an inline text.
+
+The records are queued to the result logger as (name, fields, extra)
+tuples and encoded by the BinaryResultHandler of the process writing the
+file, so the worker processes of a bench share the string table of the
+bench process.
+
+In bench mode the virtual users do not write the records themselves, they
+queue them to the AsyncResultHandler. Its writer thread writes them in
+batches every result_flush_interval seconds, see the bench section:
+
+  result_flush_interval = 1.0
+  result_queue_size = 100000
+
+A record that does not fit in the queue is dropped and counted.
+
+Both formats are compressed when the result_path ends with .gz or .bz2,
+other compressions can be added with register_codec. The readers detect
+the compression of a file from its first bytes.
+"""
+import os
+import bz2
+import gzip
+import zlib
+import struct
+import logging
+import threading
+from Queue import Queue, Full
+from xml.sax.saxutils import quoteattr
+
+MAGIC = 'FLRB\x01'
+HEADER = struct.Struct('<cI')
+
+# name, (field, kind, legacy xml format)
+SCHEMAS = {
+    'response': ('R', (
+        ('cycle', 'I', '%.3i'), ('cvus', 'I', '%.3i'),
+        ('thread', 'I', '%.3i'), ('suite', 's', None), ('name', 's', None),
+        ('step', 'I', '%.3i'), ('number', 'I', '%.3i'), ('type', 's', None),
+        ('result', 's', None), ('url', 's', None), ('code', 's', None),
+        ('description', 's', None), ('time', 'd', None),
+        ('duration', 'd', None))),
+    'testResult': ('T', (
+        ('cycle', 'I', '%.3i'), ('cvus', 'I', '%.3i'),
+        ('thread', 'I', '%.3i'), ('suite', 's', None), ('name', 's', None),
+        ('time', 'd', None), ('result', 's', None), ('steps', 'I', None),
+        ('duration', 'd', None), ('connection_duration', 'd', None),
+        ('requests', 'I', None), ('pages', 'I', None),
+        ('xmlrpc', 'I', None), ('redirects', 'I', None),
+        ('images', 'I', None), ('links', 'I', None)))}
+
+_types = {}
+for _name, (_type, _fields) in SCHEMAS.items():
+    _types[_type] = (_name, _fields,
+                     struct.Struct('<' + ''.join([kind.replace('s', 'I')
+                                                  for (field, kind, fmt)
+                                                  in _fields])))
+_string = struct.Struct('<I')
+_extra = struct.Struct('<Ic')
+_int = struct.Struct('<q')
+_double = struct.Struct('<d')
+
+
+# extension: (magic, writer, decompressor)
+CODECS = {}
+
+
+def register_codec(extension, magic, writer, decompressor):
+    """Register a compression of the result files.
+
+    It is used to write the result paths ending with extension and detected
+    by the magic string starting a file. writer(path) opens a compressed
+    file for writing and decompressor() returns an object with a decompress
+    method and an unused_data attribute like the zlib ones."""
+    CODECS[extension] = (magic, writer, decompressor)
+
+register_codec('.gz', '\x1f\x8b', lambda path: gzip.open(path, 'wb', 6),
+               lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+register_codec('.bz2', 'BZh', lambda path: bz2.BZ2File(path, 'w'),
+               bz2.BZ2Decompressor)
+
+
+def get_codec(path):
+    """Return the extension of the compression of a result file, None if it
+    is not compressed."""
+    f = open(path, 'rb')
+    try:
+        head = f.read(max([len(magic) for magic, writer, decompressor
+                           in CODECS.values()] or [0]))
+    finally:
+        f.close()
+    for extension, (magic, writer, decompressor) in CODECS.items():
+        if head.startswith(magic):
+            return extension
+    return None
+
+
+def open_result(path, mode='rb'):
+    """Open a result file, writing it compressed according to its extension
+    or reading it decompressed according to its content."""
+    if mode.startswith('r'):
+        extension = get_codec(path)
+        if extension is None:
+            return open(path, mode)
+        return DecompressingReader(open(path, 'rb'), CODECS[extension][2])
+    extension = os.path.splitext(path)[1].lower()
+    if extension in CODECS:
+        # a compressed file is always created, a previous file is renamed
+        return CODECS[extension][1](path)
+    return open(path, mode)
+
+
+class DecompressingReader:
+    """Read a compressed file like a plain one.
+
+    A file left without its end by a killed bench is read up to its last
+    flush, the concatenated compressed files are read as one."""
+    block_size = 65536
+
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.current = decompressor()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Decompress the next block of the file."""
+        data = self.fileobj.read(self.block_size)
+        if not data:
+            self.eof = True
+            return
+        blocks = [self.buffer[self.pos:]]
+        while data:
+            try:
+                blocks.append(self.current.decompress(data))
+            except (zlib.error, IOError, EOFError):
+                # a corrupted end
+                self.eof = True
+                break
+            data = self.current.unused_data
+            if data:
+                self.current = self.decompressor()
+        self.buffer = ''.join(blocks)
+        self.pos = 0
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or
+                                len(self.buffer) - self.pos < size):
+            self._fill()
+        if size < 0:
+            end = len(self.buffer)
+        else:
+            end = min(self.pos + size, len(self.buffer))
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def readline(self):
+        end = self.buffer.find('\n', self.pos)
+        while end < 0 and not self.eof:
+            self._fill()
+            end = self.buffer.find('\n', self.pos)
+        if end < 0:
+            end = len(self.buffer)
+        else:
+            end += 1
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    xreadlines = __iter__
+
+    def close(self):
+        self.fileobj.close()
+
+
+def to_text(value):
+    """Return the utf-8 text of a value."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if value is None:
+        return ''
+    return str(value)
+
+
+def format_attributes(extra):
+    """Return the xml attributes of a list of (name, value)."""
+    attributes = []
+    for name, value in extra:
+        if isinstance(value, float):
+            attributes.append(' %s="%.6f"' % (name, value))
+        elif isinstance(value, (int, long)):
+            attributes.append(' %s="%d"' % (name, value))
+        else:
+            attributes.append(' %s=%s' % (name, quoteattr(to_text(value))))
+    return ''.join(attributes)
+
+
+class RecordBuilder:
+    """Build the xml result records of a test case.
+
+    The attributes identifying the virtual user are formatted once per
+    cycle, the urls and descriptions are quoted once."""
+    cache_size = 1024
+
+    def __init__(self, suite_name, test_name):
+        self.suite_name = suite_name
+        self.test_name = test_name
+        self.key = None
+        self.prefix = None
+        self.quoted = {}
+
+    def getPrefix(self, cycle, cvus, thread_id):
+        """Return the attributes identifying a virtual user."""
+        key = (cycle, cvus, thread_id)
+        if key != self.key:
+            self.key = key
+            self.prefix = (' cycle="%.3i" cvus="%.3i" thread="%.3i" '
+                           'suite="%s" name="%s"' % (
+                    cycle, cvus, thread_id, self.suite_name, self.test_name))
+        return self.prefix
+
+    def quote(self, value):
+        """Return the quoted attribute value of a text."""
+        quoted = self.quoted.get(value)
+        if quoted is None:
+            if len(self.quoted) >= self.cache_size:
+                self.quoted.clear()
+            quoted = self.quoted[value] = quoteattr(value)
+        return quoted
+
+    def formatAttributes(self, extra):
+        """Return the xml attributes of a list of (name, value)."""
+        attributes = []
+        for name, value in extra:
+            kind = type(value)
+            if kind is float:
+                attributes.append(' %s="%.6f"' % (name, value))
+            elif kind is int:
+                attributes.append(' %s="%d"' % (name, value))
+            elif kind is str and name != 'traceback':
+                attributes.append(' %s=%s' % (name, self.quote(value)))
+            else:
+                attributes.append(format_attributes(((name, value),)))
+        return ''.join(attributes)
+
+    def response(self, cycle, cvus, thread_id, step, number, rtype, result,
+                 url, code, description, time_start, duration, extra):
+        """Return a response element without its end."""
+        return ('<response%s step="%.3i" number="%.3i" type="%s" '
+                'result="%s" url=%s code="%s" description=%s time="%s" '
+                'duration="%s"%s' % (
+                self.getPrefix(cycle, cvus, thread_id), step, number, rtype,
+                result, self.quote(url), code,
+                description and self.quote(description) or '""', time_start,
+                duration, self.formatAttributes(extra)))
+
+    def testResult(self, cycle, cvus, thread_id, time_start, result, steps,
+                   duration, connection_duration, requests, pages, xmlrpc,
+                   redirects, images, links, extra):
+        """Return a testResult element."""
+        return ('<testResult%s time="%s" result="%s" steps="%s" '
+                'duration="%s" connection_duration="%s" requests="%s" '
+                'pages="%s" xmlrpc="%s" redirects="%s" images="%s" '
+                'links="%s"%s />' % (
+                self.getPrefix(cycle, cvus, thread_id), time_start, result,
+                steps, duration, connection_duration, requests, pages,
+                xmlrpc, redirects, images, links,
+                self.formatAttributes(extra)))
+
+
+def is_binary_result(path):
+    """Check if a result file has the binary format."""
+    f = open_result(path)
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+
+class ResultWriter:
+    """Encode the result records into a file."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.strings = {}
+        stream.write(MAGIC)
+
+    def getStringId(self, value):
+        """Return the id of a string, adding it to the table."""
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+            text = to_text(value)
+            self.stream.write(HEADER.pack('S', 4 + len(text)) +
+                              _string.pack(string_id) + text)
+        return string_id
+
+    def write(self, record):
+        """Write an xml text or a (name, fields, extra) record."""
+        if isinstance(record, basestring):
+            text = to_text(record)
+            self.stream.write(HEADER.pack('X', len(text)) + text)
+            return
+        name, fields, extra = record
+        record_type, schema = SCHEMAS[name]
+        packer = _types[record_type][2]
+        values = list(fields)
+        for i in range(len(schema)):
+            if schema[i][1] == 's':
+                values[i] = self.getStringId(values[i])
+        parts = [packer.pack(*values)]
+        for key, value in extra:
+            if isinstance(value, float):
+                parts.append(_extra.pack(self.getStringId(key), 'f') +
+                             _double.pack(value))
+            elif isinstance(value, (int, long)):
+                parts.append(_extra.pack(self.getStringId(key), 'i') +
+                             _int.pack(value))
+            elif key == 'traceback':
+                text = to_text(value)
+                parts.append(_extra.pack(self.getStringId(key), 't') +
+                             _string.pack(len(text)) + text)
+            else:
+                parts.append(_extra.pack(self.getStringId(key), 's') +
+                             _string.pack(self.getStringId(value)))
+        payload = ''.join(parts)
+        self.stream.write(HEADER.pack(record_type, len(payload)) + payload)
+
+
+class XmlResultHandler(logging.FileHandler):
+    """Write the records of the result logger as xml lines."""
+    def _open(self):
+        return open_result(self.baseFilename, self.mode)
+
+    def emitBatch(self, records):
+        """Write a list of records with a single write."""
+        self.stream.write(''.join([to_text(self.format(record)) + '\n'
+                                   for record in records]))
+        self.flush()
+
+
+class BinaryResultHandler(logging.FileHandler):
+    """Write the records of the result logger in the binary format."""
+    def __init__(self, path):
+        logging.FileHandler.__init__(self, path, 'wb')
+        self.writer = ResultWriter(self.stream)
+
+    def _open(self):
+        return open_result(self.baseFilename, self.mode)
+
+    def emit(self, record):
+        try:
+            self.writer.write(record.msg)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def emitBatch(self, records):
+        """Write a list of records."""
+        for record in records:
+            self.writer.write(record.msg)
+        self.flush()
+
+
+class AsyncResultHandler(logging.Handler):
+    """Queue the result records to a writer thread.
+
+    The writer thread hands the queued records to the target handler every
+    flush_interval seconds, so the virtual users neither wait for the file
+    nor for each other. The records of a thread stay in order."""
+    batch_size = 1000
+
+    def __init__(self, target, queue_size=100000, flush_interval=1.0):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.stats_lock = threading.Lock()
+        self.written = self.dropped = self.max_backlog = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       name='FunkLoadResultWriter')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def handle(self, record):
+        # the queue has its own lock, there is no need to take the handler
+        # lock for each record
+        if not self.filter(record):
+            return 0
+        self.emit(record)
+        return 1
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.stats_lock.acquire()
+            self.dropped += 1
+            self.stats_lock.release()
+
+    def run(self):
+        """Write the queued records until the handler is closed."""
+        while not self.stopping.isSet():
+            self.stopping.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write the records queued so far."""
+        if os.getpid() != self.pid:
+            # a forked process must not write the records of its parent
+            return
+        self.acquire()
+        try:
+            backlog = self.queue.qsize()
+            records = [self.queue.get_nowait() for i in xrange(backlog)]
+            emit_batch = getattr(self.target, 'emitBatch', None)
+            for i in range(0, backlog, self.batch_size):
+                batch = records[i:i + self.batch_size]
+                try:
+                    if emit_batch is not None:
+                        emit_batch(batch)
+                    else:
+                        for record in batch:
+                            self.target.handle(record)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    self.handleError(batch[0])
+            self.stats_lock.acquire()
+            self.written += backlog
+            self.max_backlog = max(self.max_backlog, backlog)
+            self.stats_lock.release()
+        finally:
+            self.release()
+
+    def getStats(self):
+        """Return the records written, dropped and waiting in the queue and
+        the largest batch since the previous call."""
+        self.stats_lock.acquire()
+        try:
+            stats = (self.written, self.dropped, self.queue.qsize(),
+                     self.max_backlog)
+            self.written = self.dropped = self.max_backlog = 0
+        finally:
+            self.stats_lock.release()
+        return stats
+
+    def close(self):
+        """Write the remaining records and close the target."""
+        self.stopping.set()
+        # the writer thread may be writing a batch, flush waits for it
+        self.flush()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def read_results(path):
+    """Yield the records of a binary result file, (None, xml text) or
+    (name, attributes) with the attribute values as in the xml format."""
+    for name, attrs, extra in _read_records(path):
+        yield name, attrs
+
+
+def _read_records(path):
+    """Yield the records of a binary result file with the names of their
+    extra attributes in the recorded order."""
+    f = open_result(path)
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a binary result file' % path)
+        strings = {}
+        header_size = HEADER.size
+        while True:
+            header = f.read(header_size)
+            if len(header) < header_size:
+                # a bench that is killed can leave a truncated record
+                break
+            record_type, size = HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                break
+            if record_type == 'S':
+                strings[_string.unpack_from(payload)[0]] = payload[4:].decode(
+                    'utf-8', 'replace')
+                continue
+            if record_type == 'X':
+                yield None, payload, None
+                continue
+            name, schema, packer = _types[record_type]
+            values = packer.unpack_from(payload)
+            attrs = {}
+            extra = []
+            for (field, kind, fmt), value in zip(schema, values):
+                if kind == 's':
+                    attrs[field] = strings[value]
+                elif fmt is not None:
+                    attrs[field] = fmt % value
+                else:
+                    attrs[field] = repr_number(value)
+            pos = packer.size
+            while pos < size:
+                key_id, kind = _extra.unpack_from(payload, pos)
+                pos += _extra.size
+                if kind == 'f':
+                    value = repr_number(_double.unpack_from(payload, pos)[0])
+                    pos += 8
+                elif kind == 'i':
+                    value = str(_int.unpack_from(payload, pos)[0])
+                    pos += 8
+                elif kind == 's':
+                    value = strings[_string.unpack_from(payload, pos)[0]]
+                    pos += 4
+                else:
+                    length = _string.unpack_from(payload, pos)[0]
+                    pos += 4
+                    value = payload[pos:pos + length].decode('utf-8',
+                                                             'replace')
+                    pos += length
+                attrs[strings[key_id]] = value
+                extra.append(strings[key_id])
+            yield name, attrs, extra
+    finally:
+        f.close()
+
+
+def repr_number(value):
+    """Return the text of a number like the xml format does."""
+    if isinstance(value, float):
+        return str(value)
+    return '%d' % value
+
+
+def convert_to_xml(path, output):
+    """Write a binary result file in the legacy xml format."""
+    for name, attrs, extra in _read_records(path):
+        if name is None:
+            output.write(attrs + '\n')
+            continue
+        schema = SCHEMAS[name][1]
+        fields = [field for field, kind, fmt in schema]
+        for key in extra:
+            if key not in fields:
+                fields.append(key)
+        text = ['<%s' % name]
+        for field in fields:
+            text.append(' %s=%s' % (field, quoteattr(attrs[field])))
+        text.append(' />\n')
+        output.write(''.join(text).encode('utf-8'))
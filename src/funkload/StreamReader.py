@@ -0,0 +1,342 @@
+# (C) Copyright 2011 Nuxeo SAS <http://nuxeo.com>
+# Author: bdelbosc@nuxeo.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+"""Read the body of streaming responses (comet, long polling, Server-Sent
+Events) and deliver whole messages to a consumer.
+
+The bodies are read by blocks, decoded when the transfer encoding is
+chunked and split into messages according to a framing:
+
+  * sse: Server-Sent Events, the consumer gets ServerSentEvent objects
+  * line: the consumer gets each line without its end of line
+  * raw: the consumer gets the data as it comes
+
+All the open streams of a process are read by a single selector thread.
+"""
+import time
+import errno
+import select
+import socket
+import threading
+
+BLOCK_SIZE = 65536
+
+
+class ServerSentEvent:
+    """An event of a text/event-stream response."""
+    def __init__(self, data, event='message', id=None, retry=None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.retry = retry
+
+    def __str__(self):
+        return self.data
+
+    def __repr__(self):
+        return '<ServerSentEvent %s %r>' % (self.event, self.data)
+
+
+class StreamParser:
+    """Split a response body into messages as it is received."""
+    def __init__(self, framing='line', chunked=False, length=None):
+        if framing not in ('sse', 'line', 'raw'):
+            raise ValueError('Unknown stream framing %r' % framing)
+        self.framing = framing
+        self.chunked = chunked
+        # bytes of the body left to read, None to read until the end of
+        # the connection
+        self.length = length
+        self.done = length == 0
+        # chunked decoder state: size, data, crlf or trailer
+        self.state = 'size'
+        self.chunk_left = 0
+        self.raw = ''
+        self.text = ''
+        self.event = {}
+
+    def feed(self, data):
+        """Return the messages completed by the received data."""
+        if self.done:
+            return []
+        if self.length is not None:
+            data = data[:self.length]
+            self.length -= len(data)
+            if not self.length:
+                self.done = True
+        if self.chunked:
+            data = self._decodeChunks(data)
+        if not data:
+            return []
+        if self.framing == 'raw':
+            return [data]
+        self.text += data
+        lines = self.text.split('\n')
+        self.text = lines.pop()
+        if self.framing == 'line':
+            return [line.rstrip('\r') for line in lines]
+        messages = []
+        for line in lines:
+            message = self._parseEventLine(line.rstrip('\r'))
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def close(self):
+        """Return the last message of a stream that ends."""
+        self.done = True
+        if self.framing == 'line' and self.text:
+            text, self.text = self.text, ''
+            return [text.rstrip('\r')]
+        # an incomplete event is discarded
+        return []
+
+    def _decodeChunks(self, data):
+        """Return the data of the chunks, see rfc 2616 section 3.6.1."""
+        self.raw += data
+        ret = []
+        while self.raw and not self.done:
+            if self.state == 'data':
+                block = self.raw[:self.chunk_left]
+                self.raw = self.raw[len(block):]
+                self.chunk_left -= len(block)
+                ret.append(block)
+                if not self.chunk_left:
+                    self.state = 'crlf'
+                continue
+            pos = self.raw.find('\n')
+            if pos < 0:
+                break
+            line = self.raw[:pos].strip()
+            self.raw = self.raw[pos + 1:]
+            if self.state == 'size':
+                try:
+                    self.chunk_left = int(line.split(';', 1)[0], 16)
+                except ValueError:
+                    raise ValueError('Invalid chunk size %r' % line)
+                if self.chunk_left:
+                    self.state = 'data'
+                else:
+                    self.state = 'trailer'
+            elif self.state == 'crlf':
+                self.state = 'size'
+            elif not line:
+                # the blank line after the trailer ends the body
+                self.done = True
+        return ''.join(ret)
+
+    def _parseEventLine(self, line):
+        """Process a line of a text/event-stream, return the event dispatched
+        by a blank line."""
+        if not line:
+            event = self.event
+            self.event = {}
+            if not event.has_key('data'):
+                return None
+            return ServerSentEvent('\n'.join(event['data']),
+                                   event.get('event') or 'message',
+                                   event.get('id'), event.get('retry'))
+        if line.startswith(':'):
+            # a comment or a keep alive
+            return None
+        if ':' in line:
+            field, value = line.split(':', 1)
+            if value.startswith(' '):
+                value = value[1:]
+        else:
+            field, value = line, ''
+        if field == 'data':
+            self.event.setdefault('data', []).append(value)
+        elif field in ('event', 'id'):
+            self.event[field] = value
+        elif field == 'retry' and value.isdigit():
+            self.event[field] = int(value)
+        return None
+
+
+def get_framing(headers):
+    """Return the default framing of a response."""
+    if headers is not None:
+        content_type = headers.get('content-type') or ''
+        if content_type.split(';')[0].strip().lower() == 'text/event-stream':
+            return 'sse'
+    return 'line'
+
+
+class Stream:
+    """The body of a response read by the stream selector.
+
+    The consumer is called with each message, it can close the stream by
+    returning 0. The on_message hook gets the message, the time the previous
+    message was received (or the response headers) and the time this one is
+    received."""
+    def __init__(self, fileobj, headers, consumer, t_headers=None):
+        self.fileobj = fileobj
+        self.sock = fileobj._sock
+        self.headers = headers
+        self.consumer = consumer
+        self.parser = None
+        self.on_message = None
+        self.t_last = t_headers or time.time()
+        self.messages = 0
+        self.error = None
+        self.closed = threading.Event()
+
+    def start(self, framing=None, on_message=None, selector=None):
+        """Start reading the stream in the selector of the process."""
+        headers = self.headers
+        chunked = False
+        length = None
+        if headers is not None:
+            chunked = 'chunked' in (headers.get('transfer-encoding') or
+                                    '').lower()
+            if not chunked and headers.get('content-length'):
+                length = int(headers['content-length'])
+        self.parser = StreamParser(framing or get_framing(headers), chunked,
+                                   length)
+        self.on_message = on_message
+        (selector or get_stream_selector()).add(self)
+        return self
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        """Read the available data, return False when the stream ends."""
+        try:
+            data = self.sock.recv(BLOCK_SIZE)
+            # data already decrypted by an ssl socket is not seen by select
+            pending = getattr(self.sock, 'pending', None)
+            while data and pending is not None and pending():
+                data += self.sock.recv(BLOCK_SIZE)
+        except socket.error, error:
+            if error.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            self.error = error
+            data = ''
+        now = time.time()
+        messages = []
+        if data:
+            messages = self.parser.feed(data)
+        if not data or self.parser.done:
+            messages += self.parser.close()
+        for message in messages:
+            if not self.deliver(message, now):
+                return False
+        return not self.parser.done
+
+    def deliver(self, message, now):
+        """Send a message to the consumer, return False to close the
+        stream."""
+        self.messages += 1
+        t_last, self.t_last = self.t_last, now
+        if self.on_message is not None:
+            self.on_message(message, t_last, now)
+        return self.consumer(message) != 0
+
+    def close(self):
+        """Close the connection and release the threads joining it, called
+        by the selector."""
+        if self.closed.isSet():
+            return
+        try:
+            self.fileobj.close()
+        finally:
+            self.closed.set()
+
+    def join(self, timeout=None):
+        """Wait for the end of the stream."""
+        self.closed.wait(timeout)
+
+    def isAlive(self):
+        return not self.closed.isSet()
+
+    is_alive = isAlive
+
+
+class StreamSelector:
+    """Read the open streams of a process from a single thread."""
+    def __init__(self):
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        # a socket pair to wake up the thread when a stream is added
+        self.waker = self.wakee = None
+
+    def add(self, stream):
+        """Register a stream and wake up the selector thread."""
+        self.lock.acquire()
+        try:
+            self.streams[stream.fileno()] = stream
+            if self.thread is None:
+                self.waker, self.wakee = socket.socketpair()
+                self.thread = threading.Thread(target=self.run,
+                                               name='stream-selector')
+                self.thread.setDaemon(True)
+                self.thread.start()
+            else:
+                self.waker.send('x')
+        finally:
+            self.lock.release()
+
+    def remove(self, stream):
+        self.lock.acquire()
+        try:
+            self.streams.pop(stream.fileno(), None)
+        finally:
+            self.lock.release()
+        stream.close()
+
+    def run(self):
+        """Dispatch the readable streams until there is no more stream."""
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.streams:
+                    self.thread = None
+                    self.waker.close()
+                    self.wakee.close()
+                    return
+                filenos = self.streams.keys()
+            finally:
+                self.lock.release()
+            try:
+                readable = select.select(filenos + [self.wakee], [], [])[0]
+            except (select.error, socket.error), error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fileno in readable:
+                if fileno is self.wakee:
+                    self.wakee.recv(BLOCK_SIZE)
+                    continue
+                stream = self.streams[fileno]
+                try:
+                    alive = stream.read()
+                except Exception, error:
+                    # a consumer or a protocol error only ends its stream
+                    stream.error = error
+                    alive = False
+                if not alive:
+                    self.remove(stream)
+
+
+_selector = StreamSelector()
+
+def get_stream_selector():
+    """Return the stream selector of the process."""
+    return _selector
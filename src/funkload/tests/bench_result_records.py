@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+"""Micro benchmark of the xml response records, in records per second.
+
+The legacy formatting built a dict of the attributes for each response and
+quoted its url and description, the RecordBuilder formats the attributes of
+the virtual user once and caches the quoted texts."""
+import os
+import sys
+import time
+from xml.sax.saxutils import quoteattr
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ResultFile import RecordBuilder, format_attributes
+
+URLS = ['/page/%i?id=%i&q=a+b' % (i % 20, i % 7) for i in range(100)]
+EXTRA = [('connection', 'reused'), ('request_bytes', 120),
+         ('response_bytes', 4096), ('ttfb', 0.0123)]
+
+
+def legacy(i):
+    info = {}
+    info['cycle'] = 1
+    info['cvus'] = 50
+    info['thread_id'] = 12
+    info['suite_name'] = 'Simple'
+    info['test_name'] = 'test_simple'
+    info['step'] = 1
+    info['number'] = i % 10
+    info['type'] = 'get'
+    info['url'] = quoteattr(URLS[i % 100])
+    info['code'] = 200
+    info['description'] = quoteattr('Get the page')
+    info['time_start'] = 1300000000.123
+    info['duration'] = 0.0456
+    info['result'] = 'Successful'
+    info['extra'] = format_attributes(EXTRA)
+    return '''<response cycle="%(cycle).3i" cvus="%(cvus).3i" thread="%(thread_id).3i" suite="%(suite_name)s" name="%(test_name)s" step="%(step).3i" number="%(number).3i" type="%(type)s" result="%(result)s" url=%(url)s code="%(code)s" description=%(description)s time="%(time_start)s" duration="%(duration)s"%(extra)s''' % info + ' />'
+
+
+builder = RecordBuilder('Simple', 'test_simple')
+
+def cached(i):
+    return builder.response(1, 50, 12, 1, i % 10, 'get', 'Successful',
+                            URLS[i % 100], 200, 'Get the page',
+                            1300000000.123, 0.0456, EXTRA) + ' />'
+
+
+def main(count=200000):
+    assert legacy(3) == cached(3)
+    for name, function in (('legacy', legacy), ('builder', cached)):
+        t_start = time.time()
+        for i in xrange(count):
+            function(i)
+        print '%-8s %10.0f records/s' % (name,
+                                         count / (time.time() - t_start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.BodyStore import BodyStore, BodyStoreReader, format_headers
+
+class TestBodyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'funkload.xml.bodies')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_store(self):
+        store = BodyStore(self.path)
+        key = store.add('<html>Oops</html>')
+        self.assertEqual(store.add('<html>Oops</html>'), key)
+        self.assertEqual(BodyStore(self.path).add('<html>Oops</html>'), key)
+        self.assertEqual(os.listdir(self.path), [key])
+        headers = format_headers({'Date': 'now', 'Content-Type': 'text/html',
+                                  'Server': 'test'})
+        self.assertEqual(headers, 'Content-Type: text/html\nServer: test\n')
+        headers_key = store.add(headers)
+        reader = BodyStoreReader([self.path, '/no/such/store'])
+        self.assertEqual(reader.get(key), '<html>Oops</html>')
+        self.assertEqual(reader.get('0' * 40), None)
+        self.assertEqual(reader.getHeaders(headers_key),
+                         {'Content-Type': 'text/html', 'Server': 'test'})
+        self.assert_(reader.getHeaders(headers_key) is
+                     reader.getHeaders(headers_key))
+
+if __name__ == '__main__':
+    unittest.main()
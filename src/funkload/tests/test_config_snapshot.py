@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.FunkLoadTestCase import FunkLoadTestCase
+
+CONFIG = """[main]
+title = Snapshot
+url = http://localhost
+
+[ftest]
+log_to = file
+log_path = %(dir)s/snapshot-test.log
+result_path = %(dir)s/snapshot-test.xml
+"""
+
+class Options:
+    def __init__(self, config):
+        self.config = config
+
+class Snapshot(FunkLoadTestCase):
+    def test_snapshot(self):
+        pass
+
+class TestConfigSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'Snapshot.conf')
+        f = open(path, 'w')
+        f.write(CONFIG % {'dir': self.dir})
+        f.close()
+        self.options = Options(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_isolation(self):
+        first = Snapshot('test_snapshot', self.options)
+        second = Snapshot('test_snapshot', self.options)
+        self.assert_(first._config_snapshot is second._config_snapshot)
+        first._config.set('main', 'title', 'Changed')
+        first._config.set('main', 'added', '1')
+        self.assertEqual(first.conf_get('main', 'title'), 'Changed')
+        self.assertEqual(first.conf_get('main', 'added'), '1')
+        self.assertEqual(second.conf_get('main', 'title'), 'Snapshot')
+        self.assertEqual(second._config.get('main', 'title'), 'Snapshot')
+        self.assertEqual(second.conf_get('main', 'added', None, quiet=True),
+                         None)
+        third = Snapshot('test_snapshot', self.options)
+        self.assertEqual(third.conf_get('main', 'title'), 'Snapshot')
+        self.assertEqual(third._config.has_option('main', 'added'), False)
+
+if __name__ == '__main__':
+    unittest.main()
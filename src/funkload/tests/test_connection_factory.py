@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ConnectionFactory import ConnectionFactory
+
+class TestConnectionFactory(unittest.TestCase):
+
+    def test_routes(self):
+        factory = ConnectionFactory()
+        factory.configure(environ={'HTTP_PROXY': 'http://proxy:3128',
+                                   'https_proxy': 'proxy:3129',
+                                   'no_proxy': 'localhost, .example.com:8080'})
+        route = factory.getRoute('http', 'www.funkload.org', '80')
+        self.assertEqual(route.proxy, ('proxy', 3128))
+        self.assert_(route.forward)
+        self.assertEqual(route.prefix, 'http://www.funkload.org')
+        self.assert_(factory.getRoute('http', 'www.funkload.org', 80).key ==
+                     factory.getRoute('http', 'other', 8000).key)
+        route = factory.getRoute('https', 'www.funkload.org', '8443')
+        self.assert_(route.tunnel)
+        self.assertEqual(route.host_header, 'www.funkload.org:8443')
+        self.assertEqual(factory.getRoute('http', 'localhost', 80).proxy, None)
+        self.assertEqual(factory.getRoute('http', 'a.example.com',
+                                          8080).proxy, None)
+        self.assertEqual(factory.getRoute('http', 'a.example.com', 80).proxy,
+                         ('proxy', 3128))
+        # an empty setting disables the proxy of the environment
+        factory.configure(http_proxy='', environ={'http_proxy': 'proxy:1'})
+        self.assertEqual(factory.getRoute('http', 'localhost', 80).proxy, None)
+        self.assertRaises(ValueError, factory.getRoute, 'ftp', 'host', 21)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import unittest
+from mimetools import Message
+from StringIO import StringIO
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.CookieJar import CookieJar, parse_cookie_date
+from funkload.PatchWebunit import decodeCookies
+
+def set_cookies(jar, url, server, *cookies):
+    headers = Message(StringIO(''.join(['Set-Cookie: %s\r\n' % cookie
+                                        for cookie in cookies]) + '\r\n'))
+    decodeCookies(url, server, headers, jar)
+
+class TestCookieJar(unittest.TestCase):
+
+    def test_dates(self):
+        self.assertEqual(parse_cookie_date('Thu, 01-Jan-1970 00:01:40 GMT'),
+                         100)
+        self.assertEqual(parse_cookie_date('Thu, 01 Jan 1970 00:01:40 GMT'),
+                         100)
+        self.assertEqual(parse_cookie_date('invalid'), None)
+
+    def test_send(self):
+        jar = CookieJar()
+        set_cookies(jar, 'http://www.example.com/', 'www.example.com',
+                    'a=1', 'b=2; Path=/app; Domain=.example.com',
+                    's=3; Secure', 'd=deleted')
+        self.assertEqual(sorted(jar.keys()), ['example.com',
+                                              'www.example.com'])
+        self.assertEqual(jar.getCookies('www.example.com', '/app/x', False),
+                         ('b=2; a=1;', ['b', 'a']))
+        self.assertEqual(jar.getCookies('www.example.com', '/application',
+                                        False), ('a=1;', ['a']))
+        self.assertEqual(jar.getCookies('other.example.com', '/app', True),
+                         ('b=2;', ['b']))
+        self.assertEqual(
+            sorted(jar.getCookies('www.example.com', '/', True)[1]),
+            ['a', 's'])
+        self.assertEqual(jar.getCookies('wwwexample.com', '/app', False),
+                         ('', []))
+
+    def test_expires(self):
+        jar = CookieJar()
+        now = time.time()
+        set_cookies(jar, 'http://host/', 'host', 'a=1; Max-Age=60',
+                    'b=2; Expires=Thu, 01-Jan-2037 00:00:00 GMT')
+        self.assertEqual(jar.getCookies('host', '/', False, now)[1], ['a', 'b'])
+        self.assertEqual(jar.getCookies('host', '/', False, now + 61)[1],
+                         ['b'])
+        self.assertEqual(jar['host']['/'].keys(), ['b'])
+        set_cookies(jar, 'http://host/', 'host', 'b=2; Max-Age=0')
+        self.assertEqual(jar.getCookies('host', '/', False), ('', []))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.LinkExtractor import extract_links
+
+PAGE = """<html><head>
+<BASE href="/root/">
+<link rel="stylesheet" href='style.css?a=1&amp;b=2' />
+<script src="app.js"></script>
+<script>var s = '<img src="no.png">';</script>
+</head><body>
+<!-- <img src="commented.png"> -->
+<a href="/page?id=1">Page <b>one</b></a>
+<abbr title="x">y</abbr>
+<img alt='a > b' src=logo.png>
+<a name="anchor">no href</a>
+</body></html>"""
+
+class TestLinkExtractor(unittest.TestCase):
+
+    def test_extract(self):
+        links = extract_links(PAGE)
+        self.assertEqual(links.base, '/root/')
+        self.assertEqual(links.getBaseUrl('http://host/index.html'),
+                         'http://host/root/')
+        self.assertEqual(links.resources,
+                         [('link', 'style.css?a=1&b=2'),
+                          ('script', 'app.js'),
+                          ('image', 'logo.png')])
+        self.assertEqual(links.anchors,
+                         [('Page <b>one</b>', '/page?id=1')])
+
+    def test_empty(self):
+        links = extract_links('')
+        self.assertEqual(links.resources, [])
+        self.assertEqual(links.getBaseUrl('http://host/'), 'http://host/')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.LoadShape import LoadShape, RampShape, StepShape, SpikeShape
+
+class FakeTest:
+    """Provide the bench configuration of a test."""
+    def __init__(self, **conf):
+        self.conf = conf
+
+    def conf_get(self, section, key, default=None, quiet=False):
+        return self.conf.get(key, default)
+
+    def conf_getInt(self, section, key, default=None, quiet=False):
+        return int(self.conf_get(section, key, default))
+
+    def conf_getFloat(self, section, key, default=None, quiet=False):
+        return float(self.conf_get(section, key, default))
+
+class TestLoadShape(unittest.TestCase):
+
+    def test_constant(self):
+        shape = LoadShape(10, 60, FakeTest())
+        self.assertEqual(shape.getUsers(0), 10)
+        self.assertEqual(shape.getUsers(59), 10)
+
+    def test_ramp(self):
+        shape = RampShape(10, 60, FakeTest(ramp_up=20, ramp_down=10))
+        self.assertEqual(shape.getUsers(0), 0)
+        self.assertEqual(shape.getUsers(10), 5)
+        self.assertEqual(shape.getUsers(30), 10)
+        self.assertEqual(shape.getUsers(55), 5)
+        self.assertEqual(shape.getUsers(60), 0)
+
+    def test_step(self):
+        shape = StepShape(10, 60, FakeTest(steps=2))
+        self.assertEqual(shape.getUsers(0), 5)
+        self.assertEqual(shape.getUsers(30), 10)
+        self.assertEqual(shape.getUsers(65), 10)
+
+    def test_spike(self):
+        shape = SpikeShape(10, 60, FakeTest(spike_start=20, spike_duration=5))
+        self.assertEqual(shape.getUsers(0), 2)
+        self.assertEqual(shape.getUsers(20), 10)
+        self.assertEqual(shape.getUsers(25), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.BenchRunner import LoopTestRunner, ThreadSignaller
+from funkload.BenchRunner import ArrivalDispatcher
+
+class FakeOptions:
+    no_color = True
+
+class FakeThread:
+    def join(self):
+        pass
+
+class FakeThreadData:
+    def __init__(self):
+        self.thread = FakeThread()
+        self.thread_signaller = ThreadSignaller()
+
+class FakeBench:
+    arrival_distribution = 'constant'
+    arrival_max_workers = 10
+
+    def __init__(self):
+        self.thread_creation_lock = threading.Lock()
+        self.locked = []
+
+    def createThread(self, cycle, cvus, thread_id, tickets):
+        self.locked.append(self.thread_creation_lock.locked())
+        return FakeThreadData()
+
+    def createThreadId(self):
+        return 0
+
+class PacedTest:
+    """Record the cycle and the schedule lag of each run."""
+    runs = []
+
+    def __init__(self, name, options):
+        self.cycle = 1
+
+    def clearContext(self):
+        pass
+
+    def __call__(self, result):
+        self.runs.append((self.cycle, self.schedule_lag))
+
+class TestLoopTestRunner(unittest.TestCase):
+
+    def test_pacing_after_reuse(self):
+        PacedTest.runs = []
+        gate = threading.Event()
+        gate.set()
+        signaller = ThreadSignaller(gate)
+        runner = LoopTestRunner('funkload.tests.test_loop_runner',
+                                'PacedTest', 'test_paced', FakeOptions(),
+                                1, 1, 0, signaller, 0, pacing=0.1)
+        runner.start()
+        time.sleep(0.45)
+        gate.clear()
+        # a long pause between the cycles
+        time.sleep(0.6)
+        runner.retag(2, 1)
+        gate.set()
+        time.sleep(0.45)
+        signaller.set_running(False)
+        runner.join(1)
+        for cycle in (1, 2):
+            lags = [lag for run_cycle, lag in PacedTest.runs
+                    if run_cycle == cycle]
+            self.assert_(4 <= len(lags) <= 6, lags)
+            self.assert_(max(lags) < 0.05, lags)
+
+class TestArrivalDispatcher(unittest.TestCase):
+
+    def test_zero_rate(self):
+        dispatcher = ArrivalDispatcher(FakeBench(), 0, 0, 0)
+        # an idle cycle returns at once
+        dispatcher.run()
+        self.assertEqual(dispatcher.offered, 0)
+        self.assert_(dispatcher.tickets.empty())
+        self.assertEqual(dispatcher.threads, [])
+
+    def test_fractional_rate(self):
+        bench = FakeBench()
+        dispatcher = ArrivalDispatcher(bench, 0, 2, 2.5)
+        dispatcher.start()
+        time.sleep(1)
+        dispatcher.stop()
+        # the tickets are not taken, a runner is created for each one
+        self.assertEqual(dispatcher.tickets.qsize(), 3)
+        self.assertEqual(bench.locked, [True] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+from tempfile import mkstemp
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from webunit.utility import Upload
+from funkload.PatchWebunit import MultipartBody
+
+class TestMultipartBody(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = mkstemp(suffix='.txt')
+        os.write(fd, 'abc\r')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_body(self):
+        body = MultipartBody([('a', 'x'), ('f', Upload(self.path))],
+                             '--B', '--B--')
+        expected = ('--B\r\nContent-Disposition: form-data; name="a"\r\n\r\n'
+                    'x\r\n--B\r\nContent-Disposition: form-data; name="f"; '
+                    'filename="%s"\r\nContent-Type: text/plain\r\n\r\n'
+                    'abc\r\r\n\r\n--B--\r\n' % os.path.basename(self.path))
+        self.assertEqual(str(body), expected)
+        self.assertEqual(len(body), len(expected))
+
+    def test_chunks(self):
+        body = MultipartBody([('f', Upload(self.path))], '--B', '--B--')
+        body.chunk_size = 3
+        self.assertEqual(list(body)[1:3], ['abc', '\r'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ConnectionFactory import get_connection_factory
+from funkload.PatchWebunit import WebTestCase, ConnectionPool
+from funkload.PatchWebunit import fetch_resources
+from funkload.ResourceCache import ResourceCache
+
+class SilentServer(threading.Thread):
+    """Answer the first request of a connection, then stay silent."""
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(1)
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.requests = []
+        self.connections = []
+
+    def run(self):
+        while True:
+            try:
+                conn = self.sock.accept()[0]
+            except socket.error:
+                return
+            self.connections.append(conn)
+            data = ''
+            while data.count('\r\n\r\n') < 2:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+                if data.count('\r\n\r\n') == 1 and len(self.requests) == 0:
+                    self.requests.append(data)
+                    conn.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                                 '\r\nok')
+            if data.count('\r\n\r\n') == 2:
+                self.requests.append(data)
+
+    def close(self):
+        self.sock.close()
+        for conn in self.connections:
+            conn.close()
+
+class RecordServer(threading.Thread):
+    """Record the bytes of the requests of a connection and answer them."""
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(1)
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.requests = []
+
+    def run(self):
+        while True:
+            try:
+                conn = self.sock.accept()[0]
+            except socket.error:
+                return
+            data = ''
+            while True:
+                while '\r\n\r\n' not in data:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                if '\r\n\r\n' not in data:
+                    break
+                head = data.split('\r\n\r\n')[0]
+                size = len(head) + 4
+                for line in head.split('\r\n'):
+                    if line.lower().startswith('content-length:'):
+                        size += int(line.split(':')[1])
+                while len(data) < size:
+                    data += conn.recv(4096)
+                self.requests.append(data[:size])
+                data = data[size:]
+                conn.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                             '\r\nok')
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+class CookieHandler(BaseHTTPRequestHandler):
+    """Set a cookie named after the path of the request."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        name = self.path.strip('/')
+        self.send_response(200)
+        self.send_header('Set-Cookie', '%s=1; Path=/' % name)
+        self.send_header('Cache-Control', 'max-age=60')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """Send three lines, or an empty body."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = ''
+        if self.path.endswith('/stream'):
+            body = 'one\ntwo\nthree\n'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class TestKeepAlive(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = get_connection_factory()
+        self.factory.configure(timeout=0.5, environ={})
+        self.server = SilentServer()
+        self.server.start()
+        self.browser = WebTestCase(methodName='log')
+        self.browser.connection_pool = ConnectionPool()
+        self.browser.extra_headers = []
+        self.browser.css = {}
+
+    def tearDown(self):
+        self.server.close()
+        self.browser.connection_pool.clear()
+        self.factory.configure()
+
+    def test_timeout_not_retried(self):
+        url = 'http://127.0.0.1:%i/' % self.server.port
+        response = self.browser.fetch(url)
+        self.assertEqual(response.connection, 'new')
+        # the reused connection times out, a retry would send the request
+        # again on a new connection
+        self.assertRaises(socket.timeout, self.browser.fetch, url)
+        time.sleep(0.1)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.connections), 1)
+
+class TestSentBytes(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = get_connection_factory()
+        self.server = RecordServer()
+        self.server.start()
+        self.url = 'http://127.0.0.1:%i/' % self.server.port
+        self.browser = WebTestCase(methodName='log')
+        self.browser.connection_pool = ConnectionPool()
+        self.browser.extra_headers = []
+        self.browser.css = {}
+
+    def tearDown(self):
+        self.browser.connection_pool.clear()
+        self.server.close()
+        self.factory.configure()
+
+    def checkSentBytes(self):
+        responses = [self.browser.fetch(self.url + 'get'),
+                     self.browser.fetch(self.url + 'post',
+                                        postdata=[('a', '1'), ('b', '2')])]
+        self.browser.extra_headers = [('Accept-Encoding', 'gzip')]
+        responses.append(self.browser.fetch(self.url + 'gzip'))
+        self.assertEqual([response.wire_bytes[0] for response in responses],
+                         [len(request) for request in self.server.requests])
+        self.assertEqual(self.server.requests[0].count('Host:'), 1)
+        self.assertEqual(self.server.requests[2].count('Accept-Encoding'), 1)
+
+    def test_sent_bytes(self):
+        self.factory.configure(environ={})
+        self.checkSentBytes()
+
+    def test_sent_bytes_proxy(self):
+        # the server is its own proxy
+        self.factory.configure(http_proxy=self.url, environ={})
+        self.checkSentBytes()
+        self.assert_(self.server.requests[0].startswith('GET ' + self.url))
+
+class TestFetchResources(unittest.TestCase):
+
+    def test_concurrent_workers(self):
+        server = ThreadingServer(('127.0.0.1', 0), CookieHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(1)
+        thread.start()
+        browser = WebTestCase(methodName='log')
+        browser.connection_pool = ConnectionPool()
+        browser.resource_cache = ResourceCache(1000000)
+        browser.extra_headers = []
+        browser.css = {}
+        try:
+            urls = ['http://127.0.0.1:%i/c%i' % (server.server_address[1], i)
+                    for i in range(60)]
+            results = fetch_resources(browser, [('image', url)
+                                                for url in urls])
+        finally:
+            browser.connection_pool.clear()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(results), 60)
+        self.assertEqual([result[5] for result in results], [None] * 60)
+        names = browser.cookies.getCookies('127.0.0.1', '/', False)[1]
+        self.assertEqual(sorted(names), sorted(['c%i' % i
+                                                for i in range(60)]))
+        self.assertEqual(len(browser.resource_cache.entries), 60)
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = get_connection_factory()
+        self.server = ThreadingServer(('127.0.0.1', 0), StreamHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(1)
+        thread.start()
+        self.url = 'http://127.0.0.1:%i/' % self.server.server_address[1]
+        self.browser = WebTestCase(methodName='log')
+        self.browser.extra_headers = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.factory.configure()
+
+    def checkStream(self):
+        messages = []
+        response = self.browser.fetch(self.url + 'stream',
+                                      consumer=messages.append)
+        self.assertEqual(response.url, '/stream')
+        stream = response.stream.start('line')
+        stream.join(5)
+        self.assertEqual(messages, ['one', 'two', 'three'])
+        # an empty body is not streamed
+        response = self.browser.fetch(self.url + 'empty',
+                                      consumer=messages.append)
+        self.failIf(hasattr(response, 'stream'))
+
+    def test_stream(self):
+        self.factory.configure(environ={})
+        self.checkStream()
+
+    def test_stream_proxy(self):
+        # the server is its own proxy
+        self.factory.configure(http_proxy=self.url, environ={})
+        self.checkStream()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ReportStats import AllResponseStat, ArrivalStat, Percentiles
+from funkload.ReportStats import SinglePageStat, ResponseStat
+
+class TestReportStats(unittest.TestCase):
+
+    def test_percentiles(self):
+        percentiles = Percentiles(stepsize=5, results=range(100, 0, -1))
+        percentiles.calcPercentiles()
+        self.assertEqual(percentiles.perc50, 51.0)
+        self.assertEqual(percentiles.perc95, 96.0)
+        self.assertEqual(percentiles.getPercentile(99), 100.0)
+        self.assertEqual(Percentiles().getPercentile(99), -1.0)
+
+    def test_corrected_duration(self):
+        stat = AllResponseStat('000', 10, 2)
+        for i in range(100):
+            stat.add(1000 + i, 'Successful', 0.1, 0.1 + i / 10.0)
+        stat.add(1100, 'Successful', 0.1)
+        stat.finalize()
+        self.assertEqual(stat.count, 101)
+        self.assertEqual(stat.percentiles.getPercentile(99), 0.1)
+        self.assertEqual(len(stat.corrected_percentiles.results), 100)
+        self.assertAlmostEqual(stat.corrected_percentiles.getPercentile(99),
+                               10.0)
+        self.assertAlmostEqual(stat.corrected_max, 10.0)
+
+    def test_bandwidth(self):
+        stat = AllResponseStat('000', 2, 2)
+        stat.add('100.1', 'Successful', 0.1, wire_bytes=('100', '1000000',
+                                                          '3000000'))
+        stat.add('101.1', 'Successful', 0.1, wire_bytes=('100', '500000',
+                                                          '500000'))
+        stat.add('101.5', 'Successful', 0.1)
+        stat.finalize()
+        self.assertEqual(stat.bytes_count, 2)
+        self.assertAlmostEqual(stat.mbps_received, 0.75)
+        self.assertAlmostEqual(stat.mbps_received_max, 1.0)
+        self.assertAlmostEqual(stat.mbps_decoded, 1.75)
+        self.assertAlmostEqual(stat.mbps_sent, 0.0001)
+
+    def test_arrival(self):
+        stat = ArrivalStat('000', 10, 100)
+        stat.add('50.000', '498', '2', '10')
+        stat.add('50.000', '502', '0', '12')
+        stat.finalize()
+        self.assertEqual(stat.rate, 100.0)
+        self.assertEqual(stat.offered_tps, 100.0)
+        self.assertEqual(stat.backlog, 2)
+        self.assertEqual(stat.workers, 22)
+
+    def test_page_duration(self):
+        page = SinglePageStat(1)
+        page.addResponse('100.0', 'Successful', '0.5')
+        page.addResponse('100.6', 'Successful', '0.2')
+        self.assertAlmostEqual(page.duration, 0.7)
+        # resources fetched in parallel
+        page.addResponse('100.8', 'Successful', '0.3')
+        page.addResponse('100.8', 'Successful', '0.4')
+        self.assertAlmostEqual(page.duration, 1.2)
+
+    def test_phases(self):
+        stat = ResponseStat(1, 1, 2)
+        stat.add('get', 'Successful', '/', '0.4', phases={
+            'dns': 0.1, 'connect': 0.1, 'ttfb': 0.2})
+        stat.add('get', 'Successful', '/', '0.2', phases={'ttfb': 0.2})
+        stat.add('get', 'Successful', '/', '0.2')
+        stat.finalize()
+        self.assertEqual(stat.phase_count, 2)
+        self.assertAlmostEqual(stat.phase_avg['dns'], 0.05)
+        self.assertAlmostEqual(stat.phase_avg['ttfb'], 0.2)
+        self.assertEqual(stat.phase_avg['tls'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
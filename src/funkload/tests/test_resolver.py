@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.Resolver import Resolver
+
+class TestResolver(unittest.TestCase):
+
+    def test_pinned_hosts(self):
+        resolver = Resolver(0, {'www.example.com': ['10.0.0.1', '10.0.0.2']})
+        addresses = [resolver.getaddrinfo('WWW.example.com', 80)[0][4]
+                     for i in range(3)]
+        self.assertEqual(addresses, [('10.0.0.1', 80), ('10.0.0.2', 80),
+                                     ('10.0.0.1', 80)])
+        self.assertEqual(len(resolver.getaddrinfo('www.example.com', 80)), 2)
+
+    def test_ttl(self):
+        resolver = Resolver(0)
+        resolver.getaddrinfo('127.0.0.1', 80)
+        self.assertEqual(resolver.entries, {})
+        resolver.configure(60, {})
+        self.assertEqual(resolver.getaddrinfo('127.0.0.1', 80)[0][4],
+                         ('127.0.0.1', 80))
+        self.assertEqual(resolver.entries.keys(), [('127.0.0.1', 80)])
+
+if __name__ == '__main__':
+    unittest.main()
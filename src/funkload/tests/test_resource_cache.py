@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ResourceCache import ResourceCache, get_expires
+
+class FakeResponse:
+    """A response with its headers."""
+    def __init__(self, body, **headers):
+        self.code = 200
+        self.body = body
+        self.headers = dict([(key.replace('_', '-'), value)
+                             for key, value in headers.items()])
+
+class TestResourceCache(unittest.TestCase):
+
+    def test_expires(self):
+        self.assertEqual(get_expires({'cache-control': 'max-age=60'}, 100),
+                         160)
+        self.assertEqual(get_expires({'cache-control': 'no-store'}, 100),
+                         None)
+        self.assertEqual(get_expires(
+            {'cache-control': 'no-cache, max-age=60'}, 100), 100)
+        self.assertEqual(get_expires(
+            {'expires': 'Thu, 01 Jan 1970 00:01:40 GMT'}, 0), 100)
+        self.assertEqual(get_expires({'expires': '0'}, 100), 100)
+
+    def test_revalidation(self):
+        cache = ResourceCache(100)
+        cache.put('/a', FakeResponse('a'), 100)
+        self.assertEqual(cache.get('/a'), None)
+        cache.put('/a', FakeResponse('a', etag='"1"'), 100)
+        entry = cache.get('/a')
+        self.assertFalse(entry.isFresh(100))
+        self.assertEqual(entry.size, 1)
+        self.assertEqual(entry.response.body, None)
+        self.assertEqual(entry.getConditionalHeaders(),
+                         [('If-None-Match', '"1"')])
+        cache.refresh(entry, FakeResponse('', cache_control='max-age=10'),
+                      100)
+        self.assertTrue(entry.isFresh(105))
+
+    def test_lru(self):
+        # an entry keeps 27 bytes of headers "cache-control: max-age=60"
+        cache = ResourceCache(60)
+        cache.put('/a', FakeResponse('a' * 4, cache_control='max-age=60'), 0)
+        cache.put('/b', FakeResponse('b' * 4, cache_control='max-age=60'), 0)
+        cache.get('/a')
+        cache.put('/c', FakeResponse('c' * 4, cache_control='max-age=60'), 0)
+        self.assertEqual(cache.get('/b'), None)
+        self.assertNotEqual(cache.get('/a'), None)
+        self.assertEqual(cache.size, 54)
+        # the dropped body does not count
+        cache.put('/d', FakeResponse('d' * 200, cache_control='max-age=60'),
+                  0)
+        self.assertEqual(cache.get('/d').size, 200)
+        self.assertEqual(cache.get('/c'), None)
+        self.assertEqual(cache.size, 54)
+
+    def test_not_modified(self):
+        cache = ResourceCache(100)
+        response = FakeResponse('', cache_control='max-age=60')
+        response.code = 304
+        cache.put('/a', response, 0)
+        self.assertEqual(cache.get('/a'), None)
+        self.assertEqual(cache.size, 0)
+
+if __name__ == '__main__':
+    unittest.main()
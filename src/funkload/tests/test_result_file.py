@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import logging
+import unittest
+import tempfile
+from StringIO import StringIO
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.ResultFile import ResultWriter, read_results, convert_to_xml
+from funkload.ResultFile import is_binary_result, AsyncResultHandler
+from funkload.ResultFile import RecordBuilder, open_result, get_codec
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.batches = []
+
+    def emitBatch(self, records):
+        self.batches.append([record.msg for record in records])
+
+class TestResultFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        f = os.fdopen(fd, 'wb')
+        writer = ResultWriter(f)
+        writer.write('<funkload version="1.16.0">')
+        for i in range(2):
+            writer.write(('response', (
+                1, 10, i, 'Simple', 'test_simple', 1, 1, 'get',
+                'Successful', u'/caf\xe9', '200', 'home "page"',
+                1300000000.25, 0.5), [('size', 42), ('connect', 0.125),
+                                      ('traceback', 'a\nb')]))
+        writer.write('</funkload>')
+        f.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_read(self):
+        self.assert_(is_binary_result(self.path))
+        records = list(read_results(self.path))
+        self.assertEqual(len(records), 4)
+        name, attrs = records[1]
+        self.assertEqual(name, 'response')
+        self.assertEqual(attrs['cycle'], '001')
+        self.assertEqual(attrs['thread'], '000')
+        self.assertEqual(attrs['url'], u'/caf\xe9')
+        self.assertEqual(attrs['time'], '1300000000.25')
+        self.assertEqual(attrs['connect'], '0.125')
+        self.assertEqual(attrs['size'], '42')
+        self.assertEqual(attrs['traceback'], 'a\nb')
+
+    def test_convert(self):
+        output = StringIO()
+        convert_to_xml(self.path, output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], '<funkload version="1.16.0">')
+        self.assert_(lines[1].startswith('<response cycle="001" cvus="010"'))
+        self.assert_("description='home \"page\"'" in lines[1])
+        # the extra attributes keep their recorded order
+        self.assert_(lines[2].endswith(' size="42" connect="0.125" '
+                                       'traceback="a&#10;b" />'), lines[2])
+        self.assertEqual(lines[-1], '</funkload>')
+
+class TestAsyncResultHandler(unittest.TestCase):
+
+    def test_queue(self):
+        target = ListHandler()
+        handler = AsyncResultHandler(target, queue_size=3, flush_interval=60)
+        logger = logging.getLogger('FunkLoadTestAsyncResult')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        try:
+            for i in range(5):
+                logger.info(i)
+            self.assertEqual(handler.getStats(), (0, 2, 3, 0))
+            handler.flush()
+            logger.info(5)
+            handler.close()
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(target.batches, [[0, 1, 2], [5]])
+        self.assertEqual(handler.getStats(), (4, 0, 0, 3))
+
+class TestRecordBuilder(unittest.TestCase):
+
+    def test_response(self):
+        builder = RecordBuilder('Simple', 'test_simple')
+        record = builder.response(1, 10, 2, 1, 3, 'get', 'Successful',
+                                  '/a?b=1&c=2', 200, None, 1300000000.25,
+                                  0.5, [('cache', 'hit'), ('size', 42),
+                                        ('ttfb', 0.125)])
+        self.assertEqual(record, '<response cycle="001" cvus="010" '
+                         'thread="002" suite="Simple" name="test_simple" '
+                         'step="001" number="003" type="get" '
+                         'result="Successful" url="/a?b=1&amp;c=2" '
+                         'code="200" description="" time="1300000000.25" '
+                         'duration="0.5" cache="hit" size="42" '
+                         'ttfb="0.125000"')
+        # a retagged test gets a new prefix
+        record = builder.response(2, 20, 2, 1, 3, 'get', 'Successful',
+                                  '/a?b=1&c=2', 200, 'home', 1.5, 0.5, [])
+        self.assert_(record.startswith('<response cycle="002" cvus="020" '))
+        self.assert_(record.endswith(' description="home" time="1.5" '
+                                     'duration="0.5"'))
+
+class TestCompression(unittest.TestCase):
+
+    def test_codecs(self):
+        lines = ''.join(['<response number="%i" />\n' % i
+                         for i in range(5000)])
+        for extension in ('.gz', '.bz2'):
+            fd, path = tempfile.mkstemp(suffix='.xml' + extension)
+            os.close(fd)
+            try:
+                f = open_result(path, 'a')
+                f.write(lines)
+                f.close()
+                self.assertEqual(get_codec(path), extension)
+                self.assertEqual(open_result(path).read(), lines)
+                f = open_result(path)
+                self.assertEqual(f.readline(), '<response number="0" />\n')
+                self.assertEqual(len(list(f)), 4999)
+                # a truncated file is read up to its end
+                data = open(path, 'rb').read()
+                f = open(path, 'wb')
+                f.write(data[:len(data) // 2])
+                f.close()
+                self.assert_(lines.startswith(open_result(path).read()))
+            finally:
+                os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import unittest
+
+if os.path.realpath(os.curdir) == os.path.realpath(os.path.dirname(__file__)):
+    sys.path.append('../..')
+
+from funkload.StreamReader import StreamParser
+
+def feed(parser, data, size):
+    messages = []
+    for i in range(0, len(data), size):
+        messages.extend(parser.feed(data[i:i + size]))
+    return messages
+
+class TestStreamParser(unittest.TestCase):
+
+    def test_sse_chunked(self):
+        body = (': ping\r\nevent: tick\r\nid: 1\r\ndata: a\r\ndata:b\r\n\r\n'
+                'retry: 10\r\n\r\ndata: c\n\n')
+        chunked = ''.join(['%x;ext=1\r\n%s\r\n' % (len(body[i:i + 5]),
+                                                   body[i:i + 5])
+                           for i in range(0, len(body), 5)]) + '0\r\n\r\n'
+        for size in (1, 3, len(chunked)):
+            parser = StreamParser('sse', chunked=True)
+            events = feed(parser, chunked, size)
+            self.assertEqual([(e.event, e.id, e.data) for e in events],
+                             [('tick', '1', 'a\nb'), ('message', None, 'c')])
+            self.assert_(parser.done)
+
+    def test_lines(self):
+        parser = StreamParser('line', length=11)
+        self.assertEqual(feed(parser, 'a\r\nbc\nde', 2), ['a', 'bc'])
+        self.assertEqual(parser.feed('f\ngignored'), ['def'])
+        self.assert_(parser.done)
+        self.assertEqual(parser.close(), ['g'])
+
+    def test_raw(self):
+        parser = StreamParser('raw')
+        self.assertEqual(parser.feed('a\nb'), ['a\nb'])
+        self.assertEqual(parser.close(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,9 +31,24 @@ import pkg_resources
 import tarfile
 import tempfile
 
+from ResultFile import BinaryResultHandler, XmlResultHandler, \
+     AsyncResultHandler
+
+
+g_cooperative_sleep = None
+
+def set_cooperative_sleep(func):
+    """Sleep with func, yielding even for 0s, None to restore time.sleep."""
+    global g_cooperative_sleep
+    g_cooperative_sleep = func
 
 def thread_sleep(seconds=0):
     """Sleep seconds."""
+    if g_cooperative_sleep is not None:
+        # green threads only switch when they block, always give a chance
+        # to the other virtual users
+        g_cooperative_sleep(seconds)
+        return
     # looks like python >= 2.5 does not need a minimal sleep to let thread
     # working properly
     if seconds:
@@ -54,6 +69,21 @@ def set_recording_flag(value):
     global g_recording
     g_recording = value
 
+g_active_cvus = None
+
+def active_cvus():
+    """The number of running users when it changes during a cycle."""
+    global g_active_cvus
+    return g_active_cvus
+
+def set_active_cvus(value):
+    """Set the number of running users, None when it is the cycle CUs."""
+    global g_active_cvus
+    g_active_cvus = value
+
+# the timed phases of a request
+REQUEST_PHASES = ('dns', 'connect', 'tls', 'send', 'ttfb', 'transfer')
+
 # ------------------------------------------------------------
 # daemon
 #
@@ -120,8 +150,11 @@ def mmn_decode(meta_method_name):
 # logging
 #
 def get_default_logger(log_to, log_path=None, level=logging.DEBUG,
-                       name='FunkLoad'):
-    """Get a logger."""
+                       name='FunkLoad', flush_interval=0, queue_size=0):
+    """Get a logger.
+
+    The xml or binary results are written by a writer thread when a
+    flush_interval is given."""
     logger = logging.getLogger(name)
     if logger.handlers:
         # already setup
@@ -142,10 +175,15 @@ def get_default_logger(log_to, log_path=None, level=logging.DEBUG,
         hdlr = logging.FileHandler(log_path)
         hdlr.setFormatter(formatter)
         logger.addHandler(hdlr)
-    if log_to.count("xml") and log_path:
+    if (log_to.count("xml") or log_to.count("binary")) and log_path:
         if os.access(log_path, os.F_OK):
             os.rename(log_path, log_path + '.bak-' + str(int(time.time())))
-        hdlr = logging.FileHandler(log_path)
+        if log_to.count("binary"):
+            hdlr = BinaryResultHandler(log_path)
+        else:
+            hdlr = XmlResultHandler(log_path)
+        if flush_interval:
+            hdlr = AsyncResultHandler(hdlr, queue_size, flush_interval)
         logger.addHandler(hdlr)
     logger.setLevel(level)
     return logger
@@ -218,10 +256,15 @@ def xmlrpc_list_credentials(host, port, group=None):
 # ------------------------------------------------------------
 # misc
 #
+_version = None
+
 def get_version():
     """Retrun the FunkLoad package version."""
-    from pkg_resources import get_distribution
-    return get_distribution('funkload').version
+    global _version
+    if _version is None:
+        from pkg_resources import get_distribution
+        _version = get_distribution('funkload').version
+    return _version
 
 
 _COLOR = {'green': "\x1b[32;01m",